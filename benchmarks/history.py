@@ -0,0 +1,250 @@
+"""
+Benchmark of chat history backends with synthetic conversations of 10k to 1M messages.
+
+Backends are the history trees of the file and sqlite backends, and the flat JSON file of FileChatMessageHistory
+that ChatHistory used before them as the baseline. For each backend and size the history is written, then measured:
+* load: opening the history and reading every message like the conversation view does on startup
+* peak memory: tracemalloc peak of the load, SQLite allocations outside of Python are not included
+* append: latency of adding a question and an answer
+* window: cost of the context window sent with a request, as in Chat._history_window, or trimming the history by
+  rewriting it as Chat._trim_history did with the flat file
+* size: files of the written history on disk
+
+Results are printed as a markdown table:
+    hatch run bench-history --sizes 10000 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Union
+
+from langchain_community.chat_message_histories import FileChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, message_to_dict
+
+from paita.llm.history_sqlite import SQLiteHistoryTree
+from paita.llm.history_tree import HistoryTree
+
+SIZES = (10_000, 100_000, 1_000_000)
+BATCH = 10_000
+APPENDS = 100
+WINDOWS = 100
+# Defaults of LLM Settings history depth and a typical history token budget
+WINDOW_LENGTH = 20
+WINDOW_TOKENS = 4000
+MB = 1024 * 1024
+
+# Appends and trims of the flat file read and rewrite the whole history, so they are measured only a few times
+LEGACY_APPENDS = 3
+
+VOCABULARY = (
+    "history branch window token answer question model stream render markdown append load memory context "
+    "session message paita textual langchain sqlite benchmark latency"
+)
+
+
+class Result(NamedTuple):
+    backend: str
+    messages: int
+    write: float
+    load: float
+    peak_memory: float
+    append_p50: float
+    append_p95: float
+    window: float
+    size: float
+
+
+def conversation(size: int, *, seed: int = 0) -> Iterator[BaseMessage]:
+    """Questions of 20-100 and answers of 100-500 characters, every message is unique"""
+    rng = random.Random(seed)  # noqa: S311
+    words = VOCABULARY.split()
+    text = " ".join(rng.choice(words) for _ in range(20_000))
+    for i in range(size):
+        if i % 2 == 0:
+            length = rng.randint(20, 100)
+            offset = rng.randrange(len(text) - length)
+            yield HumanMessage(content=f"{i}: {text[offset : offset + length]}")
+        else:
+            length = rng.randint(100, 500)
+            offset = rng.randrange(len(text) - length)
+            yield AIMessage(content=f"{i}: {text[offset : offset + length]}")
+
+
+def batches(messages: Iterator[BaseMessage]) -> Iterator[List[BaseMessage]]:
+    batch: List[BaseMessage] = []
+    for message in messages:
+        batch.append(message)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TreeBackend:
+    """History tree of the file or the sqlite backend"""
+
+    appends = APPENDS
+    windows = WINDOWS
+
+    def __init__(self, tree: Union[HistoryTree, SQLiteHistoryTree]):
+        self.tree: Union[HistoryTree, SQLiteHistoryTree] = tree
+
+    def write(self, messages: Iterable[BaseMessage]):
+        for batch in batches(messages):
+            self.tree.add(batch)
+
+    def load(self):
+        self.tree.messages().records()
+
+    def add(self, messages: List[BaseMessage]):
+        self.tree.add(messages)
+
+    def window(self):
+        self.tree.window(max_length=WINDOW_LENGTH, max_tokens=WINDOW_TOKENS)
+
+    def close(self):
+        if isinstance(self.tree, SQLiteHistoryTree):
+            self.tree.close()
+
+
+class LegacyBackend:
+    """
+    Flat JSON file of FileChatMessageHistory that ChatHistory used before history trees. Every message added reads
+    and rewrites the whole file, and the history was trimmed before each request by rewriting the file with the
+    latest messages. Trimming leaves only those messages, so it is measured once.
+    """
+
+    appends = LEGACY_APPENDS
+    windows = 1
+
+    def __init__(self, path: Path):
+        self.history: FileChatMessageHistory = FileChatMessageHistory(str(path))
+
+    def write(self, messages: Iterable[BaseMessage]):
+        # Written in one go like the file would be after a long conversation, adding messages would take hours
+        with open(self.history.file_path, "w", encoding="utf-8") as history_file:
+            history_file.write("[")
+            history_file.writelines(
+                (", " if i else "") + json.dumps(message_to_dict(message)) for i, message in enumerate(messages)
+            )
+            history_file.write("]")
+
+    def load(self):
+        self.history.messages  # noqa: B018
+
+    def add(self, messages: List[BaseMessage]):
+        self.history.add_messages(messages)
+
+    def window(self):
+        # Chat._trim_history of the flat file history
+        messages = self.history.messages
+        if len(messages) > WINDOW_LENGTH:
+            self.history.clear()
+            self.history.add_messages(messages[-WINDOW_LENGTH:])
+
+    def close(self):
+        pass
+
+
+Backend = Union[TreeBackend, LegacyBackend]
+
+BACKENDS: Dict[str, Callable[[Path], Backend]] = {
+    "legacy": lambda directory: LegacyBackend(directory / "chat_history"),
+    "file": lambda directory: TreeBackend(HistoryTree(directory / "chat_history.tree")),
+    "sqlite": lambda directory: TreeBackend(SQLiteHistoryTree(directory / "chat_history.sqlite", session="benchmark")),
+}
+
+
+def load(factory: Callable[[Path], Backend], directory: Path) -> Backend:
+    history = factory(directory)
+    history.load()
+    return history
+
+
+def measure(backend: str, size: int, directory: Path) -> Result:
+    factory = BACKENDS[backend]
+
+    started = time.perf_counter()
+    history = factory(directory)
+    history.write(conversation(size))
+    write = time.perf_counter() - started
+    history.close()
+    disk_size = sum(path.stat().st_size for path in directory.iterdir())
+
+    started = time.perf_counter()
+    load(factory, directory).close()
+    load_time = time.perf_counter() - started
+
+    tracemalloc.start()
+    history = load(factory, directory)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    appends = []
+    for i in range(history.appends):
+        messages = [HumanMessage(content=f"Question {i}"), AIMessage(content=f"Answer {i}")]
+        started = time.perf_counter()
+        history.add(messages)
+        appends.append(time.perf_counter() - started)
+
+    windows = []
+    for _ in range(history.windows):
+        started = time.perf_counter()
+        history.window()
+        windows.append(time.perf_counter() - started)
+    history.close()
+
+    return Result(
+        backend=backend,
+        messages=size,
+        write=write,
+        load=load_time,
+        peak_memory=peak_memory / MB,
+        append_p50=statistics.median(appends) * 1000,
+        append_p95=statistics.quantiles(appends, n=20)[-1] * 1000,
+        window=statistics.median(windows) * 1000,
+        size=disk_size / MB,
+    )
+
+
+def table(results: List[Result]) -> str:
+    lines = [
+        "| Backend | Messages | Write (s) | Load (s) | Peak memory (MB) | Append p50 (ms) | Append p95 (ms) "
+        "| Window (ms) | Size (MB) |",
+        "|---|---:|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    lines.extend(
+        f"| {r.backend} | {r.messages:,} | {r.write:.2f} | {r.load:.2f} | {r.peak_memory:.1f} | {r.append_p50:.2f} "
+        f"| {r.append_p95:.2f} | {r.window:.3f} | {r.size:.1f} |"
+        for r in results
+    )
+    return "\n".join(lines) + "\n"
+
+
+def main(args: Union[List[str], None] = None):
+    parser = argparse.ArgumentParser(description="Benchmark chat history backends")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), metavar="N", help="Numbers of messages")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parsed = parser.parse_args(args)
+
+    results = []
+    for size in parsed.sizes:
+        for backend in parsed.backends:
+            with tempfile.TemporaryDirectory() as directory:
+                results.append(measure(backend, size, Path(directory)))
+            sys.stderr.write(f"{backend} {size:,} messages done\n")
+    sys.stdout.write(table(results))
+
+
+if __name__ == "__main__":
+    main()
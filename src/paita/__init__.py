@@ -1,3 +1,7 @@
 # SPDX-FileCopyrightText: 2024-present Ville Kärkkäinen <ville.karkkainen@outlook.com>
 #
 # SPDX-License-Identifier: MIT
+import time
+
+# Reference point for measuring import time when profiling
+STARTED_AT = time.perf_counter()
@@ -1,6 +1,10 @@
+from typing import Any, Dict, Optional
+
 from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
 from langchain.schema.output import LLMResult
 
+from paita.llm.scheduler import RequestStats
+
 
 class SyncHandler(BaseCallbackHandler):
     callback_on_token = None
@@ -92,3 +96,73 @@ class AsyncHandler(AsyncCallbackHandler):
     ) -> None:
         # log.error(f"{error=} {run_id=} {parent_run_id=} {tags=}")
         self.callback_on_error(error)
+
+
+class HedgeGate:
+    """
+    HedgeGate decides which of the racing request attempts gets to deliver its output
+    """
+
+    def __init__(self):
+        self.winner: Optional[str] = None
+
+    def claim(self, name: str) -> bool:
+        if self.winner is None:
+            self.winner = name
+        return self.winner == name
+
+
+class GatedHandler(AsyncCallbackHandler):
+    """
+    GatedHandler forwards callbacks of a hedged request attempt only if the attempt has won the race
+    """
+
+    def __init__(self, handler: AsyncCallbackHandler, *, gate: HedgeGate, name: str):
+        self._handler: AsyncCallbackHandler = handler
+        self._gate: HedgeGate = gate
+        self._name: str = name
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self._gate.claim(self._name):
+            await self._handler.on_llm_new_token(token, **kwargs)
+
+    async def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        if self._gate.claim(self._name):
+            await self._handler.on_llm_end(response, **kwargs)
+
+    async def on_llm_error(self, error: BaseException, **kwargs) -> None:
+        if self._gate.winner == self._name:
+            await self._handler.on_llm_error(error, **kwargs)
+
+
+def token_usage(response: LLMResult) -> Dict[str, int]:
+    """
+    Token usage of a response with prompt cache reads and writes. Bedrock Converse usage and OpenAI token usage
+    are read from the metadata of the response as langchain usage metadata doesn't carry prompt cache counts.
+    """
+    generation = response.generations[0][0] if response.generations and response.generations[0] else None
+    message = getattr(generation, "message", None)
+    usage_metadata: Dict[str, Any] = getattr(message, "usage_metadata", None) or {}
+    response_metadata: Dict[str, Any] = getattr(message, "response_metadata", None) or {}
+    converse_usage = response_metadata.get("usage") or {}
+    openai_usage = response_metadata.get("token_usage") or (response.llm_output or {}).get("token_usage") or {}
+    prompt_details = openai_usage.get("prompt_tokens_details") or {}
+    return {
+        "input_tokens": usage_metadata.get("input_tokens", 0),
+        "output_tokens": usage_metadata.get("output_tokens", 0),
+        "cache_read_tokens": converse_usage.get("cacheReadInputTokens") or prompt_details.get("cached_tokens") or 0,
+        "cache_write_tokens": converse_usage.get("cacheWriteInputTokens") or 0,
+    }
+
+
+class UsageHandler(AsyncCallbackHandler):
+    """
+    UsageHandler records token usage of a request, including prompt cache hits, to the stats of the request
+    """
+
+    def __init__(self, stats: RequestStats):
+        self._stats: RequestStats = stats
+
+    async def on_llm_end(self, response: LLMResult, **kwargs) -> None:  # noqa: ARG002
+        for field, value in token_usage(response).items():
+            setattr(self._stats, field, value)
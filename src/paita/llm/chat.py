@@ -1,21 +1,37 @@
-from typing import TYPE_CHECKING
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.schema.output_parser import StrOutputParser
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
 
-from paita.llm.callbacks import AsyncHandler
-from paita.llm.chat_history import ChatHistory
+from paita.llm.callbacks import AsyncHandler, GatedHandler, HedgeGate, UsageHandler
 from paita.llm.models import AIService
-from paita.llm.services import bedrock, ollama, openai
-from paita.llm.services.service import LLMSettingsModel
+from paita.llm.scheduler import RequestStats, estimate_tokens, scheduler
+from paita.llm.services import bedrock, mock, ollama, openai
+from paita.utils.logger import log
 
 if TYPE_CHECKING:
+    from langchain.callbacks.base import AsyncCallbackHandler
     from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import BaseMessage
     from langchain_core.runnables import Runnable
 
+    from paita.llm.chat_history import ChatHistory
+    from paita.llm.model_info import ModelInfo
+    from paita.llm.services.service import LLMSettingsModel, Service
+
 
 HISTORY_FILE_NAME = "chat_history"
+DEFAULT_SESSION_ID = "default"
+PRIMARY = "primary"
+SECONDARY = "secondary"
+# Sent after the partial answer to models that don't continue an assistant message
+CONTINUE_INSTRUCTION = (
+    "Your previous answer was interrupted. Continue it exactly where it stopped, without repeating any of it."
+)
 
 
 class Chat:
@@ -27,31 +43,65 @@ class Chat:
         self._chat_model: BaseChatModel = None
         self._settings_model: LLMSettingsModel = None
         self._chat_history: ChatHistory = None
+        self._history_factory: Optional[Callable[[str], ChatHistory]] = None
         self._chain: Runnable = None
+        self._continuation_chain: Runnable = None
+        self._hedge_settings_model: Optional[LLMSettingsModel] = None
+        self._hedge_chain: Optional[Runnable] = None
         self._callback_handler: AsyncHandler = None
+        self.last_request_stats: Optional[RequestStats] = None
+        self.model_info: Optional[ModelInfo] = None
         self.parser: StrOutputParser = StrOutputParser()
 
     def init_model(
         self,
         *,
         settings_model: LLMSettingsModel,
-        chat_history: ChatHistory,
-        callback_handler: AsyncHandler,
+        chat_history: Optional[ChatHistory] = None,
+        history_factory: Optional[Callable[[str], ChatHistory]] = None,
+        callback_handler: Optional[AsyncHandler] = None,
+        model_info: Optional[ModelInfo] = None,
+        chat_model: Optional[BaseChatModel] = None,
     ):
+        """Initialize chat with AI Model of the settings, or with the given chat model e.g. to replay a recording"""
+        if chat_history is None and history_factory is None:
+            msg = "Either chat_history or history_factory is required"
+            raise ValueError(msg)
         self._settings_model = settings_model
         self._chat_history = chat_history
+        self._history_factory = history_factory
         self._callback_handler = callback_handler
+        self.model_info = model_info
+
+        service = self._create_service(settings_model) if chat_model is None else None
+        self._chat_model = chat_model if chat_model is not None else service.chat_model()
+        self._chain = self._create_chain(self._chat_model)
+        self._continuation_chain = self._create_continuation_chain(
+            self._chat_model, prefill=service is not None and service.assistant_prefill
+        )
+
+        self._hedge_settings_model = None
+        self._hedge_chain = None
+        if chat_model is None and settings_model.ai_hedge_service and settings_model.ai_hedge_model:
+            self._hedge_settings_model = settings_model.model_copy(
+                update={"ai_service": settings_model.ai_hedge_service, "ai_model": settings_model.ai_hedge_model}
+            )
+            self._hedge_chain = self._create_chain(self._create_service(self._hedge_settings_model).chat_model())
 
+    @classmethod
+    def _create_service(cls, settings_model: LLMSettingsModel) -> Service:
         if settings_model.ai_service == AIService.AWSBedRock.value:
-            service = bedrock.Bedrock(settings_model=settings_model, callback_handler=self._callback_handler)
-        elif settings_model.ai_service == AIService.OpenAI.value:
-            service = openai.OpenAI(settings_model=settings_model, callback_handler=self._callback_handler)
-        elif settings_model.ai_service == AIService.Ollama.value:
-            service = ollama.Ollama(settings_model=settings_model, callback_handler=self._callback_handler)
-        else:
-            msg = f"Invalid AI Service {settings_model.ai_service}"
-            raise ValueError(msg)
-        self._chat_model = service.chat_model()
+            return bedrock.Bedrock(settings_model=settings_model)
+        if settings_model.ai_service == AIService.OpenAI.value:
+            return openai.OpenAI(settings_model=settings_model)
+        if settings_model.ai_service == AIService.Ollama.value:
+            return ollama.Ollama(settings_model=settings_model)
+        if settings_model.ai_service == AIService.Mock.value:
+            return mock.Mock(settings_model=settings_model)
+        msg = f"Invalid AI Service {settings_model.ai_service}"
+        raise ValueError(msg)
+
+    def _create_chain(self, chat_model: BaseChatModel) -> Runnable:
         prompt = ChatPromptTemplate.from_messages(
             [
                 (
@@ -63,38 +113,331 @@ class Chat:
             ]
         )
 
-        chain = prompt | self._chat_model | self.parser
-        self._chain = RunnableWithMessageHistory(
-            chain,
-            lambda session_id: self._chat_history.history,  # noqa: ARG005
-            input_messages_key="input",
-            history_messages_key="chat_history",
-        )
+        # History window is given as input, and the answer is added to history by the caller once it is complete
+        return prompt | chat_model | self.parser
 
-    async def request(self, data: str):
-        await self._trim_history(self._chat_history, max_length=self._settings_model.ai_history_depth)
+    def _create_continuation_chain(self, chat_model: BaseChatModel, *, prefill: bool) -> Runnable:
+        # With prefill the partial answer is the last message so the model continues it instead of answering
+        # from scratch, other models are asked to continue it
+        messages = [
+            (
+                "system",
+                self._settings_model.ai_persona,
+            ),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}"),
+            ("ai", "{partial}"),
+        ]
+        if not prefill:
+            messages.append(("human", CONTINUE_INSTRUCTION))
+        prompt = ChatPromptTemplate.from_messages(messages)
+        return prompt | chat_model | self.parser
 
-        if self._settings_model.ai_streaming:
-            async for _ in self._chain.astream(
-                {"input": data},
-                {"configurable": {"session_id": "unused"}},
-            ):
-                pass
+    def session_history(self, session_id: str = DEFAULT_SESSION_ID) -> ChatHistory:
+        if self._history_factory is not None:
+            return self._history_factory(session_id)
+        return self._chat_history
+
+    async def request(self, data: str, *, session_id: str = DEFAULT_SESSION_ID):
+        async for _ in self.stream(data, session_id=session_id):
+            pass
+
+    async def stream(
+        self,
+        data: str,
+        *,
+        session_id: str = DEFAULT_SESSION_ID,
+        stats: Optional[RequestStats] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Send data to the model and yield the answer as it is generated.
+        Non-streaming models yield the whole answer as a single chunk.
+        Requests go through the scheduler which rate limits and retries throttled requests.
+        If hedging is configured the request is also sent to the secondary model when the primary model is slow
+        to answer or fails.
+        """
+        chat_history = self.session_history(session_id)
+        if await chat_history.recover():
+            log.info("Recovered interrupted answer to history")
+        tokens = estimate_tokens(self._settings_model.ai_persona or "") + estimate_tokens(data)
+        history_messages = self._history_window(
+            chat_history,
+            max_length=self._settings_model.ai_history_depth,
+            max_tokens=self._history_token_budget(tokens),
+            stable=bool(self._settings_model.ai_prompt_cache),
+        )
+        tokens += sum(estimate_tokens(str(message.content)) for message in history_messages)
+
+        stats = RequestStats() if stats is None else stats
+        self.last_request_stats = stats
+        inputs = {"chat_history": history_messages, "input": data}
+        if self._hedge_chain is None:
+            callbacks = [self._callback_handler] if self._callback_handler else []
+            chunks = self._scheduled_request(
+                self._chain,
+                self._settings_model,
+                inputs,
+                session_id,
+                tokens=tokens,
+                stats=stats,
+                callbacks=callbacks,
+            )
         else:
-            await self._chain.ainvoke(
-                {"input": data},
-                {"configurable": {"session_id": "unused"}},
+            chunks = self._hedged_request(inputs, session_id, tokens=tokens, stats=stats)
+
+        answer = []
+
+        async def add_to_history():
+            await chat_history.history.aadd_messages([HumanMessage(content=data), AIMessage(content="".join(answer))])
+
+        async for chunk in self._journaled(chat_history, chunks, question=data, on_complete=add_to_history):
+            answer.append(chunk)
+            yield chunk
+        self._estimate_cost(stats)
+        log.info(f"{stats=}")
+
+    async def resume(
+        self,
+        *,
+        session_id: str = DEFAULT_SESSION_ID,
+        stats: Optional[RequestStats] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Continue the interrupted answer of the session and yield only the missing part. Partial answer is sent
+        as an assistant prefix, followed by an instruction to continue it when the AI Service doesn't support
+        prefill. The whole answer is added to history once it is complete. If resuming fails the answer stays
+        resumable.
+        """
+        chat_history = self.session_history(session_id)
+        interrupted = chat_history.interrupted()
+        if interrupted is None:
+            msg = "No interrupted answer to resume"
+            raise ValueError(msg)
+        question, partial = interrupted
+
+        tokens = sum(estimate_tokens(text) for text in (self._settings_model.ai_persona or "", question, partial))
+        history_messages = self._history_window(
+            chat_history,
+            max_length=self._settings_model.ai_history_depth,
+            max_tokens=self._history_token_budget(tokens),
+            stable=bool(self._settings_model.ai_prompt_cache),
+        )
+        stats = RequestStats() if stats is None else stats
+        self.last_request_stats = stats
+        callbacks = [self._callback_handler] if self._callback_handler else []
+        inputs = {"chat_history": history_messages, "input": question, "partial": partial}
+        chunks = self._scheduled_request(
+            self._continuation_chain,
+            self._settings_model,
+            inputs,
+            session_id,
+            tokens=tokens,
+            stats=stats,
+            callbacks=callbacks,
+        )
+
+        answer = [partial]
+
+        async def add_to_history():
+            await chat_history.history.aadd_messages(
+                [HumanMessage(content=question), AIMessage(content="".join(answer))]
             )
 
+        async for chunk in self._journaled(chat_history, chunks, on_complete=add_to_history):
+            answer.append(chunk)
+            yield chunk
+        self._estimate_cost(stats)
+        log.info(f"{stats=}")
+
     @classmethod
-    async def _trim_history(cls, chat_history: ChatHistory, *, max_length: int = 20):
-        stored_messages = await chat_history.history.aget_messages()
-        if len(stored_messages) <= max_length:
+    async def _journaled(
+        cls,
+        chat_history: ChatHistory,
+        chunks: AsyncIterator[str],
+        *,
+        question: Optional[str] = None,
+        on_complete: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Write answer ahead to the journal while it streams, so that the partial answer survives errors and crashes.
+        New journal entry is started for a question, otherwise chunks continue the interrupted answer.
+        Journal is committed once the answer has been added to history.
+        """
+        journal = chat_history.journal
+        if journal is None:
+            async for chunk in chunks:
+                yield chunk
+            if on_complete is not None:
+                await on_complete()
+            return
+
+        if question is not None:
+            await journal.begin(question)
+        try:
+            async for chunk in chunks:
+                await journal.append(chunk)
+                yield chunk
+        except BaseException:
+            await asyncio.shield(journal.sync())
+            raise
+        if on_complete is not None:
+            await on_complete()
+        await journal.commit()
+
+    async def _scheduled_request(
+        self,
+        chain: Runnable,
+        settings_model: LLMSettingsModel,
+        inputs: Dict[str, Any],
+        session_id: str,
+        *,
+        tokens: int,
+        stats: RequestStats,
+        callbacks: List[AsyncCallbackHandler],
+    ) -> AsyncIterator[str]:
+        stats.served_by = f"{settings_model.ai_service}/{settings_model.ai_model}"
+        callbacks = [*callbacks, UsageHandler(stats)]
+        async for chunk in scheduler.stream(
+            (settings_model.ai_service, settings_model.ai_model),
+            lambda: self._request_chain(chain, inputs, session_id, callbacks),
+            tokens=tokens,
+            stats=stats,
+            requests_per_minute=settings_model.ai_requests_per_minute,
+            tokens_per_minute=settings_model.ai_tokens_per_minute,
+            max_retries=settings_model.ai_max_retries,
+        ):
+            yield chunk
+
+    async def _hedged_request(
+        self, inputs: Dict[str, Any], session_id: str, *, tokens: int, stats: RequestStats
+    ) -> AsyncIterator[str]:
+        """
+        Race primary and secondary models. Secondary request is sent if primary has not produced anything
+        within hedge delay, or primary fails. First attempt to produce output wins and the other is cancelled.
+        """
+        gate = HedgeGate()
+        attempts = {
+            PRIMARY: (self._chain, self._settings_model),
+            SECONDARY: (self._hedge_chain, self._hedge_settings_model),
+        }
+        attempt_stats = {name: RequestStats() for name in attempts}
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def run(name: str):
+            chain, settings_model = attempts[name]
+            callbacks = [GatedHandler(self._callback_handler, gate=gate, name=name)] if self._callback_handler else []
+            try:
+                async for chunk in self._scheduled_request(
+                    chain,
+                    settings_model,
+                    inputs,
+                    session_id,
+                    tokens=tokens,
+                    stats=attempt_stats[name],
+                    callbacks=callbacks,
+                ):
+                    await queue.put((name, chunk, None))
+            except Exception as e:  # noqa: BLE001
+                await queue.put((name, None, e))
+            else:
+                await queue.put((name, None, None))
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._settings_model.ai_hedge_delay
+        tasks = {PRIMARY: asyncio.create_task(run(PRIMARY))}
+        errors = {}
+        decided = False
+        try:
+            while True:
+                # Hedge delay applies only until an attempt has won, gaps between chunks of the winner don't count
+                hedging = SECONDARY not in tasks and not decided and gate.winner is None
+                timeout = max(0.0, deadline - loop.time()) if hedging else None
+                try:
+                    name, chunk, error = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    log.info(f"No answer within {self._settings_model.ai_hedge_delay}s, hedging to secondary model")
+                    tasks[SECONDARY] = asyncio.create_task(run(SECONDARY))
+                    continue
+
+                if gate.winner is None and error is not None:
+                    errors[name] = error
+                    if SECONDARY not in tasks:
+                        log.info(f"Primary model failed, failing over to secondary model: {error}")
+                        tasks[SECONDARY] = asyncio.create_task(run(SECONDARY))
+                    elif len(errors) == len(tasks):
+                        raise errors[PRIMARY]
+                    continue
+
+                gate.claim(name)
+                if not decided:
+                    decided = True
+                    for other, task in tasks.items():
+                        if other != gate.winner:
+                            task.cancel()
+                if name != gate.winner:
+                    continue
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            if gate.winner is not None:
+                for field, value in attempt_stats[gate.winner].model_dump().items():
+                    setattr(stats, field, value)
+                stats.hedged = SECONDARY in tasks
+
+    async def _request_chain(
+        self, chain: Runnable, inputs: Dict[str, Any], session_id: str, callbacks: List[AsyncCallbackHandler]
+    ) -> AsyncIterator[str]:
+        config = {"configurable": {"session_id": session_id}, "callbacks": callbacks}
+        if self._settings_model.ai_streaming:
+            async for chunk in chain.astream(inputs, config):
+                yield chunk
+        else:
+            yield await chain.ainvoke(inputs, config)
+
+    def _estimate_cost(self, stats: RequestStats):
+        """Cost of the request from the reported token usage when it was served by the model of model info"""
+        if self.model_info is None or stats.served_by != f"{self.model_info.ai_service}/{self.model_info.ai_model}":
             return
+        if stats.input_tokens or stats.output_tokens:
+            stats.cost = self.model_info.cost(input_tokens=stats.input_tokens, output_tokens=stats.output_tokens)
+
+    def _history_token_budget(self, request_tokens: int) -> Optional[int]:
+        """Tokens left for history in the context window after the request and the answer, None if not known"""
+        if self.model_info is None or not self.model_info.context_length:
+            return None
+        output_limits = [self._settings_model.ai_max_tokens, self.model_info.max_output_tokens]
+        output_tokens = min(limit for limit in output_limits if limit) if any(output_limits) else 0
+        return max(self.model_info.context_length - output_tokens - request_tokens, 0)
 
-        await chat_history.history.aclear()
-        trim_history_messages = stored_messages[-max_length:]
-        await chat_history.history.aadd_messages(trim_history_messages)
+    @classmethod
+    def _history_window(
+        cls,
+        chat_history: ChatHistory,
+        *,
+        max_length: int = 20,
+        max_tokens: Optional[int] = None,
+        stable: bool = False,
+    ) -> List[BaseMessage]:
+        """
+        Latest messages of history that fit in max_length messages and max_tokens tokens. Stored history is not
+        trimmed, so that earlier messages stay available to branches forked from them. Stable window only grows
+        between requests until it is moved forward by half of max_length at once, unless moving it would leave no
+        messages.
+        """
+        window = chat_history.tree.window(max_length=max_length, max_tokens=max_tokens)
+        if not stable or not window:
+            return window
+        # Start of window moves in steps of half the history depth, so that the prompt prefix stays the same and is
+        # read from the prompt cache until the window moves again
+        step = max(2, max_length // 4 * 2)
+        skip = -(chat_history.tree.length() - len(window)) % step
+        # Window cut short by the token budget is sent as is rather than emptied
+        return window[skip:] if skip < len(window) else window
 
     async def _summarize_messages(self, chat_history: ChatHistory, *, max_length: int = 20):
         stored_messages = chat_history.history.messages
@@ -1,39 +1,114 @@
-from typing import TYPE_CHECKING
+from __future__ import annotations
 
-from langchain_community.chat_message_histories import ChatMessageHistory, FileChatMessageHistory
-from langchain_core.chat_history import AIMessage, BaseChatMessageHistory
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
-from paita.llm.enums import Role
-from paita.llm.message import Message
+from langchain_community.chat_message_histories import FileChatMessageHistory
+from langchain_core.chat_history import AIMessage, BaseChatMessageHistory, HumanMessage
+
+from paita.llm.enums import HistoryBackend
+from paita.llm.history_sqlite import SQLiteHistoryTree
+from paita.llm.history_tree import HistoryTree, TreeChatMessageHistory
+from paita.llm.journal import AnswerJournal
 from paita.utils.config_dirs import compose_path
 
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from langchain_core.messages import BaseMessage
+
+    from paita.llm.message import MessageRecord
+
 
 HISTORY_FILE_NAME = "chat_history"
+JOURNAL_SUFFIX = ".journal"
+TREE_SUFFIX = ".tree"
+SQLITE_SUFFIX = ".sqlite"
+DEFAULT_SESSION = "default"
 
 
 class ChatHistory:
     """
-    ChatHistory is a factory for creating specific langchain ChatHistory instance
+    ChatHistory is a factory for creating specific langchain ChatHistory instance. Messages are kept in a
+    HistoryTree so that conversation can be forked and switched between branches. With the sqlite backend the tree
+    of every session is kept in one SQLite database that can be shared by concurrent paita processes.
     """
 
-    def __init__(self, *, app_name: str, app_author: str, file_history: bool = True):
-        file_path: Path = compose_path(HISTORY_FILE_NAME, app_name=app_name, app_author=app_author)
-        self.history: BaseChatMessageHistory = None
-        if file_history:
-            self.history = FileChatMessageHistory(str(file_path))
+    def __init__(
+        self,
+        *,
+        app_name: str,
+        app_author: str,
+        file_history: bool = True,
+        session_id: Optional[str] = None,
+        backend: str = HistoryBackend.file.value,
+    ):
+        file_name = f"{HISTORY_FILE_NAME}_{session_id}" if session_id else HISTORY_FILE_NAME
+        file_path: Path = compose_path(file_name, app_name=app_name, app_author=app_author)
+        self.backend: str = backend
+        # In-memory history has nothing to recover after a crash
+        self.journal: Optional[AnswerJournal] = None
+        if not file_history:
+            self.tree: Union[HistoryTree, SQLiteHistoryTree] = HistoryTree()
+        elif backend == HistoryBackend.sqlite.value:
+            database_path = file_path.with_name(HISTORY_FILE_NAME + SQLITE_SUFFIX)
+            self.tree = SQLiteHistoryTree(database_path, session=session_id or DEFAULT_SESSION)
+            if self.tree.created and (messages := _file_messages(file_path)):
+                # Current branch of the file history becomes the main branch of a new session
+                self.tree.add(messages)
         else:
-            self.history = ChatMessageHistory()
-
-    async def messages(self) -> [Message]:
-        # TODO: This conversion is quite unnecessary. Use Langchain classes directly.
-        lc_messages = await self.history.aget_messages()
-        messages: [Message] = []
-        for lc_message in lc_messages:
-            role = Role.question
-            if type(lc_message) is AIMessage:
-                role = Role.answer
-            messages.append(Message(content=lc_message.content, role=role))
-        return messages
+            self.tree = HistoryTree(file_path.with_name(file_path.name + TREE_SUFFIX))
+            if not self.tree.path.exists() and file_path.exists():
+                # History of earlier versions is a flat list, it becomes the main branch
+                self.tree.add(FileChatMessageHistory(str(file_path)).messages)
+        if file_history:
+            self.journal = AnswerJournal(file_path.with_name(file_path.name + JOURNAL_SUFFIX))
+        self.history: BaseChatMessageHistory = TreeChatMessageHistory(self.tree)
+
+    def interrupted(self) -> Optional[Tuple[str, str]]:
+        """Return question and partial answer of an interrupted request, None if there is nothing to resume"""
+        if self.journal is None:
+            return None
+        interrupted = self.journal.recover()
+        if interrupted is None or not interrupted[1]:
+            return None
+        return interrupted
+
+    async def clear(self):
+        await self.history.aclear()
+        if self.journal is not None:
+            await self.journal.commit()
+
+    async def recover(self) -> bool:
+        """
+        Move answer of an interrupted request from the journal to history. Returns True if an answer was recovered.
+        """
+        if self.journal is None:
+            return False
+        interrupted = self.journal.recover()
+        if interrupted is None:
+            return False
+        question, answer = interrupted
+        if answer:
+            await self.history.aadd_messages(
+                [HumanMessage(content=question), AIMessage(content=answer, response_metadata={"partial": True})]
+            )
+        await self.journal.commit()
+        return bool(answer)
+
+    async def messages(self) -> List[MessageRecord]:
+        # Records are read straight from the tree without building langchain messages
+        return self.tree.messages().records()
+
+    def close(self):
+        """Close the database connection of the SQLite backend, file backend has nothing open"""
+        if isinstance(self.tree, SQLiteHistoryTree):
+            self.tree.close()
+
+
+def _file_messages(file_path: Path) -> List[BaseMessage]:
+    tree_path = file_path.with_name(file_path.name + TREE_SUFFIX)
+    if tree_path.exists():
+        return list(HistoryTree(tree_path).messages())
+    if file_path.exists():
+        return FileChatMessageHistory(str(file_path)).messages
+    return []
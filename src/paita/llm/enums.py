@@ -5,14 +5,29 @@ class AIService(Enum):
     AWSBedRock = "AWS Bedrock"
     OpenAI = "OpenAI"
     Ollama = "Ollama"
+    Mock = "Mock"
 
 
 class Tag(Enum):
     AI_SERVICE = "ai_services"
     AI_MODELS = "ai_models"
+    MODEL_INFO = "model_info"
+    MARKDOWN_TOKENS = "markdown_tokens"
 
 
 class Role(Enum):
     question = "question"
     answer = "answer"
     info = "info"
+
+
+class HistoryBackend(Enum):
+    file = "file"
+    sqlite = "sqlite"
+
+
+class ModelLoadState(Enum):
+    unloaded = "unloaded"
+    loading = "loading"
+    loaded = "loaded"
+    failed = "failed"
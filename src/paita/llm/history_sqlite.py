@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, message_to_dict
+
+from paita.llm.history_tree import (
+    MAIN_BRANCH,
+    Branch,
+    HistoryView,
+    build_message,
+    build_record,
+    next_branch_name,
+    node_id,
+    split_message,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from paita.llm.message import MessageRecord
+
+# Seconds to wait for a write lock held by another process
+BUSY_TIMEOUT = 10.0
+# Node ids per query when messages are read in bulk, well below the SQLite variable limit
+QUERY_CHUNK = 500
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS nodes (
+        id INTEGER PRIMARY KEY,
+        hash BLOB NOT NULL UNIQUE,
+        parent INTEGER REFERENCES nodes (id),
+        depth INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL,
+        extras TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS branches (
+        session TEXT NOT NULL,
+        name TEXT NOT NULL,
+        tip INTEGER REFERENCES nodes (id),
+        PRIMARY KEY (session, name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session TEXT PRIMARY KEY,
+        branch TEXT NOT NULL
+    )
+    """,
+)
+
+# Ancestors of the tip node deeper than the given depth, walked by primary key
+PATH_QUERY = """
+    WITH RECURSIVE path (id, parent, depth) AS (
+        SELECT id, parent, depth FROM nodes WHERE id = ? AND depth > ?
+        UNION ALL
+        SELECT nodes.id, nodes.parent, nodes.depth FROM nodes JOIN path ON nodes.id = path.parent
+        WHERE nodes.depth > ?
+    )
+    SELECT {columns} FROM path JOIN nodes ON nodes.id = path.id ORDER BY path.depth
+"""
+HEAD_QUERY = """
+    SELECT branches.tip, nodes.hash, nodes.depth FROM branches LEFT JOIN nodes ON nodes.id = branches.tip
+    WHERE branches.session = ? AND branches.name = ?
+"""
+UPSERT_BRANCH = """
+    INSERT INTO branches (session, name, tip) VALUES (?, ?, ?)
+    ON CONFLICT (session, name) DO UPDATE SET tip = excluded.tip
+"""
+UPSERT_SESSION = """
+    INSERT INTO sessions (session, branch) VALUES (?, ?)
+    ON CONFLICT (session) DO UPDATE SET branch = excluded.branch
+"""
+
+
+def _extras(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    return json.loads(value) if value else None
+
+
+class SQLiteHistoryTree:
+    """
+    HistoryTree stored in a SQLite database in WAL mode, so that several paita processes can read and write the
+    same history at once. Branch tips are always read from the database and appends are inserts in short write
+    transactions, so processes never overwrite each other's messages. One database holds the trees of all
+    sessions, messages are read by node id and only the part of history that is viewed.
+    """
+
+    def __init__(self, path: Path, *, session: str):
+        self.path: Path = path
+        self.session: str = session
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Connection is shared with the executor threads of langchain async methods
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(path), timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT OR IGNORE INTO branches (session, name, tip) VALUES (?, ?, NULL)", (session, MAIN_BRANCH)
+            )
+            # True when the session was not in the database before
+            self.created: bool = cursor.rowcount == 1
+            row = cursor.execute("SELECT branch FROM sessions WHERE session = ?", (session,)).fetchone()
+        self.branch: str = row[0] if row else MAIN_BRANCH
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM nodes")[0][0]
+
+    @property
+    def tip(self) -> Optional[str]:
+        with self._lock:
+            _, node_hash, _ = self._head(self._connection, self.branch)
+        return node_hash
+
+    def length(self, branch: Optional[str] = None) -> int:
+        """Number of messages in the branch"""
+        with self._lock:
+            _, _, depth = self._head(self._connection, branch if branch is not None else self.branch)
+        return depth
+
+    def messages(self, branch: Optional[str] = None) -> HistoryView:
+        with self._lock:
+            tip, _, _ = self._head(self._connection, branch if branch is not None else self.branch)
+            nodes = self._path(self._connection, tip, 0, "path.id")
+        return HistoryView(self, [node for (node,) in nodes])
+
+    def window(self, *, max_length: int, max_tokens: Optional[int] = None) -> List[BaseMessage]:
+        """
+        Latest messages of the current branch that fit in max_length messages and max_tokens tokens. Only the
+        messages in the window are read.
+        """
+        if max_length <= 0:
+            return []
+        with self._lock:
+            tip, _, depth = self._head(self._connection, self.branch)
+            rows = self._path(self._connection, tip, depth - max_length, "type, content, tokens, extras")
+        window = []
+        tokens = 0
+        for type_name, content, message_tokens, extras in reversed(rows):
+            tokens += message_tokens
+            if max_tokens is not None and tokens > max_tokens:
+                break
+            window.append(build_message(type_name, content, _extras(extras)))
+        window.reverse()
+        return window
+
+    def message(self, node: int) -> BaseMessage:
+        type_name, content, extras = self._query("SELECT type, content, extras FROM nodes WHERE id = ?", (node,))[0]
+        return build_message(type_name, content, _extras(extras))
+
+    def records(self, nodes: Sequence[int]) -> List[MessageRecord]:
+        rows: Dict[int, Tuple[str, str, Optional[str]]] = {}
+        for start in range(0, len(nodes), QUERY_CHUNK):
+            chunk = list(nodes[start : start + QUERY_CHUNK])
+            placeholders = ", ".join("?" * len(chunk))
+            query = f"SELECT id, type, content, extras FROM nodes WHERE id IN ({placeholders})"  # noqa: S608
+            rows.update((node, row) for node, *row in self._query(query, chunk))
+        return [build_record(rows[node][0], rows[node][1], _extras(rows[node][2])) for node in nodes]
+
+    def add(self, messages: Sequence[BaseMessage]):
+        """
+        Append messages to the current branch as it is in the database, so appends of other processes are kept.
+        Nodes that already exist are shared, not stored again.
+        """
+        with self._transaction() as cursor:
+            tip, parent, depth = self._head(cursor, self.branch)
+            for message in messages:
+                message_data = message_to_dict(message)
+                child = node_id(parent, message_data)
+                key = bytes.fromhex(child)
+                row = cursor.execute("SELECT id FROM nodes WHERE hash = ?", (key,)).fetchone()
+                if row is None:
+                    type_name, content, tokens, extras = split_message(message_data)
+                    cursor.execute(
+                        "INSERT INTO nodes (hash, parent, depth, type, content, tokens, extras) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (key, tip, depth + 1, type_name, content, tokens, json.dumps(extras) if extras else None),
+                    )
+                    tip = cursor.lastrowid
+                else:
+                    tip = row[0]
+                parent = child
+                depth += 1
+            cursor.execute(UPSERT_BRANCH, (self.session, self.branch, tip))
+
+    def reset(self):
+        """Empty the current branch, nodes shared with other branches are kept"""
+        with self._transaction() as cursor:
+            cursor.execute(UPSERT_BRANCH, (self.session, self.branch, None))
+
+    def fork(self, *, length: int, name: Optional[str] = None) -> str:
+        """
+        Start a new branch from the first length messages of the current branch and switch to it.
+        Returns name of the new branch.
+        """
+        with self._transaction() as cursor:
+            tip, _, depth = self._head(cursor, self.branch)
+            if not 0 <= length <= depth:
+                msg = f"Cannot fork at {length}, branch {self.branch} has {depth} messages"
+                raise ValueError(msg)
+            names = {row[0] for row in cursor.execute("SELECT name FROM branches WHERE session = ?", (self.session,))}
+            name = name if name is not None else next_branch_name(names)
+            if name in names:
+                msg = f"Branch {name} already exists"
+                raise ValueError(msg)
+            # First node of the path deeper than length - 1 is the node at length
+            nodes = self._path(cursor, tip, length - 1, "path.id") if length else []
+            cursor.execute(UPSERT_BRANCH, (self.session, name, nodes[0][0] if nodes else None))
+            cursor.execute(UPSERT_SESSION, (self.session, name))
+        self.branch = name
+        return name
+
+    def switch(self, name: str):
+        with self._transaction() as cursor:
+            row = cursor.execute(
+                "SELECT 1 FROM branches WHERE session = ? AND name = ?", (self.session, name)
+            ).fetchone()
+            if row is None:
+                msg = f"Unknown branch {name}"
+                raise ValueError(msg)
+            cursor.execute(UPSERT_SESSION, (self.session, name))
+        self.branch = name
+
+    def branches(self) -> List[Branch]:
+        rows = self._query(
+            "SELECT branches.name, nodes.hash, nodes.depth FROM branches LEFT JOIN nodes ON nodes.id = branches.tip "
+            "WHERE branches.session = ? ORDER BY branches.rowid",
+            (self.session,),
+        )
+        return [Branch(name, node_hash.hex() if node_hash else None, depth or 0) for name, node_hash, depth in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        # Write lock is taken up front so that reads of the transaction see the latest commit
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def _query(self, query: str, parameters: Sequence[Any] = ()) -> List[Tuple]:
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def _head(self, executor: Any, branch: str) -> Tuple[Optional[int], Optional[str], int]:
+        row = executor.execute(HEAD_QUERY, (self.session, branch)).fetchone()
+        if row is None:
+            msg = f"Unknown branch {branch}"
+            raise ValueError(msg)
+        tip, node_hash, depth = row
+        return tip, node_hash.hex() if node_hash else None, depth or 0
+
+    @staticmethod
+    def _path(executor: Any, tip: Optional[int], depth: int, columns: str) -> List[Tuple]:
+        if tip is None:
+            return []
+        return executor.execute(PATH_QUERY.format(columns=columns), (tip, depth, depth)).fetchall()
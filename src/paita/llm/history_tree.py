@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from array import array
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from paita.llm.enums import Role
+from paita.llm.message import MessageRecord
+from paita.llm.scheduler import estimate_tokens
+from paita.utils.logger import log
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from paita.llm.history_sqlite import SQLiteHistoryTree
+
+MAIN_BRANCH = "main"
+BRANCH_PREFIX = "branch-"
+
+NODE = "node"
+BRANCH = "branch"
+CURRENT = "current"
+
+# Node index of an empty branch
+EMPTY = -1
+MESSAGE_TYPES = ("human", "ai", "system")
+AI_TYPE = "ai"
+
+
+class Branch(NamedTuple):
+    name: str
+    tip: Optional[str]
+    length: int
+
+
+def node_id(parent: Optional[str], message_data: Dict) -> str:
+    payload = json.dumps([parent, message_data], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _is_default(value: Any) -> bool:
+    return value is None or value is False or (isinstance(value, (dict, list)) and not value)
+
+
+def split_message(message_data: Dict[str, Any]) -> Tuple[str, str, int, Dict[str, Any]]:
+    """
+    Split a serialized message to type, text content, token estimate and the rare fields that differ from
+    defaults. Content that is not plain text is kept in the extras.
+    """
+    data = message_data["data"]
+    content = data.get("content", "")
+    extras = {key: value for key, value in data.items() if key not in ("content", "type") and not _is_default(value)}
+    if not isinstance(content, str):
+        extras["content"] = content
+    return message_data["type"], content if isinstance(content, str) else "", estimate_tokens(str(content)), extras
+
+
+def build_message(type_name: str, content: str, extras: Optional[Dict[str, Any]]) -> BaseMessage:
+    data = {"content": content}
+    data.update(extras or {})
+    return messages_from_dict([{"type": type_name, "data": data}])[0]
+
+
+def build_record(type_name: str, content: str, extras: Optional[Dict[str, Any]]) -> MessageRecord:
+    role = Role.answer if type_name == AI_TYPE else Role.question
+    return MessageRecord(extras["content"] if extras and "content" in extras else content, role)
+
+
+def next_branch_name(names: Collection[str]) -> str:
+    number = len(names)
+    while f"{BRANCH_PREFIX}{number}" in names:
+        number += 1
+    return f"{BRANCH_PREFIX}{number}"
+
+
+class HistoryTree:
+    """
+    Chat messages stored as a tree of content-addressed nodes. Node id is the hash of the message and its parent,
+    so shared prefixes of branches are stored once. Branch is just a pointer to its tip node, which makes forking
+    O(1) in time and storage. Tree is persisted as an append-only JSON lines log of nodes and branch moves.
+
+    Nodes are kept in parallel arrays of parent index, depth, type code, content offset and token count, with
+    contents in a single UTF-8 buffer. Fields other than type and content are rare and kept aside. Langchain
+    messages are built only for the part of history that is viewed.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path: Optional[Path] = path
+        self._ids: List[bytes] = []
+        self._index: Dict[bytes, int] = {}
+        self._parents: array = array("l")
+        self._depths: array = array("L")
+        self._types: bytearray = bytearray()
+        self._type_names: List[str] = list(MESSAGE_TYPES)
+        self._offsets: array = array("Q", [0])
+        self._text: bytearray = bytearray()
+        self._tokens: array = array("L")
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        self._branches: Dict[str, int] = {MAIN_BRANCH: EMPTY}
+        self.branch: str = MAIN_BRANCH
+        if path is not None and path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def tip(self) -> Optional[str]:
+        return self._id(self._branches[self.branch])
+
+    def length(self, branch: Optional[str] = None) -> int:
+        """Number of messages in the branch"""
+        tip = self._branches[branch if branch is not None else self.branch]
+        return self._depths[tip] if tip != EMPTY else 0
+
+    def messages(self, branch: Optional[str] = None) -> HistoryView:
+        return HistoryView(self, self._path(self._branches[branch if branch is not None else self.branch]))
+
+    def window(self, *, max_length: int, max_tokens: Optional[int] = None) -> List[BaseMessage]:
+        """
+        Latest messages of the current branch that fit in max_length messages and max_tokens tokens. Only the
+        messages in the window are walked and built.
+        """
+        nodes = []
+        tokens = 0
+        node = self._branches[self.branch]
+        while node != EMPTY and len(nodes) < max_length:
+            tokens += self._tokens[node]
+            if max_tokens is not None and tokens > max_tokens:
+                break
+            nodes.append(node)
+            node = self._parents[node]
+        nodes.reverse()
+        return [self.message(node) for node in nodes]
+
+    def message(self, node: int) -> BaseMessage:
+        return build_message(self._type_names[self._types[node]], self._content(node), self._extras.get(node))
+
+    def records(self, nodes: Sequence[int]) -> List[MessageRecord]:
+        return [
+            build_record(self._type_names[self._types[node]], self._content(node), self._extras.get(node))
+            for node in nodes
+        ]
+
+    def add(self, messages: Sequence[BaseMessage]):
+        """Append messages to the current branch. Nodes that already exist are shared, not stored again."""
+        records = []
+        tip = self._branches[self.branch]
+        for message in messages:
+            message_data = message_to_dict(message)
+            parent = self._id(tip)
+            child = node_id(parent, message_data)
+            node = self._index.get(bytes.fromhex(child))
+            if node is None:
+                node = self._append_node(child, tip, message_data)
+                records.append({"type": NODE, "id": child, "parent": parent, "message": message_data})
+            tip = node
+        self._branches[self.branch] = tip
+        records.append({"type": BRANCH, "name": self.branch, "tip": self._id(tip)})
+        self._append(records)
+
+    def reset(self):
+        """Empty the current branch, nodes shared with other branches are kept"""
+        self._branches[self.branch] = EMPTY
+        self._append([{"type": BRANCH, "name": self.branch, "tip": None}])
+
+    def fork(self, *, length: int, name: Optional[str] = None) -> str:
+        """
+        Start a new branch from the first length messages of the current branch and switch to it.
+        Returns name of the new branch.
+        """
+        if not 0 <= length <= self.length():
+            msg = f"Cannot fork at {length}, branch {self.branch} has {self.length()} messages"
+            raise ValueError(msg)
+        name = name if name is not None else next_branch_name(self._branches)
+        if name in self._branches:
+            msg = f"Branch {name} already exists"
+            raise ValueError(msg)
+        tip = self._branches[self.branch]
+        for _ in range(self.length() - length):
+            tip = self._parents[tip]
+        self._branches[name] = tip
+        self.branch = name
+        self._append([{"type": BRANCH, "name": name, "tip": self._id(tip)}, {"type": CURRENT, "name": name}])
+        return name
+
+    def switch(self, name: str):
+        if name not in self._branches:
+            msg = f"Unknown branch {name}"
+            raise ValueError(msg)
+        self.branch = name
+        self._append([{"type": CURRENT, "name": name}])
+
+    def branches(self) -> List[Branch]:
+        return [Branch(name, self._id(tip), self.length(name)) for name, tip in self._branches.items()]
+
+    def _id(self, node: int) -> Optional[str]:
+        return self._ids[node].hex() if node != EMPTY else None
+
+    def _content(self, node: int) -> str:
+        return self._text[self._offsets[node] : self._offsets[node + 1]].decode("utf-8")
+
+    def _path(self, tip: int) -> array:
+        nodes = array("l")
+        while tip != EMPTY:
+            nodes.append(tip)
+            tip = self._parents[tip]
+        nodes.reverse()
+        return nodes
+
+    def _append_node(self, node_hash: str, parent: int, message_data: Dict[str, Any]) -> int:
+        node = len(self._ids)
+        key = bytes.fromhex(node_hash)
+        self._ids.append(key)
+        self._index[key] = node
+        self._parents.append(parent)
+        self._depths.append(self._depths[parent] + 1 if parent != EMPTY else 1)
+
+        type_name, content, tokens, extras = split_message(message_data)
+        if type_name not in self._type_names:
+            self._type_names.append(type_name)
+        self._types.append(self._type_names.index(type_name))
+        self._text += content.encode("utf-8")
+        self._offsets.append(len(self._text))
+        self._tokens.append(tokens)
+        if extras:
+            self._extras[node] = extras
+        return node
+
+    def _append(self, records: List[Dict]):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as tree_file:
+            tree_file.writelines(json.dumps(record) + "\n" for record in records)
+
+    def _node(self, node_hash: Optional[str]) -> int:
+        return self._index[bytes.fromhex(node_hash)] if node_hash is not None else EMPTY
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as tree_file:
+            for line in tree_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line may be torn by a crash in the middle of a write
+                    log.info(f"Skipping invalid history record in {self.path}")
+                    continue
+                if record["type"] == NODE:
+                    self._append_node(record["id"], self._node(record["parent"]), record["message"])
+                elif record["type"] == BRANCH:
+                    self._branches[record["name"]] = self._node(record["tip"])
+                elif record["type"] == CURRENT:
+                    self.branch = record["name"]
+
+
+class HistoryView(Sequence[BaseMessage]):
+    """
+    Read-only view of the messages of a branch. Langchain messages are built on access.
+    """
+
+    def __init__(self, tree: Union[HistoryTree, SQLiteHistoryTree], nodes: Sequence[int]):
+        self._tree: Union[HistoryTree, SQLiteHistoryTree] = tree
+        self._nodes: Sequence[int] = nodes
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @overload
+    def __getitem__(self, index: int) -> BaseMessage: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> HistoryView: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[BaseMessage, HistoryView]:
+        if isinstance(index, slice):
+            return HistoryView(self._tree, self._nodes[index])
+        return self._tree.message(self._nodes[index])
+
+    def __iter__(self) -> Iterator[BaseMessage]:
+        return (self._tree.message(node) for node in self._nodes)
+
+    def records(self) -> List[MessageRecord]:
+        return self._tree.records(self._nodes)
+
+
+class TreeChatMessageHistory(BaseChatMessageHistory):
+    """
+    Langchain chat message history of the current branch of a HistoryTree or SQLiteHistoryTree
+    """
+
+    def __init__(self, tree: Union[HistoryTree, SQLiteHistoryTree]):
+        self.tree: Union[HistoryTree, SQLiteHistoryTree] = tree
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return list(self.tree.messages())
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.tree.add(messages)
+
+    def clear(self) -> None:
+        self.tree.reset()
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+
+from paita.utils.logger import log
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+BEGIN = "begin"
+CHUNK = "chunk"
+
+
+class AnswerJournal:
+    """
+    Write-ahead journal of the answer being streamed. Question and answer chunks are appended as JSON lines and
+    synced to disk in batches. Journal is truncated once the answer is committed to history, so anything left in it
+    is an answer that was interrupted by an error or a crash.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        sync_interval: float = 1.0,
+        sync_bytes: int = 8192,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.path: Path = path
+        self.sync_interval: float = sync_interval
+        self.sync_bytes: int = sync_bytes
+        self._clock = clock
+        self._pending: List[str] = []
+        self._pending_bytes: int = 0
+        self._synced_at: float = clock()
+
+    async def begin(self, question: str):
+        self._pending = []
+        self._pending_bytes = 0
+        await self._write([_record(BEGIN, question)], truncate=True)
+
+    async def append(self, chunk: str):
+        record = _record(CHUNK, chunk)
+        self._pending.append(record)
+        self._pending_bytes += len(record)
+        if self._pending_bytes >= self.sync_bytes or self._clock() - self._synced_at >= self.sync_interval:
+            await self.sync()
+
+    async def sync(self):
+        if not self._pending:
+            return
+        records, self._pending, self._pending_bytes = self._pending, [], 0
+        await self._write(records)
+
+    async def commit(self):
+        self._pending = []
+        self._pending_bytes = 0
+        await self._write([], truncate=True)
+
+    async def _write(self, records: List[str], *, truncate: bool = False):
+        # fsync blocks, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_and_sync, records, truncate)
+        self._synced_at = self._clock()
+
+    def _write_and_sync(self, records: List[str], truncate: bool):  # noqa: FBT001
+        with open(self.path, "w" if truncate else "a", encoding="utf-8") as journal_file:
+            journal_file.writelines(records)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def recover(self) -> Optional[Tuple[str, str]]:
+        """Return question and partial answer of an interrupted answer, None if there is none"""
+        try:
+            with open(self.path, encoding="utf-8") as journal_file:
+                lines = journal_file.readlines()
+        except FileNotFoundError:
+            return None
+
+        question: Optional[str] = None
+        chunks: List[str] = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line may be torn by a crash in the middle of a write
+                log.info(f"Skipping invalid journal record in {self.path}")
+                continue
+            if record["type"] == BEGIN:
+                question, chunks = record["text"], []
+            elif record["type"] == CHUNK:
+                chunks.append(record["text"])
+        if question is None:
+            return None
+        return question, "".join(chunks)
+
+
+def _record(record_type: str, text: str) -> str:
+    return json.dumps({"type": record_type, "text": text}) + "\n"
@@ -1,4 +1,4 @@
-from typing import Dict, List, Union
+from typing import Any, Dict, List, Union
 
 from pydantic import BaseModel
 
@@ -8,3 +8,19 @@ from paita.llm.enums import Role
 class Message(BaseModel):
     content: Union[str, List[Union[str, Dict]]]
     role: Role
+
+
+class MessageRecord:
+    """
+    Lightweight message of history for display. Message validates its fields, records are built in bulk from
+    the history store and are cheaper per instance.
+    """
+
+    __slots__ = ("content", "role")
+
+    def __init__(self, content: Union[str, List[Union[str, Dict]]], role: Role):
+        self.content: Union[str, List[Union[str, Dict]]] = content
+        self.role: Role = role
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"content": self.content, "role": self.role.value}
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from paita.llm.enums import Tag
+from paita.llm.model_info import ModelInfo, bundled_model_info
+from paita.llm.models import get_model_info
+from paita.utils.cache import CacheNamespace, TieredCache, get_cache
+from paita.utils.logger import log
+
+
+class ModelCatalog:
+    """
+    ModelCatalog combines capabilities reported by AI Services (e.g. Bedrock model details, Ollama show) with
+    the bundled catalog. Results are cached next to the model lists.
+    """
+
+    CACHE_TTL = 24 * 60 * 60
+
+    def __init__(self, cache: Optional[TieredCache] = None):
+        cache = cache if cache else get_cache()
+        self._infos: CacheNamespace = cache.namespace(Tag.MODEL_INFO.value, ttl=self.CACHE_TTL, max_memory_items=64)
+
+    async def get(self, *, ai_service: str, ai_model: str) -> ModelInfo:
+        key = f"{ai_service}/{ai_model}"
+        cached = self._infos.get(key)
+        if cached is not None:
+            return ModelInfo.model_validate(cached)
+
+        info = bundled_model_info(ai_service=ai_service, ai_model=ai_model)
+        try:
+            info = info.merge(await get_model_info(ai_service=ai_service, ai_model=ai_model))
+        except Exception as e:  # noqa: BLE001
+            # Bundled values are still useful, but don't cache them so that the AI Service is asked again next time
+            log.info(f"Model info for {key} not available: {e}")
+            return info
+        self._infos.set(key, info.model_dump())
+        return info
+
+
+_catalog: Optional[ModelCatalog] = None
+
+
+def get_catalog() -> ModelCatalog:
+    global _catalog  # noqa: PLW0603
+    if _catalog is None:
+        _catalog = ModelCatalog()
+    return _catalog
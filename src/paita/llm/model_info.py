@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from pathlib import PurePath
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+from paita.llm.enums import AIService
+
+CATALOG_PATH = PurePath(__file__).parent / "model_catalog.json"
+TOKENS_PER_PRICE_UNIT = 1_000_000
+# Cross-region inference profiles e.g. "us.anthropic.claude-3-haiku-20240307-v1:0"
+BEDROCK_REGION_PREFIXES = ("us.", "eu.", "apac.")
+
+
+class ModelInfo(BaseModel):
+    """
+    Capabilities of an AI Model. Unknown values are None. Prices are in USD per million tokens.
+    """
+
+    model_config = ConfigDict(protected_namespaces=())
+
+    ai_service: str
+    ai_model: str
+    context_length: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    streaming: Optional[bool] = None
+    input_price: Optional[float] = None
+    output_price: Optional[float] = None
+
+    def merge(self, other: Optional[ModelInfo]) -> ModelInfo:
+        """Return copy where values known by other override values of self"""
+        if other is None:
+            return self
+        return self.model_copy(update=other.model_dump(exclude_none=True, exclude={"ai_service", "ai_model"}))
+
+    def cost(self, *, input_tokens: int, output_tokens: int) -> Optional[float]:
+        if self.input_price is None or self.output_price is None:
+            return None
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / TOKENS_PER_PRICE_UNIT
+
+    def summary(self) -> str:
+        parts = []
+        if self.context_length:
+            parts.append(f"context {self.context_length:,}")
+        if self.max_output_tokens:
+            parts.append(f"max output {self.max_output_tokens:,}")
+        if self.streaming is False:
+            parts.append("no streaming")
+        if self.input_price == self.output_price == 0:
+            parts.append("no token cost")
+        elif self.input_price is not None and self.output_price is not None:
+            parts.append(f"${self.input_price:g}/${self.output_price:g} per 1M tokens")
+        return ", ".join(parts)
+
+
+@lru_cache(maxsize=None)
+def _catalog() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    with open(CATALOG_PATH, encoding="utf-8") as catalog_file:
+        return json.load(catalog_file)
+
+
+def bundled_model_info(*, ai_service: str, ai_model: str) -> ModelInfo:
+    """
+    Look up model from the bundled catalog. Catalog keys are model id prefixes and the longest matching prefix wins,
+    so that versioned ids e.g. "gpt-4o-mini-2024-07-18" or "llama3.1:8b" match their model family.
+    """
+    model_id = ai_model
+    if ai_service == AIService.AWSBedRock.value:
+        for prefix in BEDROCK_REGION_PREFIXES:
+            if model_id.startswith(prefix):
+                model_id = model_id[len(prefix) :]
+                break
+    entries = _catalog().get(ai_service, {})
+    matches = [prefix for prefix in entries if model_id.startswith(prefix)]
+    info = ModelInfo(ai_service=ai_service, ai_model=ai_model)
+    if ai_service == AIService.Ollama.value:
+        # Local models
+        info = info.model_copy(update={"input_price": 0.0, "output_price": 0.0})
+    if matches:
+        info = info.model_copy(update=entries[max(matches, key=len)])
+    return info
@@ -1,8 +1,10 @@
 import asyncio
 from typing import Dict, List, Optional
 
-from paita.llm.enums import AIService
-from paita.llm.services import bedrock, ollama, openai
+from paita.llm.enums import AIService, ModelLoadState
+from paita.llm.model_info import ModelInfo
+from paita.llm.services import bedrock, mock, ollama, openai
+from paita.llm.services.bedrock_transport import close_transports
 from paita.utils.logger import log
 
 
@@ -13,11 +15,8 @@ async def list_models(ai_service: str):
         return await openai.OpenAI.models()
     if ai_service == AIService.Ollama.value:
         return await ollama.Ollama.models()
-    # if ai_service == AIService.Mock:
-    #     return [
-    #         "mock_model_1",
-    #         "mock_model_2"
-    #     ]
+    if ai_service == AIService.Mock.value:
+        return await mock.Mock.models()
     msg = f"Invalid value for {ai_service=}"
     raise ValueError(msg)
 
@@ -29,15 +28,39 @@ def get_embeddings(*, ai_service: str, ai_model: Optional[str] = None):
         return openai.OpenAI.embeddings(ai_model)
     if ai_service == AIService.Ollama.value:
         return ollama.Ollama.embeddings(ai_model)
-    # if ai_service == AIService.Mock:
-    #     return [
-    #         "mock_model_1",
-    #         "mock_model_2"
-    #     ]
+    if ai_service == AIService.Mock.value:
+        return mock.Mock.embeddings(ai_model)
     msg = f"Invalid value for {ai_service=}"
     raise ValueError(msg)
 
 
+async def get_model_info(*, ai_service: str, ai_model: str) -> Optional[ModelInfo]:
+    if ai_service == AIService.AWSBedRock.value:
+        return await bedrock.Bedrock.model_info(ai_model)
+    if ai_service == AIService.OpenAI.value:
+        return await openai.OpenAI.model_info(ai_model)
+    if ai_service == AIService.Ollama.value:
+        return await ollama.Ollama.model_info(ai_model)
+    if ai_service == AIService.Mock.value:
+        return await mock.Mock.model_info(ai_model)
+    msg = f"Invalid value for {ai_service=}"
+    raise ValueError(msg)
+
+
+async def warm_up_model(
+    *, ai_service: str, ai_model: str, keep_alive: Optional[str] = None
+) -> Optional[ModelLoadState]:
+    """Load model into memory ahead of the first request. Returns None for AI Services that need no warm-up."""
+    if ai_service == AIService.Ollama.value:
+        return await ollama.Ollama.warm_up(ai_model, keep_alive=keep_alive)
+    return None
+
+
+async def close_clients():
+    """Close HTTP sessions kept open for AI Service requests"""
+    await close_transports()
+
+
 async def list_all_models() -> Dict[str, List[str]]:
     services = [service.value for service in AIService]
     tasks = [list_models(service) for service in services]
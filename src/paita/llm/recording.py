@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, message_chunk_to_message, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, Generation, LLMResult
+
+from paita.llm.callbacks import AsyncHandler
+from paita.utils.logger import log
+
+if TYPE_CHECKING:
+    from uuid import UUID
+
+    from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+    from langchain_core.messages import BaseMessage
+
+START = "start"
+TOKEN = "token"  # noqa: S105
+END = "end"
+
+
+class Recording:
+    """
+    Token stream of one AI Model run. Tokens are kept with their offset in seconds from the start of the run.
+    """
+
+    def __init__(self, tokens: List[Tuple[float, str]], result: Optional[LLMResult] = None):
+        self.tokens: List[Tuple[float, str]] = tokens
+        self.result: Optional[LLMResult] = result
+
+    @property
+    def text(self) -> str:
+        return "".join(text for _, text in self.tokens)
+
+    @property
+    def duration(self) -> float:
+        return self.tokens[-1][0] if self.tokens else 0.0
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> Recording:
+        tokens: List[Tuple[float, str]] = []
+        result: Optional[LLMResult] = None
+        with open(path, encoding="utf-8") as recording_file:
+            for line in recording_file:
+                record = json.loads(line)
+                if record["type"] == TOKEN:
+                    tokens.append((record["t"], record["text"]))
+                elif record["type"] == END:
+                    result = _result_from_dict(record["result"])
+        return cls(tokens, result)
+
+
+class RecordingHandler(AsyncHandler):
+    """
+    AsyncHandler that records every token with its timestamp and the final LLMResult of each run to a JSON lines
+    file in the given directory. Recordings can be played back with ReplayChatModel.
+    """
+
+    def __init__(self, directory: Union[str, Path], *, clock: Callable[[], float] = time.monotonic):
+        self.directory: Path = Path(directory)
+        self._clock = clock
+        self._runs: Dict[UUID, Tuple[float, List[Tuple[float, str]]]] = {}
+        self.recorded: List[Path] = []
+
+    def _run(self, run_id: UUID) -> Tuple[float, List[Tuple[float, str]]]:
+        # Hedged attempts forward only tokens, so run may start at its first token
+        if run_id not in self._runs:
+            self._runs[run_id] = (self._clock(), [])
+        return self._runs[run_id]
+
+    async def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],  # noqa: ARG002
+        messages: List[List[BaseMessage]],  # noqa: ARG002
+        *,
+        run_id: UUID,
+        **kwargs: Any,  # noqa: ARG002
+    ) -> None:
+        self._runs[run_id] = (self._clock(), [])
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs) -> None:
+        started_at, tokens = self._run(run_id)
+        tokens.append((self._clock() - started_at, token))
+        await super().on_llm_new_token(token, run_id=run_id, **kwargs)
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        started_at, tokens = self._runs.pop(run_id, (self._clock(), []))
+        records = [{"type": START, "run_id": str(run_id)}]
+        records.extend({"type": TOKEN, "t": offset, "text": text} for offset, text in tokens)
+        records.append({"type": END, "t": self._clock() - started_at, "result": json.loads(response.json())})
+        timestamp = datetime.now(tz=timezone.utc).strftime("%Y%m%dT%H%M%S")
+        path = self.directory / f"{timestamp}-{run_id}.jsonl"
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, path, records)
+        self.recorded.append(path)
+        log.info(f"Recorded {len(tokens)} tokens to {path}")
+        await super().on_llm_end(response, run_id=run_id, **kwargs)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._runs.pop(run_id, None)
+        await super().on_llm_error(error, run_id=run_id, **kwargs)
+
+    def _write(self, path: Path, records: List[Dict[str, Any]]):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as recording_file:
+            recording_file.writelines(json.dumps(record) + "\n" for record in records)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Chat model that plays back a recorded token stream with the original timing, or speed times faster.
+    Speed 0 plays back without delays.
+    """
+
+    tokens: List[Tuple[float, str]]
+    usage_metadata: Optional[Dict[str, Any]] = None
+    speed: float = 1.0
+
+    @classmethod
+    def from_recording(cls, recording: Recording, *, speed: float = 1.0) -> ReplayChatModel:
+        usage_metadata = None
+        if recording.result and recording.result.generations:
+            generation = recording.result.generations[0][0]
+            if isinstance(generation, ChatGeneration):
+                usage_metadata = getattr(generation.message, "usage_metadata", None)
+        return cls(tokens=recording.tokens, usage_metadata=usage_metadata, speed=speed)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path], *, speed: float = 1.0) -> ReplayChatModel:
+        return cls.from_recording(Recording.load(path), speed=speed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[Tuple[float, ChatGenerationChunk]]:  # noqa: ARG002
+        # Tokens are paired with their playback offset
+        for offset, text in self.tokens:
+            playback_offset = offset / self.speed if self.speed > 0 else 0.0
+            yield playback_offset, ChatGenerationChunk(message=AIMessageChunk(content=text))
+        if self.usage_metadata:
+            yield 0.0, ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.usage_metadata))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,  # noqa: ARG002
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,  # noqa: ARG002
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        for offset, chunk in self._chunks(messages):
+            delay = offset - (loop.time() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if run_manager and chunk.text:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        generation: Optional[ChatGenerationChunk] = None
+        async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+            generation = chunk if generation is None else generation + chunk
+        message = generation.message if generation else AIMessageChunk(content="")
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,  # noqa: ARG002
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,  # noqa: ARG002
+    ) -> Iterator[ChatGenerationChunk]:
+        started_at = time.monotonic()
+        for offset, chunk in self._chunks(messages):
+            delay = offset - (time.monotonic() - started_at)
+            if delay > 0:
+                time.sleep(delay)
+            if run_manager and chunk.text:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        generation: Optional[ChatGenerationChunk] = None
+        for chunk in self._stream(messages, stop, run_manager, **kwargs):
+            generation = chunk if generation is None else generation + chunk
+        message = generation.message if generation else AIMessageChunk(content="")
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
+
+
+def _result_from_dict(data: Dict[str, Any]) -> LLMResult:
+    # LLMResult does not parse back its own ChatGenerations so messages are rebuilt from their dicts
+    generations: List[List[Generation]] = []
+    for candidates in data.get("generations", []):
+        row: List[Generation] = []
+        for generation in candidates:
+            if "message" in generation:
+                message = messages_from_dict([{"type": generation["message"]["type"], "data": generation["message"]}])
+                row.append(ChatGeneration(message=message[0], generation_info=generation.get("generation_info")))
+            else:
+                row.append(Generation(text=generation["text"], generation_info=generation.get("generation_info")))
+        generations.append(row)
+    return LLMResult(generations=generations, llm_output=data.get("llm_output"))
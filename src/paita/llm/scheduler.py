@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from paita.utils.logger import log
+
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "RateLimitError",
+)
+
+SECONDS_PER_MINUTE = 60.0
+CHARS_PER_TOKEN = 4
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    if getattr(error, "status_code", None) == 429:  # noqa: PLR2004
+        return True
+    # botocore ClientError
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+        return True
+    return type(error).__name__ in THROTTLING_ERROR_CODES
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough estimate good enough for rate limiting, roughly four characters per token
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations in arrival order.
+    Reserving more than available puts the bucket in debt, later callers wait until the debt is refilled.
+    """
+
+    def __init__(self, *, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity: float = per_minute
+        self._rate: float = per_minute / SECONDS_PER_MINUTE
+        self._clock = clock
+        self._tokens: float = per_minute
+        self._updated: float = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Reserve amount of tokens and return the number of seconds to wait before using them."""
+        self._refill()
+        self._tokens -= min(amount, self.capacity)
+        return max(0.0, -self._tokens / self._rate)
+
+    def consume(self, amount: float):
+        """Consume tokens that were used without reservation e.g. generated output."""
+        self._refill()
+        self._tokens -= amount
+
+
+class RateLimiter:
+    def __init__(self, *, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests: Optional[TokenBucket] = (
+            TokenBucket(per_minute=requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens: Optional[TokenBucket] = TokenBucket(per_minute=tokens_per_minute) if tokens_per_minute else None
+        self._paused_until: float = 0.0
+
+    def limits(self) -> Tuple[Optional[float], Optional[float]]:
+        return (
+            self.requests.capacity if self.requests else None,
+            self.tokens.capacity if self.tokens else None,
+        )
+
+    def reserve(self, tokens: int) -> float:
+        delays = [self._paused_until - time.monotonic()]
+        if self.requests:
+            delays.append(self.requests.reserve(1))
+        if self.tokens:
+            delays.append(self.tokens.reserve(tokens))
+        return max(delays)
+
+    def consume(self, tokens: int):
+        if self.tokens:
+            self.tokens.consume(tokens)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RequestStats(BaseModel):
+    queue_wait: float = 0.0
+    latency: float = 0.0
+    attempts: int = 0
+    served_by: Optional[str] = None
+    hedged: bool = False
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    # USD, None when prices of the model or token usage are not known
+    cost: Optional[float] = None
+
+
+class RequestScheduler:
+    """
+    RequestScheduler rate limits requests per AI Service and model, and retries throttled requests
+    with jittered exponential backoff. Time spent waiting in queue is reported separately from model latency.
+    """
+
+    def __init__(self, *, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self._limiters: Dict[Tuple[str, str], RateLimiter] = {}
+
+    def limiter(
+        self,
+        key: Tuple[str, str],
+        *,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> RateLimiter:
+        limiter = self._limiters.get(key)
+        if limiter is None or limiter.limits() != (requests_per_minute, tokens_per_minute):
+            limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+            self._limiters[key] = limiter
+        return limiter
+
+    def backoff(self, attempt: int) -> float:
+        # "Full jitter" backoff
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))  # noqa: S311
+
+    async def stream(
+        self,
+        key: Tuple[str, str],
+        request: Callable[[], AsyncIterator[str]],
+        *,
+        tokens: int,
+        stats: RequestStats,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 3,
+    ) -> AsyncIterator[str]:
+        """
+        Run a streaming request once rate limits allow it. Throttled requests are retried as long as
+        they have not yielded anything.
+        """
+        limiter = self.limiter(key, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+        output_length = 0
+        while True:
+            queued = time.monotonic()
+            delay = limiter.reserve(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            stats.queue_wait += started - queued
+            stats.attempts += 1
+            yielded = False
+            try:
+                async for chunk in request():
+                    yielded = True
+                    output_length += len(chunk)
+                    yield chunk
+            except Exception as e:
+                if yielded or not is_throttling_error(e) or stats.attempts > max_retries:
+                    stats.latency += time.monotonic() - started
+                    raise
+                delay = self.backoff(stats.attempts)
+                log.info(f"Throttled by {key}, retrying in {delay:.2f}s: {e}")
+                # Back off also all other requests queued for the same model
+                limiter.pause(delay)
+                stats.queue_wait += time.monotonic() - started
+                continue
+            stats.latency += time.monotonic() - started
+            limiter.consume(output_length // CHARS_PER_TOKEN)
+            return
+
+
+scheduler = RequestScheduler()
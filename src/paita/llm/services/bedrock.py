@@ -1,26 +1,235 @@
 from __future__ import annotations
 
 import asyncio
-import os
-from functools import partial
-from typing import Optional
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional
 
-import boto3
-from botocore.config import Config
-from langchain_aws import BedrockEmbeddings, ChatBedrock
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import BaseModel, ConfigDict
 
+from paita.llm.enums import AIService
+from paita.llm.model_info import ModelInfo
+from paita.llm.services.bedrock_transport import BedrockTransport, get_transport
 from paita.llm.services.service import Service
 from paita.utils.logger import log
 
+if TYPE_CHECKING:
+    from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+
+DEFAULT_EMBEDDINGS_MODEL = "amazon.titan-embed-text-v1"
+INFERENCE_CONFIG_KEYS = {
+    "max_tokens": "maxTokens",
+    "max_tokens_to_sample": "maxTokens",
+    "temperature": "temperature",
+    "top_p": "topP",
+    "stop_sequences": "stopSequences",
+}
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+
+def convert_messages(messages: List[BaseMessage], *, cache_points: bool = False) -> Dict[str, Any]:
+    """
+    Convert messages to Converse API system and messages fields. Converse expects alternating user and assistant
+    messages so consecutive messages of the same role are merged. Trailing assistant message is a prefix the model
+    continues, and it must not end with whitespace.
+    With cache_points the prompt is cached up to the end of system prompt and up to the end of history, which is
+    everything before the last user message.
+    """
+    system: List[Dict[str, Any]] = []
+    converted: List[Dict[str, Any]] = []
+    for message in messages:
+        text = _text(message.content)
+        if isinstance(message, SystemMessage):
+            system.append({"text": text})
+            continue
+        role = "assistant" if isinstance(message, AIMessage) else "user"
+        if converted and converted[-1]["role"] == role:
+            converted[-1]["content"].append({"text": text})
+        else:
+            converted.append({"role": role, "content": [{"text": text}]})
+    if converted and converted[-1]["role"] == "assistant":
+        converted[-1]["content"][-1]["text"] = converted[-1]["content"][-1]["text"].rstrip()
+    if cache_points:
+        if system:
+            system.append(CACHE_POINT)
+        last_user = max((i for i, message in enumerate(converted) if message["role"] == "user"), default=0)
+        if last_user > 0:
+            converted[last_user - 1]["content"].append(CACHE_POINT)
+    return {"system": system, "messages": converted} if system else {"messages": converted}
+
+
+def _usage_metadata(usage: Dict[str, int]) -> Dict[str, int]:
+    return {
+        "input_tokens": usage.get("inputTokens", 0),
+        "output_tokens": usage.get("outputTokens", 0),
+        "total_tokens": usage.get("totalTokens", 0),
+    }
+
+
+class ChatBedrockAsync(BaseChatModel):
+    """
+    Chat model on Bedrock Converse API using the async BedrockTransport
+    """
+
+    transport: Any = None
+    model_id: str
+    streaming: bool = True
+    prompt_cache: bool = False
+    model_kwargs: Dict[str, Any] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "amazon_bedrock_converse_async"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_id": self.model_id, "model_kwargs": self.model_kwargs}
+
+    def _request_body(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> Dict[str, Any]:
+        inference_config: Dict[str, Any] = {}
+        additional_fields: Dict[str, Any] = {}
+        for key, value in self.model_kwargs.items():
+            if key in INFERENCE_CONFIG_KEYS:
+                inference_config[INFERENCE_CONFIG_KEYS[key]] = value
+            else:
+                additional_fields[key] = value
+        if stop:
+            inference_config["stopSequences"] = stop
+        body = convert_messages(messages, cache_points=self.prompt_cache)
+        if inference_config:
+            body["inferenceConfig"] = inference_config
+        if additional_fields:
+            body["additionalModelRequestFields"] = additional_fields
+        return body
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,  # noqa: ARG002
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        transport: BedrockTransport = self.transport
+        async for event_type, event in transport.converse_stream(self.model_id, self._request_body(messages, stop)):
+            if event_type == "contentBlockDelta":
+                text = event.get("delta", {}).get("text", "")
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if run_manager:
+                    await run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+            elif event_type == "metadata" and "usage" in event:
+                # Usage is also kept as is for the prompt cache token counts
+                message = AIMessageChunk(
+                    content="",
+                    usage_metadata=_usage_metadata(event["usage"]),
+                    response_metadata={"usage": event["usage"]},
+                )
+                yield ChatGenerationChunk(message=message)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            generation: Optional[ChatGenerationChunk] = None
+            async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+                generation = chunk if generation is None else generation + chunk
+            message = generation.message if generation else AIMessageChunk(content="")
+            return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
+
+        transport: BedrockTransport = self.transport
+        response = await transport.converse(self.model_id, self._request_body(messages, stop))
+        content = response.get("output", {}).get("message", {}).get("content", [])
+        message = AIMessage(
+            content=_text(content),
+            usage_metadata=_usage_metadata(response["usage"]) if "usage" in response else None,
+            response_metadata={"stopReason": response.get("stopReason"), "usage": response.get("usage", {})},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,  # noqa: ARG002
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # Sync interface runs the async transport in its own event loop
+        loop = asyncio.new_event_loop()
+        stream = self._astream(messages, stop, **kwargs)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(stream.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(self.transport.close())
+            loop.close()
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,  # noqa: ARG002
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = list(self._stream(messages, stop, **kwargs))
+        text = "".join(_text(chunk.message.content) for chunk in chunks)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+class BedrockAsyncEmbeddings(BaseModel, Embeddings):
+    """
+    Bedrock embeddings (Titan style request and response) using the async BedrockTransport
+    """
+
+    model_config = ConfigDict(protected_namespaces=())
+
+    transport: Any = None
+    model_id: str = DEFAULT_EMBEDDINGS_MODEL
+
+    async def aembed_query(self, text: str) -> List[float]:
+        transport: BedrockTransport = self.transport
+        response = await transport.invoke_model(self.model_id, {"inputText": text})
+        return response["embedding"]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.aembed_query(text) for text in texts)))
+
+    def embed_query(self, text: str) -> List[float]:
+        return asyncio.run(self._run(self.aembed_query(text)))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return asyncio.run(self._run(self.aembed_documents(texts)))
+
+    async def _run(self, coroutine):
+        try:
+            return await coroutine
+        finally:
+            await self.transport.close()
+
 
 class Bedrock(Service):
+    assistant_prefill = True
+
     @classmethod
     async def models(cls):
-        loop = asyncio.get_event_loop()
         try:
-            bedrock_client = cls._get_bedrock_client(runtime=False)
-            pf = partial(bedrock_client.list_foundation_models, byOutputModality="TEXT")
-            response = await loop.run_in_executor(None, pf)
+            response = await get_transport().list_foundation_models(byOutputModality="TEXT")
             models = [model["modelId"] for model in response["modelSummaries"]]
             return sorted(models)
         except Exception as e:  # noqa: BLE001 TODO
@@ -28,10 +237,22 @@ class Bedrock(Service):
             return []
 
     @classmethod
-    def embeddings(cls, model_id: Optional[str] = None) -> BedrockEmbeddings:
-        return BedrockEmbeddings(model_id=model_id) if model_id else BedrockEmbeddings()
+    async def model_info(cls, model_id: str) -> Optional[ModelInfo]:
+        response = await get_transport().get_foundation_model(model_id)
+        details = response["modelDetails"]
+        return ModelInfo(
+            ai_service=AIService.AWSBedRock.value,
+            ai_model=model_id,
+            streaming=details.get("responseStreamingSupported"),
+        )
+
+    @classmethod
+    def embeddings(cls, model_id: Optional[str] = None) -> BedrockAsyncEmbeddings:
+        if model_id:
+            return BedrockAsyncEmbeddings(transport=get_transport(), model_id=model_id)
+        return BedrockAsyncEmbeddings(transport=get_transport())
 
-    def chat_model(self) -> ChatBedrock:
+    def chat_model(self) -> ChatBedrockAsync:
         model_kwargs = {
             # "max_tokens_to_sample": self._settings_model.ai_max_tokens,
             "temperature": 1,
@@ -42,50 +263,15 @@ class Bedrock(Service):
         if self._settings_model.ai_model_kwargs:
             model_kwargs.update(self._settings_model.ai_model_kwargs)
         log.debug(f"{model_kwargs=}")
-        return ChatBedrock(
+        # Transport does no retries of its own, throttled requests are retried by the request scheduler
+        return ChatBedrockAsync(
+            transport=get_transport(),
             model_id=self._settings_model.ai_model,
             streaming=self._settings_model.ai_streaming,
+            prompt_cache=bool(self._settings_model.ai_prompt_cache),
             model_kwargs=model_kwargs,
             # max_tokens=settings_model.ai_max_tokens,
             # n=settings_model.ai_n,
-            callbacks=[self._callback_handler],
+            callbacks=self._callbacks(),
             # callback_manager=callback_handler,
         )
-
-    @classmethod
-    def _get_bedrock_client(
-        cls,
-        *,
-        assumed_role: Optional[str] = None,
-        region: Optional[str] = None,
-        runtime: Optional[bool] = True,
-    ):
-        target_region = os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION")) if region is None else region
-
-        session_kwargs = {"region_name": target_region}
-        client_kwargs = {**session_kwargs}
-
-        profile_name = os.environ.get("AWS_PROFILE")
-        if profile_name:
-            session_kwargs["profile_name"] = profile_name
-
-        retry_config = Config(
-            region_name=target_region,
-            connect_timeout=10,
-            read_timeout=3,
-            retries={
-                "max_attempts": 3,
-                "mode": "standard",
-            },
-        )
-        session = boto3.Session(**session_kwargs)
-
-        if assumed_role:
-            sts = session.client("sts")
-            response = sts.assume_role(RoleArn=str(assumed_role), RoleSessionName="langchain-llm-1")
-            client_kwargs["aws_access_key_id"] = response["Credentials"]["AccessKeyId"]
-            client_kwargs["aws_secret_access_key"] = response["Credentials"]["SecretAccessKey"]
-            client_kwargs["aws_session_token"] = response["Credentials"]["SessionToken"]
-        service_name = "bedrock-runtime" if runtime else "bedrock"
-
-        return session.client(service_name=service_name, config=retry_config, **client_kwargs)
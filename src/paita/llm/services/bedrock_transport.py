@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.eventstream import EventStreamBuffer
+from botocore.exceptions import ClientError, EventStreamError
+from yarl import URL
+
+from paita.utils.logger import log
+
+SIGNING_NAME = "bedrock"
+HTTP_CLIENT_ERROR = 400
+
+
+class BedrockTransport:
+    """
+    Async Bedrock client on top of aiohttp. Requests are signed with SigV4 and converse_stream responses are decoded
+    from the event stream on the event loop, so concurrent requests don't tie up executor threads.
+
+    Endpoint can be overridden (e.g. to a local stub) with env variable BEDROCK_ENDPOINT.
+    """
+
+    def __init__(
+        self,
+        *,
+        session: Optional[boto3.Session] = None,
+        region: Optional[str] = None,
+        endpoint_url: Optional[str] = None,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+    ):
+        self._boto_session: boto3.Session = session if session else boto3.Session()
+        self.region: Optional[str] = region if region else self._boto_session.region_name
+        self.endpoint_url: Optional[str] = endpoint_url.rstrip("/") if endpoint_url else None
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._credentials = None
+        self._clients: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+    @classmethod
+    def from_env(cls) -> BedrockTransport:
+        session_kwargs = {"region_name": os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION"))}
+        profile_name = os.environ.get("AWS_PROFILE")
+        if profile_name:
+            session_kwargs["profile_name"] = profile_name
+        return cls(session=boto3.Session(**session_kwargs), endpoint_url=os.environ.get("BEDROCK_ENDPOINT"))
+
+    def _url(self, *, runtime: bool, path: str) -> str:
+        if self.endpoint_url:
+            return f"{self.endpoint_url}{path}"
+        service_name = "bedrock-runtime" if runtime else "bedrock"
+        return f"https://{service_name}.{self.region}.amazonaws.com{path}"
+
+    async def _http_client(self) -> aiohttp.ClientSession:
+        # Sessions are bound to the event loop that created them, sessions left by closed loops are closed here
+        for loop in [loop for loop in self._clients if loop.is_closed()]:
+            await self._clients.pop(loop).close()
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.closed:
+            client = self._clients[loop] = aiohttp.ClientSession(timeout=self._timeout)
+        return client
+
+    async def close(self):
+        """Close session of the running event loop"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None and not client.closed:
+            await client.close()
+
+    async def _signed_headers(self, method: str, url: str, body: Optional[bytes]) -> Dict[str, str]:
+        if self._credentials is None:
+            # Credential chain may read files or call instance metadata, resolve it once off the event loop
+            loop = asyncio.get_running_loop()
+            self._credentials = await loop.run_in_executor(None, self._boto_session.get_credentials)
+            if self._credentials is None:
+                msg = "Unable to locate AWS credentials"
+                raise ValueError(msg)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        request = AWSRequest(method=method, url=url, data=body, headers=headers)
+        SigV4Auth(self._credentials.get_frozen_credentials(), SIGNING_NAME, self.region).add_auth(request)
+        return dict(request.headers.items())
+
+    async def _request(
+        self, method: str, *, runtime: bool, path: str, operation: str, body: Optional[Dict[str, Any]] = None
+    ) -> aiohttp.ClientResponse:
+        url = self._url(runtime=runtime, path=path)
+        data = json.dumps(body).encode() if body is not None else None
+        headers = await self._signed_headers(method, url, data)
+        # Path is already encoded, signature covers it as is
+        client = await self._http_client()
+        response = await client.request(method, URL(url, encoded=True), data=data, headers=headers)
+        if response.status >= HTTP_CLIENT_ERROR:
+            await _raise_for_error(response, operation)
+        return response
+
+    async def list_foundation_models(self, **params: str) -> Dict[str, Any]:
+        query = "&".join(f"{key}={quote(value, safe='')}" for key, value in sorted(params.items()))
+        path = f"/foundation-models?{query}" if query else "/foundation-models"
+        async with await self._request("GET", runtime=False, path=path, operation="ListFoundationModels") as response:
+            return await response.json()
+
+    async def get_foundation_model(self, model_id: str) -> Dict[str, Any]:
+        path = f"/foundation-models/{quote(model_id, safe='')}"
+        async with await self._request("GET", runtime=False, path=path, operation="GetFoundationModel") as response:
+            return await response.json()
+
+    async def invoke_model(self, model_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        path = f"/model/{quote(model_id, safe='')}/invoke"
+        async with await self._request("POST", runtime=True, path=path, operation="InvokeModel", body=body) as response:
+            return await response.json(content_type=None)
+
+    async def converse(self, model_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        path = f"/model/{quote(model_id, safe='')}/converse"
+        async with await self._request("POST", runtime=True, path=path, operation="Converse", body=body) as response:
+            return await response.json()
+
+    async def converse_stream(self, model_id: str, body: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield (event type, event) tuples e.g. ("contentBlockDelta", {"delta": {"text": "..."}, ...})
+        """
+        path = f"/model/{quote(model_id, safe='')}/converse-stream"
+        operation = "ConverseStream"
+        async with await self._request("POST", runtime=True, path=path, operation=operation, body=body) as response:
+            buffer = EventStreamBuffer()
+            async for data in response.content.iter_any():
+                buffer.add_data(data)
+                for message in buffer:
+                    message_type = message.headers.get(":message-type")
+                    payload = json.loads(message.payload) if message.payload else {}
+                    if message_type == "event":
+                        yield message.headers.get(":event-type"), payload
+                    else:
+                        code = message.headers.get(":exception-type", message.headers.get(":error-code", "Unknown"))
+                        error = {"Code": code[:1].upper() + code[1:], "Message": payload.get("message", "")}
+                        raise EventStreamError({"Error": error}, operation)
+
+
+async def _raise_for_error(response: aiohttp.ClientResponse, operation: str):
+    async with response:
+        try:
+            body = await response.json(content_type=None)
+        except ValueError:
+            body = {}
+    # Error type header looks like "ThrottlingException:http://internal.amazon.com/coral/..."
+    code = response.headers.get("x-amzn-ErrorType", body.get("__type", str(response.status)))
+    code = code.split(":")[0].split("#")[-1]
+    message = body.get("message", body.get("Message", response.reason))
+    log.debug(f"{operation} failed: {response.status} {code} {message}")
+    raise ClientError(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": response.status}},
+        operation,
+    )
+
+
+_transports: Dict[Tuple[Optional[str], ...], BedrockTransport] = {}
+
+
+def get_transport() -> BedrockTransport:
+    """Return the shared transport for the currently configured profile, region and endpoint"""
+    key = tuple(
+        os.environ.get(name) for name in ("AWS_PROFILE", "AWS_REGION", "AWS_DEFAULT_REGION", "BEDROCK_ENDPOINT")
+    )
+    if key not in _transports:
+        _transports[key] = BedrockTransport.from_env()
+    return _transports[key]
+
+
+async def close_transports():
+    for transport in _transports.values():
+        await transport.close()
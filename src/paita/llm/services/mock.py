@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import os
+import random
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+from paita.llm.enums import AIService
+from paita.llm.model_info import ModelInfo
+from paita.llm.recording import ReplayChatModel
+from paita.llm.scheduler import estimate_tokens
+from paita.llm.services.service import Service
+from paita.utils.logger import log
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+MOCK_SERVICE_ENV = "PAITA_MOCK_SERVICE"
+MOCK_CONTEXT_LENGTH = 128_000
+
+# Presets of the mock AI Models, AI Model kwargs of the settings override them. Presets override max tokens of the
+# settings, huge answers are not cut to it so that they are large messages.
+MOCK_MODELS: Dict[str, Dict[str, Any]] = {
+    "mock-fast": {"tokens_per_second": 5000.0, "first_token_delay": 0.05, "response_tokens": 800},
+    "mock-realistic": {"tokens_per_second": 60.0, "first_token_delay": 0.6, "response_tokens": 400},
+    "mock-flaky": {"tokens_per_second": 200.0, "first_token_delay": 0.3, "response_tokens": 400, "error_rate": 0.2},
+    "mock-huge": {
+        "tokens_per_second": 20000.0,
+        "first_token_delay": 0.05,
+        "response_tokens": 50000,
+        "max_tokens": None,
+    },
+}
+
+MOCK_TEXT = (
+    "the quick brown fox jumps over lazy dog paita streams tokens from a mock model so that rendering history "
+    "and persistence can be measured without any network"
+)
+WORDS = MOCK_TEXT.split()
+# Every BLOCK_TOKENS tokens a code fence is opened or closed, or a paragraph ends, with these probabilities
+BLOCK_TOKENS = 60
+FENCE_PROBABILITY = 0.1
+PARAGRAPH_PROBABILITY = 0.4
+
+
+class MockChatModel(ReplayChatModel):
+    """
+    Chat model that streams generated text without an AI Service. Response size follows a log-normal distribution
+    around response_tokens, tokens arrive at tokens_per_second after first_token_delay, and a request fails midway
+    with probability error_rate.
+    """
+
+    tokens: List[Tuple[float, str]] = []
+    tokens_per_second: float = 1000.0
+    first_token_delay: float = 0.1
+    response_tokens: int = 400
+    response_tokens_sigma: float = 0.5
+    error_rate: float = 0.0
+    max_tokens: Optional[int] = None
+    seed: Optional[int] = None
+    rng: Any = None
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.rng = random.Random(self.seed)  # noqa: S311
+
+    @property
+    def _llm_type(self) -> str:
+        return "mock"
+
+    def _response_size(self) -> int:
+        size = max(1, round(self.rng.lognormvariate(0.0, self.response_tokens_sigma) * self.response_tokens))
+        return min(size, self.max_tokens) if self.max_tokens else size
+
+    def _text(self, size: int) -> Iterator[str]:
+        # Paragraphs and code fences now and then so that responses exercise markdown rendering
+        in_fence = False
+        for i in range(size):
+            if i and i % BLOCK_TOKENS == 0:
+                roll = self.rng.random()
+                if in_fence or roll < FENCE_PROBABILITY:
+                    in_fence = not in_fence
+                    yield "\n```\n" if in_fence else "\n```\n\n"
+                    continue
+                if roll < FENCE_PROBABILITY + PARAGRAPH_PROBABILITY:
+                    yield "\n\n"
+                    continue
+            yield (" " if i else "") + self.rng.choice(WORDS)
+        if in_fence:
+            yield "\n```"
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[Tuple[float, ChatGenerationChunk]]:
+        size = self._response_size()
+        fail_at = self.rng.randrange(size + 1) if self.rng.random() < self.error_rate else None
+        offset = self.first_token_delay / self.speed if self.speed > 0 else 0.0
+        interval = 1 / (self.tokens_per_second * self.speed) if self.speed > 0 and self.tokens_per_second > 0 else 0.0
+        for i, text in enumerate(self._text(size)):
+            if i == fail_at:
+                msg = "Mock AI Service failed"
+                raise ConnectionError(msg)
+            yield offset + i * interval, ChatGenerationChunk(message=AIMessageChunk(content=text))
+        input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        usage_metadata = {"input_tokens": input_tokens, "output_tokens": size, "total_tokens": input_tokens + size}
+        yield 0.0, ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage_metadata))
+
+
+def enabled() -> bool:
+    return bool(os.getenv(MOCK_SERVICE_ENV))
+
+
+class Mock(Service):
+    """
+    Mock AI Service for load testing. Available only when PAITA_MOCK_SERVICE environment variable is set.
+    """
+
+    @classmethod
+    async def models(cls) -> [str]:
+        return list(MOCK_MODELS) if enabled() else []
+
+    @classmethod
+    async def model_info(cls, model_id: str) -> Optional[ModelInfo]:
+        return ModelInfo(
+            ai_service=AIService.Mock.value,
+            ai_model=model_id,
+            context_length=MOCK_CONTEXT_LENGTH,
+            streaming=True,
+            input_price=0.0,
+            output_price=0.0,
+        )
+
+    @classmethod
+    def embeddings(cls, model_id: Optional[str] = None) -> DeterministicFakeEmbedding:  # noqa: ARG003
+        return DeterministicFakeEmbedding(size=256)
+
+    def chat_model(self) -> MockChatModel:
+        model_kwargs = {
+            "max_tokens": self._settings_model.ai_max_tokens,
+            **MOCK_MODELS.get(self._settings_model.ai_model, {}),
+        }
+        if self._settings_model.ai_model_kwargs:
+            model_kwargs.update(
+                (key, value)
+                for key, value in self._settings_model.ai_model_kwargs.items()
+                if key in MockChatModel.__fields__
+            )
+        log.debug(f"{model_kwargs=}")
+        return MockChatModel(
+            callbacks=self._callbacks(),
+            **model_kwargs,
+        )
@@ -1,28 +1,98 @@
-import os
-from typing import Optional
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Mapping, Optional, Union
 
 from langchain_ollama import ChatOllama, OllamaEmbeddings
-from ollama import AsyncClient
+from ollama import Options
 
+from paita.llm.enums import AIService
+from paita.llm.model_info import ModelInfo
+from paita.llm.services.ollama_pool import OllamaPool, get_pool, parse_keep_alive
 from paita.llm.services.service import Service
 from paita.utils.logger import log
 
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+    from paita.llm.enums import ModelLoadState
+
+
+class PooledChatOllama(ChatOllama):
+    """
+    ChatOllama that routes each request to an endpoint selected by OllamaPool
+    """
+
+    pool: Any = None
+
+    async def _acreate_chat_stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Union[Mapping[str, Any], str]]:
+        ollama_messages = self._convert_messages_to_ollama_messages(messages)
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        params["options"]["stop"] = stop if stop is not None else self.stop
+
+        pool: OllamaPool = self.pool
+        async with pool.acquire(params["model"]) as endpoint:
+            log.debug(f"{endpoint=}")
+            async for part in await endpoint.client.chat(
+                model=params["model"],
+                messages=ollama_messages,
+                stream=True,
+                options=Options(**params["options"]),
+                keep_alive=params["keep_alive"],
+                format=params["format"],
+            ):
+                yield part
+
+
+def parse_show_response(model_id: str, response: Mapping[str, Any]) -> ModelInfo:
+    # Context window used at runtime is num_ctx when the model file sets it, otherwise the trained context length
+    context_length = None
+    for line in (response.get("parameters") or "").splitlines():
+        name, _, value = line.partition(" ")
+        if name == "num_ctx":
+            context_length = int(value.strip())
+    if context_length is None:
+        for key, value in (response.get("model_info") or {}).items():
+            if key.endswith(".context_length"):
+                context_length = int(value)
+    return ModelInfo(
+        ai_service=AIService.Ollama.value, ai_model=model_id, context_length=context_length, streaming=True
+    )
+
 
 class Ollama(Service):
     @classmethod
     async def models(cls) -> [str]:
         try:
-            client = AsyncClient(host=os.getenv("OLLAMA_ENDPOINT", None))
-            response = await client.list()
-            models = [model["name"] for model in response["models"]]
-            return sorted(models)
+            pool = get_pool()
+            await pool.refresh(force=True)
+            return pool.models()
         except Exception as e:  # noqa: BLE001 TODO
             log.info(e)
             return []
 
+    @classmethod
+    async def model_info(cls, model_id: str) -> Optional[ModelInfo]:
+        pool = get_pool()
+        await pool.refresh()
+        response = await pool.select(model_id).client.show(model_id)
+        return parse_show_response(model_id, response)
+
+    @classmethod
+    async def warm_up(cls, model_id: str, *, keep_alive: Optional[str] = None) -> ModelLoadState:
+        return await get_pool().warm_up(model_id, keep_alive=keep_alive)
+
     @classmethod
     def embeddings(cls, model_id: Optional[str] = None) -> OllamaEmbeddings:
-        return OllamaEmbeddings(model=model_id) if model_id else OllamaEmbeddings(model="llama3.1")
+        model = model_id if model_id else "llama3.1"
+        return OllamaEmbeddings(model=model, base_url=get_pool().select(model).host)
 
     def chat_model(self) -> ChatOllama:
         model_kwargs = {
@@ -35,16 +105,16 @@ class Ollama(Service):
         if self._settings_model.ai_model_kwargs:
             model_kwargs.update(self._settings_model.ai_model_kwargs)
         log.debug(f"{model_kwargs=}")
-        chat_ollama = ChatOllama(
+        pool = get_pool()
+        return PooledChatOllama(
+            pool=pool,
+            base_url=pool.default_host,
             model=self._settings_model.ai_model,
+            keep_alive=parse_keep_alive(self._settings_model.ai_keep_alive),
             streaming=self._settings_model.ai_streaming,
             model_kwargs=model_kwargs,
             # max_tokens=settings_model.ai_max_tokens,
             # n=settings_model.ai_n,
-            callbacks=[self._callback_handler],
+            callbacks=self._callbacks(),
             # callback_manager=callback_handler,
         )
-        if (host := os.getenv("OLLAMA_ENDPOINT", None)) is not None:
-            chat_ollama.base_url = host
-
-        return chat_ollama
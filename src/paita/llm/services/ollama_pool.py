@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Union
+
+import httpx
+from ollama import AsyncClient, ResponseError
+
+from paita.llm.enums import ModelLoadState
+from paita.utils.logger import log
+from paita.utils.string_utils import split_and_fix, str_to_num
+
+HTTP_SERVER_ERROR = 500
+
+
+def is_host_failure(error: BaseException) -> bool:
+    # Errors like unknown model tell nothing about the health of the host
+    if isinstance(error, ResponseError):
+        return error.status_code >= HTTP_SERVER_ERROR
+    return isinstance(error, (httpx.TransportError, OSError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker opens after consecutive failures and lets a single trial request through
+    once reset timeout has passed. Successful trial closes the circuit again.
+    """
+
+    def __init__(
+        self,
+        *,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self._clock = clock
+        self._failures: int = 0
+        self._opened_at: Optional[float] = None
+        self._trial: bool = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def available(self) -> bool:
+        if self._opened_at is None:
+            return True
+        # Half-open once reset timeout has passed, until the trial request is sent
+        return not self._trial and self._clock() - self._opened_at >= self.reset_timeout
+
+    def begin(self):
+        """Request is sent to the host, it is the trial request if the circuit is half-open"""
+        if self._opened_at is not None:
+            self._trial = True
+
+    def end(self):
+        """Request is done, trial that did not tell about the health of the host is allowed again"""
+        self._trial = False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self._failures += 1
+        # Failed trial opens the circuit again right away
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+        self._trial = False
+
+
+class OllamaEndpoint:
+    def __init__(self, host: Optional[str], *, breaker: Optional[CircuitBreaker] = None):
+        self.host: Optional[str] = host
+        self.client: AsyncClient = AsyncClient(host=host)
+        self.breaker: CircuitBreaker = breaker if breaker else CircuitBreaker()
+        self.in_flight: int = 0
+        self.available_models: Set[str] = set()
+        self.loaded_models: Set[str] = set()
+
+    def __repr__(self) -> str:
+        return f"OllamaEndpoint({self.host!r}, in_flight={self.in_flight}, open={self.breaker.is_open})"
+
+    async def refresh(self):
+        self.breaker.begin()
+        try:
+            available, loaded = await asyncio.gather(self.client.list(), self.client.ps())
+        except Exception as e:
+            if is_host_failure(e):
+                self.breaker.record_failure()
+            raise
+        finally:
+            self.breaker.end()
+        self.breaker.record_success()
+        self.available_models = {model["name"] for model in available["models"]}
+        self.loaded_models = {model["name"] for model in loaded["models"]}
+
+
+class OllamaPool:
+    """
+    OllamaPool routes requests over several Ollama hosts. Each request goes to the least loaded healthy host,
+    preferring hosts that already have the model loaded in memory.
+    """
+
+    def __init__(self, hosts: List[Optional[str]], *, refresh_interval: float = 10.0):
+        self.endpoints: List[OllamaEndpoint] = [OllamaEndpoint(host) for host in hosts]
+        self.refresh_interval: float = refresh_interval
+        self._refreshed_at: Optional[float] = None
+        # Created in the event loop that uses it, pool is shared by event loops of the server and tests
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._refresh_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loading: Set[str] = set()
+        self._failed: Set[str] = set()
+
+    @classmethod
+    def from_env(cls) -> OllamaPool:
+        endpoints = os.getenv("OLLAMA_ENDPOINT", None)
+        return cls(split_and_fix(endpoints, simple_host=True) if endpoints else [None])
+
+    @property
+    def default_host(self) -> Optional[str]:
+        return self.endpoints[0].host
+
+    def models(self) -> List[str]:
+        models: Set[str] = set()
+        for endpoint in self.endpoints:
+            if not endpoint.breaker.is_open:
+                models |= endpoint.available_models
+        return sorted(models)
+
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._refresh_lock is None or self._refresh_loop is not loop:
+            self._refresh_lock = asyncio.Lock()
+            self._refresh_loop = loop
+        return self._refresh_lock
+
+    async def refresh(self, *, force: bool = False):
+        async with self._lock():
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+                return
+            endpoints = [endpoint for endpoint in self.endpoints if endpoint.breaker.available()]
+            results = await asyncio.gather(*(endpoint.refresh() for endpoint in endpoints), return_exceptions=True)
+            for endpoint, result in zip(endpoints, results):
+                if isinstance(result, Exception):
+                    log.info(f"{endpoint} refresh failed: {result}")
+            self._refreshed_at = now
+
+    def select(self, model: str) -> OllamaEndpoint:
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.breaker.available()]
+        if not healthy:
+            msg = "No healthy Ollama endpoints available"
+            raise ConnectionError(msg)
+
+        def rank(endpoint: OllamaEndpoint):
+            # Resident model avoids load time, then available model avoids a pull error, then the least loaded host
+            return (model not in endpoint.loaded_models, model not in endpoint.available_models, endpoint.in_flight)
+
+        return min(healthy, key=rank)
+
+    @asynccontextmanager
+    async def acquire(self, model: str) -> AsyncIterator[OllamaEndpoint]:
+        await self.refresh()
+        endpoint = self.select(model)
+        endpoint.breaker.begin()
+        endpoint.in_flight += 1
+        try:
+            yield endpoint
+        except Exception as e:
+            if is_host_failure(e):
+                endpoint.breaker.record_failure()
+            raise
+        else:
+            endpoint.breaker.record_success()
+            endpoint.loaded_models.add(model)
+        finally:
+            endpoint.breaker.end()
+            endpoint.in_flight -= 1
+
+    def load_state(self, model: str) -> ModelLoadState:
+        if model in self._loading:
+            return ModelLoadState.loading
+        if any(model in endpoint.loaded_models for endpoint in self.endpoints if not endpoint.breaker.is_open):
+            return ModelLoadState.loaded
+        if model in self._failed:
+            return ModelLoadState.failed
+        return ModelLoadState.unloaded
+
+    async def warm_up(self, model: str, *, keep_alive: Optional[str] = None) -> ModelLoadState:
+        """
+        Load model into memory with an empty generate request so that the first question does not pay the load time.
+        Request goes to the same host that the pool would route chat requests to.
+        """
+        if model in self._loading:
+            return ModelLoadState.loading
+        self._loading.add(model)
+        self._failed.discard(model)
+        try:
+            async with self.acquire(model) as endpoint:
+                await endpoint.client.generate(model=model, prompt="", keep_alive=parse_keep_alive(keep_alive))
+        except Exception as e:  # noqa: BLE001
+            log.info(f"Warm up of {model} failed: {e}")
+            self._failed.add(model)
+        finally:
+            self._loading.discard(model)
+        return self.load_state(model)
+
+
+def parse_keep_alive(keep_alive: Optional[str]) -> Optional[Union[float, str]]:
+    # Ollama takes keep alive either as seconds or as duration string e.g. "30m"
+    return str_to_num(keep_alive) if keep_alive else None
+
+
+_pools: Dict[Optional[str], OllamaPool] = {}
+
+
+def get_pool() -> OllamaPool:
+    """Return the shared pool for the currently configured endpoints"""
+    endpoints = os.getenv("OLLAMA_ENDPOINT", None)
+    if endpoints not in _pools:
+        _pools[endpoints] = OllamaPool.from_env()
+    return _pools[endpoints]
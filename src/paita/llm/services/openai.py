@@ -48,10 +48,14 @@ class OpenAI(Service):
         return ChatOpenAI(
             model_name=self._settings_model.ai_model,
             streaming=self._settings_model.ai_streaming,
+            # Prompt prefixes are cached by OpenAI, usage tells how many tokens were cached
+            stream_usage=bool(self._settings_model.ai_prompt_cache),
             model_kwargs=model_kwargs,
             max_tokens=self._settings_model.ai_max_tokens,
             temperature=temperature,
+            # Throttled requests are retried by the request scheduler
+            max_retries=0,
             # n=settings_model.ai_n,
-            callbacks=[self._callback_handler],
+            callbacks=self._callbacks(),
             # callback_manager=callback_handler,
         )
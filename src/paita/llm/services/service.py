@@ -1,18 +1,24 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Optional
+from typing import TYPE_CHECKING, Any, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
+
+from paita.llm.enums import HistoryBackend
 
 if TYPE_CHECKING:
     from langchain_core.embeddings import Embeddings
     from langchain_core.language_models.chat_models import BaseChatModel
 
     from paita.llm.callbacks import AsyncHandler
+    from paita.llm.model_info import ModelInfo
 
 
 class Service:
-    def __init__(self, *, settings_model: LLMSettingsModel, callback_handler: AsyncHandler):
+    # True when the chat model continues a trailing assistant message instead of starting a new answer
+    assistant_prefill: bool = False
+
+    def __init__(self, *, settings_model: LLMSettingsModel, callback_handler: Optional[AsyncHandler] = None):
         self._settings_model = settings_model
         self._callback_handler = callback_handler
 
@@ -20,6 +26,11 @@ class Service:
     async def models(cls) -> [str]:
         raise NotImplementedError
 
+    @classmethod
+    async def model_info(cls, model_id: str) -> Optional[ModelInfo]:  # noqa: ARG003
+        """Capabilities reported by the AI Service, None if the AI Service doesn't report them"""
+        return None
+
     @classmethod
     def embeddings(cls, model_id: Optional[str] = None) -> Embeddings:
         raise NotImplementedError
@@ -27,6 +38,12 @@ class Service:
     def chat_model(self) -> BaseChatModel:
         raise NotImplementedError
 
+    def _callbacks(self) -> Optional[List[AsyncHandler]]:
+        return [self._callback_handler] if self._callback_handler else None
+
+
+DEFAULT_MAX_RETRIES = 3
+
 
 class LLMSettingsModel(BaseModel):
     version: float = 0.1
@@ -38,3 +55,18 @@ class LLMSettingsModel(BaseModel):
     ai_n: Optional[int] = 1
     ai_max_tokens: Optional[int] = 2048
     ai_history_depth: Optional[int] = 20
+    ai_requests_per_minute: Optional[int] = None
+    ai_tokens_per_minute: Optional[int] = None
+    ai_max_retries: int = Field(default=DEFAULT_MAX_RETRIES, ge=0)
+    ai_hedge_service: Optional[str] = None
+    ai_hedge_model: Optional[str] = None
+    ai_hedge_delay: Optional[float] = 5.0
+    ai_keep_alive: Optional[str] = None
+    ai_prompt_cache: Optional[bool] = False
+    history_backend: Optional[str] = HistoryBackend.file.value
+
+    @field_validator("ai_max_retries", mode="before")
+    @classmethod
+    def default_max_retries(cls, value: Any) -> Any:
+        # Settings saved by earlier versions may have no value
+        return DEFAULT_MAX_RETRIES if value is None else value
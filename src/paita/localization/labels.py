@@ -2,10 +2,19 @@ APP_TITLE = "paita"
 APP_SUBTITLE = "Python AI Textual Assistant"
 APP_AUTHOR = "paita"
 AI_PERSONA_PREFIX = "AI Persona:"
+AI_MODEL_SEARCH = "Search AI Models"
 AI_STREAMING = "Streaming"
 AI_MODEL_KWARGS = "Extra arguments to pass to model"
 AI_MAX_TOKENS = "Max tokens"
 AI_HISTORY_DEPTH = "History depth"
+AI_REQUESTS_PER_MINUTE = "Requests/min"
+AI_TOKENS_PER_MINUTE = "Tokens/min"
+AI_KEEP_ALIVE = "Keep alive"
+HISTORY_BACKEND = "History storage"
+AI_PROMPT_CACHE = "Prompt cache"
+AI_HEDGE_SERVICE = "Fallback AI Service"
+AI_HEDGE_MODEL = "Fallback AI Model"
+AI_HEDGE_DELAY = "Fallback after (s)"
 AI_N = "Number of response messages"
 
 APP_LIST_AI_SERVICES_MODELS = "Checking available AI Services and AI Models"
@@ -13,3 +22,20 @@ APP_LIST_AI_SERVICES_MODELS = "Checking available AI Services and AI Models"
 APP_ERROR_NO_AI_SERVICES_OR_MODELS = "No available AI Services or AI Models founds"
 
 APP_DIALOG_BUTTON_EXIT = "Exit"
+
+APP_DIALOG_BUTTON_CLOSE = "Close"
+
+APP_RESUME_INTERRUPTED = "Partial answer was kept, press ctrl+r to resume it"
+
+APP_QUEUED_PROMPTS = "{} queued"
+
+MESSAGE_SHOW_MORE = "Show more ({} parts, {} KB)"
+
+DEBUG_CACHE_TITLE = "Cache"
+DEBUG_CACHE_COLUMNS = ("Namespace", "Memory hits", "Disk hits", "Misses", "Evictions", "In memory", "Hit rate")
+
+APP_FORKED = "Forked to {}"
+APP_BUSY = "Wait for the answer to complete"
+
+BRANCH_TITLE = "Branches"
+BRANCH_MESSAGES = "{} messages"
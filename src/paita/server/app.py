@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+from typing import Any, Optional
+
+from aiohttp import web
+
+from paita.llm.chat import Chat
+from paita.llm.model_catalog import get_catalog
+from paita.llm.models import close_clients
+from paita.llm.scheduler import RequestStats
+from paita.localization import labels
+from paita.server.sessions import SessionStore, validate_session_id
+from paita.settings.llm_settings import LLMSettings
+from paita.utils.logger import log
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_CONCURRENCY = 8
+
+CHAT_KEY = web.AppKey("chat", Chat)
+SESSIONS_KEY = web.AppKey("sessions", SessionStore)
+SEMAPHORE_KEY = web.AppKey("semaphore", asyncio.Semaphore)
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def _session_id(request: web.Request) -> str:
+    try:
+        return validate_session_id(request.match_info["session_id"])
+    except ValueError as e:
+        raise web.HTTPBadRequest(reason=str(e)) from e
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response(
+        {
+            "status": "ok",
+            "sessions": len(request.app[SESSIONS_KEY]),
+        }
+    )
+
+
+async def get_messages(request: web.Request) -> web.Response:
+    session_id = _session_id(request)
+    messages = await request.app[SESSIONS_KEY].history(session_id).messages()
+    return web.json_response({"messages": [message.to_dict() for message in messages]})
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    session_id = _session_id(request)
+    await request.app[SESSIONS_KEY].delete(session_id)
+    return web.Response(status=204)
+
+
+async def post_message(request: web.Request) -> web.StreamResponse:
+    session_id = _session_id(request)
+    try:
+        body = await request.json()
+        data = body["input"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise web.HTTPBadRequest(reason='Expected JSON body {"input": "..."}') from e
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    chat = request.app[CHAT_KEY]
+    output = ""
+    stats = RequestStats()
+    # Requests of a single session are served in order, the semaphore caps requests to AI Services
+    async with request.app[SESSIONS_KEY].lock(session_id), request.app[SEMAPHORE_KEY]:
+        chunks = chat.stream(data, session_id=session_id, stats=stats)
+        try:
+            async for chunk in chunks:
+                output += chunk
+                if not await _send(response, "token", {"token": chunk}):
+                    # Partial answer stays in the journal and can be resumed
+                    log.info(f"Client of session {session_id} disconnected")
+                    await chunks.aclose()
+                    return response
+        except Exception as e:  # noqa: BLE001
+            log.exception(e)
+            await _send(response, "error", {"error": str(e)})
+        else:
+            await _send(response, "end", {"output": output, "stats": stats.model_dump()})
+
+    with contextlib.suppress(ConnectionResetError):
+        await response.write_eof()
+    return response
+
+
+async def _send(response: web.StreamResponse, event: str, data: Any) -> bool:
+    """Write event to the client, False if the client has disconnected"""
+    try:
+        await response.write(sse_event(event, data))
+    except ConnectionResetError:
+        return False
+    return True
+
+
+async def _close_clients(app: web.Application):  # noqa: ARG001
+    await close_clients()
+
+
+def create_app(
+    *,
+    chat: Chat,
+    sessions: SessionStore,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> web.Application:
+    app = web.Application()
+    app[CHAT_KEY] = chat
+    app[SESSIONS_KEY] = sessions
+    app[SEMAPHORE_KEY] = asyncio.Semaphore(max_concurrency)
+    app.on_cleanup.append(_close_clients)
+    app.add_routes(
+        [
+            web.get("/health", health),
+            web.get("/sessions/{session_id}/messages", get_messages),
+            web.post("/sessions/{session_id}/messages", post_message),
+            web.delete("/sessions/{session_id}", delete_session),
+        ]
+    )
+    return app
+
+
+async def init_app(*, max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> web.Application:
+    settings: LLMSettings = await LLMSettings.load(app_name=labels.APP_TITLE, app_author=labels.APP_AUTHOR)
+    if settings.model.ai_service is None or settings.model.ai_model is None:
+        msg = "AI Service and AI Model are not configured. Run 'paita' to configure them first."
+        raise ValueError(msg)
+
+    sessions = SessionStore(
+        app_name=labels.APP_TITLE, app_author=labels.APP_AUTHOR, backend=settings.model.history_backend
+    )
+    chat = Chat()
+    model_info = await get_catalog().get(ai_service=settings.model.ai_service, ai_model=settings.model.ai_model)
+    chat.init_model(settings_model=settings.model, history_factory=sessions.history, model_info=model_info)
+    return create_app(chat=chat, sessions=sessions, max_concurrency=max_concurrency)
+
+
+def main(args: Optional[list] = None):
+    parser = argparse.ArgumentParser(prog="paita-server", description=labels.APP_SUBTITLE)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="Maximum number of concurrent requests to AI Services",
+    )
+    parsed = parser.parse_args(args)
+    web.run_app(init_app(max_concurrency=parsed.max_concurrency), host=parsed.host, port=parsed.port)
+
+
+if __name__ == "__main__":
+    main()
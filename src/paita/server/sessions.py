@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import Dict
+
+from paita.llm.chat_history import ChatHistory
+from paita.llm.enums import HistoryBackend
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_session_id(session_id: str) -> str:
+    if not SESSION_ID_PATTERN.match(session_id):
+        msg = f"Invalid session id {session_id!r}"
+        raise ValueError(msg)
+    return session_id
+
+
+class SessionStore:
+    """
+    SessionStore keeps a chat history and a request lock for each session.
+    Histories are created lazily on first use.
+    """
+
+    def __init__(
+        self,
+        *,
+        app_name: str,
+        app_author: str,
+        file_history: bool = True,
+        backend: str = HistoryBackend.file.value,
+    ):
+        self._app_name: str = app_name
+        self._app_author: str = app_author
+        self._file_history: bool = file_history
+        self._backend: str = backend
+        self._histories: Dict[str, ChatHistory] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._histories)
+
+    def history(self, session_id: str) -> ChatHistory:
+        chat_history = self._histories.get(session_id)
+        if chat_history is None:
+            chat_history = ChatHistory(
+                app_name=self._app_name,
+                app_author=self._app_author,
+                file_history=self._file_history,
+                session_id=validate_session_id(session_id),
+                backend=self._backend,
+            )
+            self._histories[session_id] = chat_history
+        return chat_history
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    async def delete(self, session_id: str):
+        # Lock is kept so that requests waiting for it stay in order with requests made after the delete
+        async with self.lock(session_id):
+            chat_history = self.history(session_id)
+            await chat_history.clear()
+            chat_history.close()
+            del self._histories[session_id]
@@ -1,29 +1,31 @@
 from __future__ import annotations
 
-from typing import Any, List, Tuple
-
-from appdirs import user_config_dir
-from cache3 import DiskCache
+from typing import Any, List, Optional, Tuple
 
 from paita.llm.enums import Tag
 from paita.llm.models import list_all_models
 from paita.llm.services.service import LLMSettingsModel
-from paita.localization import labels
 from paita.settings.base_settings import BaseSettings, SettingsBackendType, load_and_parse
+from paita.utils.cache import CacheNamespace, TieredCache, get_cache
+from paita.utils.fuzzy_index import FuzzyIndex
 
 
 class LLMSettings(BaseSettings):
     FILE_NAME: str = "llm_settings.json"
-    CACHE_DIR = user_config_dir(appname=labels.APP_TITLE, appauthor=labels.APP_AUTHOR)
-    CACHE_NAME = "cache"
     CACHE_TTL = 24 * 60 * 60
 
     def __init__(
         self,
+        *,
+        cache: Optional[TieredCache] = None,
         **kwargs: Any,
     ):
         super().__init__(**kwargs)
-        self.cache: DiskCache = DiskCache(self.CACHE_DIR, self.CACHE_NAME)
+        self.cache: TieredCache = cache if cache else get_cache()
+        self._model_index: Optional[FuzzyIndex[Tuple[str, str]]] = None
+        self._ai_models: CacheNamespace = self.cache.namespace(
+            Tag.AI_MODELS.value, ttl=self.CACHE_TTL, max_memory_items=16
+        )
 
     @classmethod
     async def load(
@@ -58,22 +60,36 @@ class LLMSettings(BaseSettings):
             raise ValueError(msg)
         for key in all_models:
             if all_models[key]:
-                self.cache.set(key, all_models[key], self.CACHE_TTL, tag=Tag.AI_MODELS.value)
+                self._ai_models.set(key, all_models[key])
+            else:
+                # AI Service is no longer available, don't offer models of earlier runs
+                self._ai_models.delete(key)
+
+        self._model_index = None
 
-        available_ai_services: List[Tuple[str, str]] = list(self.cache.keys(tag=Tag.AI_MODELS.value))
+        available_ai_services: List[Tuple[str, str]] = self._ai_models.keys()
 
         if self.model.ai_service not in available_ai_services:
             self.model.ai_service = available_ai_services[0]
 
-            available_ai_models: List[Tuple[str, str]] = self.cache.get(
-                self.model.ai_service, [], tag=Tag.AI_MODELS.value
-            )
+            available_ai_models: List[Tuple[str, str]] = self._ai_models.get(self.model.ai_service, [])
 
             if self.model.ai_model not in available_ai_models:
                 self.model.ai_model = available_ai_models[0]
 
     def available_ai_services(self) -> list[tuple[Any, str]]:
-        return list(self.cache.keys(tag=Tag.AI_MODELS.value))
+        return self._ai_models.keys()
 
     def available_ai_models(self, ai_service: str, default: Any) -> List[str]:
-        return self.cache.get(ai_service, default, tag=Tag.AI_MODELS.value)
+        return self._ai_models.get(ai_service, default)
+
+    def model_index(self) -> FuzzyIndex[Tuple[str, str]]:
+        """Search index of (AI Service, AI Model) pairs over all cached AI Services, built once per refresh"""
+        if self._model_index is None:
+            pairs = [
+                (ai_service, ai_model)
+                for ai_service in sorted(self.available_ai_services())
+                for ai_model in self.available_ai_models(ai_service, [])
+            ]
+            self._model_index = FuzzyIndex(pairs, key=lambda pair: pair[1])
+        return self._model_index
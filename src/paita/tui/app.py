@@ -1,26 +1,41 @@
+import argparse
+import asyncio
 import os
+import time
 from enum import Enum
 from pathlib import PurePath
-from typing import Optional, Union
+from typing import TYPE_CHECKING, AsyncIterator, Optional, Union
 
 from appdirs import user_config_dir
 from textual.app import App, ComposeResult, Widget
 from textual.binding import Binding
 from textual.containers import Container, Horizontal, VerticalScroll
-from textual.widgets import Button, Footer, Header, Input, LoadingIndicator
+from textual.screen import Screen
+from textual.widgets import Button, Footer, Header, Input, Label, LoadingIndicator
 
+import paita
 from paita.llm.callbacks import AsyncHandler
 from paita.llm.chat import Chat
 from paita.llm.chat_history import ChatHistory
+from paita.llm.model_catalog import get_catalog
+from paita.llm.models import close_clients, warm_up_model
+from paita.llm.recording import RecordingHandler, ReplayChatModel
 from paita.llm.services.service import LLMSettingsModel
 from paita.localization import labels
 from paita.settings.llm_settings import LLMSettings
+from paita.tui.branch_screen import BranchScreen
+from paita.tui.debug_screen import DebugScreen
 from paita.tui.error_screen import ErrorScreen
 from paita.tui.llm_settings_screen import LLMSettingsScreen
-from paita.tui.message_box import MessageBox
+from paita.tui.markdown_parser import markdown_cache
+from paita.tui.message_box import MessageBox, MessageContent
 from paita.tui.multi_line_input import MultiLineInput
 from paita.tui.wait_screen import WaitScreen
 from paita.utils.logger import log
+from paita.utils.profiler import Profiler, phase
+
+if TYPE_CHECKING:
+    from textual.worker import Worker
 
 
 class Role(Enum):
@@ -32,6 +47,9 @@ class Role(Enum):
 
 TEXT_AREA = True
 
+# Queued in place of a question to resume the interrupted answer
+RESUME = object()
+
 
 class ChatApp(App):
     TITLE = labels.APP_TITLE
@@ -41,22 +59,41 @@ class ChatApp(App):
     BINDINGS = [
         Binding("ctrl+q", "quit", "Quit", key_display="ctrl+q"),
         Binding("ctrl+x", "clear", "Clear", key_display="ctrl+x"),
+        Binding("ctrl+r", "resume", "Resume", key_display="ctrl+r"),
+        Binding("ctrl+b", "branches", "Branches", key_display="ctrl+b"),
         Binding("ctrl+1", "llm_settings", "LLM Settings", key_display="ctrl+1"),
+        Binding("ctrl+2", "debug", "Debug", key_display="ctrl+2"),
     ]
 
-    def __init__(self):
+    def __init__(
+        self,
+        *,
+        profiler: Optional[Profiler] = None,
+        record_dir: Optional[str] = None,
+        replay_model: Optional[ReplayChatModel] = None,
+    ):
         super().__init__()
+        self._profiler: Optional[Profiler] = profiler
+        self._record_dir: Optional[str] = record_dir
+        self._replay_model: Optional[ReplayChatModel] = replay_model
 
         self.settings: Optional[LLMSettings] = None
         config_dir = user_config_dir(appname=labels.APP_TITLE, appauthor=labels.APP_AUTHOR)
         if not os.path.exists(config_dir):
             os.makedirs(config_dir)
 
-        self._chat_history = ChatHistory(app_name=labels.APP_TITLE, app_author=labels.APP_AUTHOR)
+        # Created when settings are loaded, they tell which history backend to use
+        self._chat_history: Optional[ChatHistory] = None
 
         self._chat: Optional[Chat] = None
 
+        # Prompts of the chat session are dispatched in order by a single worker. Queue is created in on_mount
+        # so that it belongs to the event loop of the app on Python 3.8 and 3.9.
+        self._prompts: Optional[asyncio.Queue] = None
+        self._prompt_worker: Optional[Worker] = None
+        self._requesting: bool = False
         self._current_message: Union[MessageBox or None] = None
+        self._interrupted_message: Optional[MessageBox] = None
         self._current_id: str = "id_0"
         self._last_focused: Union[Widget or None] = None
 
@@ -72,6 +109,7 @@ class ChatApp(App):
                 else:
                     yield Input(id="input")
                 yield Button("Send", variant="success", id="send_button")
+                yield Label(id="queue_depth")
         yield Footer()
 
     # Action handlers
@@ -84,6 +122,44 @@ class ChatApp(App):
         if event.input.id in ("input", "multi_line_input"):
             await self.process_conversation()
 
+    def on_message_content_quoted(self, event: MessageContent.Quoted) -> None:
+        if TEXT_AREA:
+            text_input: MultiLineInput = self.query_one("#multi_line_input", MultiLineInput)
+            text_input.text += event.text
+        else:
+            text_input: Input = self.query_one("#input", Input)
+            text_input.value += event.text
+        text_input.focus()
+
+    async def on_message_content_forked(self, event: MessageContent.Forked) -> None:
+        if self._requesting or not self._prompts.empty():
+            self.notify(labels.APP_BUSY)
+            return
+        message_boxes = list(self.query_one("#conversation").query(MessageBox))
+        index = message_boxes.index(event.message_box)
+        # Interrupted answer is not in history yet
+        if index >= self._chat_history.tree.length():
+            return
+        # Question is asked again on the new branch, answer is followed up
+        question = event.message_box.role == "question"
+        name = self._chat_history.tree.fork(length=index if question else index + 1)
+        await self._remount_conversation()
+        if question:
+            if TEXT_AREA:
+                text_input: MultiLineInput = self.query_one("#multi_line_input", MultiLineInput)
+                text_input.text = event.message_box.data
+            else:
+                text_input: Input = self.query_one("#input", Input)
+                text_input.value = event.message_box.data
+            text_input.focus()
+        self.notify(labels.APP_FORKED.format(name))
+
+    def action_branches(self) -> None:
+        tree = self._chat_history.tree
+        branches = tree.branches()
+        previews = [str(tree.messages(branch.name)[-1].content) if branch.length else "" for branch in branches]
+        self.push_screen(BranchScreen(branches, current=tree.branch, previews=previews), self.switch_branch)
+
     def action_llm_settings(self, allow_cancel: bool = False) -> None:  # noqa: FBT001, FBT002
         settings_screen = LLMSettingsScreen(
             settings=self.settings,
@@ -97,36 +173,75 @@ class ChatApp(App):
         )
 
     async def action_clear(self) -> None:
-        await self._chat_history.history.aclear()
+        await self._chat_history.clear()
+        await self._remount_conversation()
+
+    async def _remount_conversation(self) -> None:
+        self._interrupted_message = None
         await self.query_one("#conversation").remove()
         await self.query_one("#body").mount(VerticalScroll(id="conversation"))
+        await self._mount_chat_history()
+
+    def action_debug(self) -> None:
+        if self.settings is not None:
+            self.push_screen(DebugScreen([self.settings.cache, markdown_cache()]))
+
+    def action_resume(self) -> None:
+        if self._chat is None:
+            return
+        self._enqueue(RESUME)
 
     def action_quit(self) -> None:
-        self.settings.cache.clear()
         self.exit()
 
     # Callbacks
 
-    def exit_settings(self, changed: bool = False):  # noqa: FBT001, FBT002
-        if changed:
-            self.init_chat()
+    async def switch_branch(self, name: Optional[str]):
+        if name is None or name == self._chat_history.tree.branch:
+            return
+        if self._requesting or not self._prompts.empty():
+            self.notify(labels.APP_BUSY)
+            return
+        self._chat_history.tree.switch(name)
+        await self._remount_conversation()
 
-    async def on_mount(self):
-        await self._mount_chat_history()
-        await self.push_screen(WaitScreen(labels.APP_LIST_AI_SERVICES_MODELS))
+    async def exit_settings(self, changed: bool = False):  # noqa: FBT001, FBT002
+        if not changed:
+            return
+        if self.settings.model.history_backend != self._chat_history.backend:
+            if self._requesting or not self._prompts.empty():
+                # History is switched when settings are applied next time
+                self.notify(labels.APP_BUSY)
+            else:
+                self._chat_history.close()
+                self._chat_history = self._open_chat_history()
+                await self._remount_conversation()
+        self.init_chat()
 
+    async def on_mount(self):
+        self._prompts = asyncio.Queue()
+        if self._profiler is not None:
+            self.run_worker(self._profiler.sample_loop(), group="profiler")
         settings_exists = False
         try:
-            self.settings: LLMSettings = await LLMSettings.load(app_name=labels.APP_TITLE, app_author=labels.APP_AUTHOR)
+            with phase(self._profiler, "settings load"):
+                self.settings: LLMSettings = await LLMSettings.load(
+                    app_name=labels.APP_TITLE, app_author=labels.APP_AUTHOR
+                )
             settings_exists = True
         except FileNotFoundError:
             self.settings = LLMSettings(
                 app_name=labels.APP_TITLE,
                 app_author=labels.APP_AUTHOR,
             )
+        with phase(self._profiler, "history mount"):
+            self._chat_history = self._open_chat_history()
+            await self._mount_chat_history()
+        await self.push_screen(WaitScreen(labels.APP_LIST_AI_SERVICES_MODELS))
 
         try:
-            await self.settings.refresh_llms()
+            with phase(self._profiler, "model discovery"):
+                await self.settings.refresh_llms()
         except ValueError as e:
             log.error(e)
             await self.pop_screen()
@@ -145,11 +260,21 @@ class ChatApp(App):
         else:
             self.action_llm_settings(allow_cancel=False)
 
+    def _open_chat_history(self) -> ChatHistory:
+        return ChatHistory(
+            app_name=labels.APP_TITLE,
+            app_author=labels.APP_AUTHOR,
+            backend=self.settings.model.history_backend,
+        )
+
+    async def on_unmount(self):
+        await close_clients()
+
     def init_chat(self):
         if self._chat is None:
             self._chat = Chat()
 
-        callback_handler = AsyncHandler()
+        callback_handler = RecordingHandler(self._record_dir) if self._record_dir else AsyncHandler()
         callback_handler.register_callbacks(self.callback_on_token, self.callback_on_end, self.callback_on_error)
 
         try:
@@ -157,11 +282,16 @@ class ChatApp(App):
                 settings_model=self.settings.model,
                 chat_history=self._chat_history,
                 callback_handler=callback_handler,
+                chat_model=self._replay_model,
             )
             if TEXT_AREA:
                 self.query_one("#multi_line_input").focus()
             else:
                 self.query_one("#input").focus()
+            self.run_worker(self._warm_up_model(), group="warm_up", exclusive=True)
+            if self._prompt_worker is None:
+                self._prompt_worker = self.run_worker(self._process_prompts(), group="prompts")
+            self.run_worker(self._load_model_info(), group="model_info", exclusive=True)
         except ValueError:
             self.settings = LLMSettings(
                 settings_model=LLMSettingsModel(),
@@ -170,6 +300,20 @@ class ChatApp(App):
             )
             self.action_llm_settings(allow_cancel=False)
 
+    async def _warm_up_model(self):
+        model = self.settings.model
+        self.sub_title = f"{labels.APP_SUBTITLE} - {model.ai_model}"
+        state = await warm_up_model(
+            ai_service=model.ai_service, ai_model=model.ai_model, keep_alive=model.ai_keep_alive
+        )
+        if state is not None:
+            self.sub_title = f"{labels.APP_SUBTITLE} - {model.ai_model} ({state.value})"
+
+    async def _load_model_info(self):
+        model = self.settings.model
+        self._chat.model_info = await get_catalog().get(ai_service=model.ai_service, ai_model=model.ai_model)
+        log.debug(f"{self._chat.model_info=}")
+
     async def process_conversation(self) -> None:
         if TEXT_AREA:
             text_input: MultiLineInput = self.query_one("#multi_line_input", MultiLineInput)
@@ -178,40 +322,88 @@ class ChatApp(App):
             text_input: Input = self.query_one("#input", Input)
             question = text_input.value
 
-        if question == "":
+        if question == "" or self._chat is None:
             return
 
-        button = self.query_one("#send_button")
-        conversation = self.query_one("#conversation")
-
-        self.toggle_widgets(text_input, button)
-
         with text_input.prevent(Input.Changed):
             if TEXT_AREA:
                 text_input.text = ""
             else:
                 text_input.value = ""
 
+        # Input stays live while an answer streams, later prompts wait in the queue
+        self._enqueue(question)
+
+    def _enqueue(self, prompt: Union[str, object]) -> None:
+        self._prompts.put_nowait(prompt)
+        self._show_queue_depth()
+
+    def _show_queue_depth(self) -> None:
+        queue_depth = self.query_one("#queue_depth", Label)
+        queue_depth.update(labels.APP_QUEUED_PROMPTS.format(self._prompts.qsize()))
+        queue_depth.display = not self._prompts.empty()
+
+    async def _process_prompts(self) -> None:
+        while True:
+            prompt = await self._prompts.get()
+            self._show_queue_depth()
+            self._requesting = True
+            try:
+                if prompt is RESUME:
+                    await self._resume()
+                else:
+                    await self._ask(prompt)
+            except Exception as e:  # noqa: BLE001
+                # Worker keeps serving the queue, only cancellation ends it
+                log.exception(e)
+                self.exit_error_screen(await self.push_screen_wait(ErrorScreen(str(e))))
+            finally:
+                self._requesting = False
+
+    async def _ask(self, question: str) -> None:
+        # Interrupted answer is moved to history as is
+        self._interrupted_message = None
+        conversation = self.query_one("#conversation")
         await conversation.mount(
             MessageBox(question, role="question"),
             LoadingIndicator(),
         )
         conversation.scroll_end(animate=False)
 
+        await self._request(self._chat.stream(question))
+
+    async def _resume(self) -> None:
+        if self._chat_history.interrupted() is None:
+            return
+
+        # Continuation is stitched onto the partial answer
+        self._current_message, self._interrupted_message = self._interrupted_message, None
+        if self._current_message is None:
+            conversation = self.query_one("#conversation")
+            await conversation.mount(LoadingIndicator())
+            conversation.scroll_end(animate=False)
+
+        await self._request(self._chat.resume())
+
+    async def _request(self, chunks: AsyncIterator[str]) -> None:
         try:
-            await self._chat.request(question)
+            async for _ in chunks:
+                pass
         except ValueError as e:
             error = str(e)
             log.info(error)
-            await self.push_screen(ErrorScreen(error), self.exit_error_screen)
+            self._keep_interrupted()
+            self.exit_error_screen(await self.push_screen_wait(ErrorScreen(self._error_text(error))))
         except Exception as e:  # noqa: BLE001
             error = str(e)
             log.exception(e)
-            await self.push_screen(ErrorScreen(error), self.exit_error_screen)
+            self._keep_interrupted()
+            self.exit_error_screen(await self.push_screen_wait(ErrorScreen(self._error_text(error))))
 
-    def toggle_widgets(self, *widgets: Widget) -> None:
-        for w in widgets:
-            w.disabled = not w.disabled
+    def _error_text(self, error: str) -> str:
+        if self._chat_history.interrupted() is not None:
+            return f"{error}\n\n{labels.APP_RESUME_INTERRUPTED}"
+        return error
 
     def callback_on_token(self, data: str):
         if self._current_message is None:
@@ -231,49 +423,85 @@ class ChatApp(App):
             self._current_message = MessageBox(data, role="answer")
             conversation.mount(self._current_message)
 
-        self._current_message.flush()
+        self._current_message.flush(complete=True)
         self._current_message = None
 
-        text_input = self.query_one("#multi_line_input") if TEXT_AREA else self.query_one("#input")
-        button = self.query_one("#send_button")
-        self.toggle_widgets(text_input, button)
-        text_input.focus()
-
     def callback_on_error(self, error):
+        # Error is shown once Chat.request gives up, throttled requests may still be retried
+        log.info(error)
+        self._keep_interrupted()
+
+    def _keep_interrupted(self):
         if self._current_message:
-            loading_indication = self.query_one(LoadingIndicator)
-            loading_indication.remove()
             self._current_message.flush()
+            self._interrupted_message = self._current_message
             self._current_message = None
 
-        self.push_screen(ErrorScreen(str(error)), self.exit_error_screen)
-
     def exit_error_screen(self, exit_app: bool = False):  # noqa: FBT001, FBT002
         if exit_app:
             self.exit()
 
-        loading_indication = self.query_one(LoadingIndicator)
-        loading_indication.remove()
+        self.query(LoadingIndicator).remove()
 
         text_input = self.query_one("#multi_line_input") if TEXT_AREA else self.query_one("#input")
-        button = self.query_one("#send_button")
-        self.toggle_widgets(text_input, button)
-
         text_input.focus()
 
     async def _mount_chat_history(self):
         messages = await self._chat_history.messages()
         message_boxes: [MessageBox] = [
-            MessageBox(data=message.content, role=message.role.value) for message in messages
+            MessageBox(data=message.content, role=message.role.value, cache_tokens=True) for message in messages
         ]
+        # Answer interrupted by a crash can be resumed, or it is moved to history with the next question
+        interrupted = self._chat_history.interrupted()
+        if interrupted is not None:
+            question, partial = interrupted
+            self._interrupted_message = MessageBox(partial, role="answer")
+            message_boxes.extend([MessageBox(question, role="question", cache_tokens=True), self._interrupted_message])
         conversation = self.query_one("#conversation")
         await conversation.mount_all(message_boxes)
         conversation.scroll_end(animate=False)
 
 
-def main():
-    app = ChatApp()
-    app.run()
+def main(args: Optional[list] = None):
+    parser = argparse.ArgumentParser(prog=labels.APP_TITLE, description=labels.APP_SUBTITLE)
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=".",
+        metavar="DIR",
+        help="Profile startup and streaming, and write the profile and a summary report to DIR",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="Record streamed tokens with their timing and the final result of each answer to DIR",
+    )
+    parser.add_argument("--replay", metavar="FILE", help="Answer by replaying a recording instead of an AI Model")
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        metavar="N",
+        help="Replay N times faster than recorded, 0 replays without delays",
+    )
+    parsed = parser.parse_args(args)
+    replay_model = ReplayChatModel.from_file(parsed.replay, speed=parsed.replay_speed) if parsed.replay else None
+    if parsed.profile is None:
+        ChatApp(record_dir=parsed.record, replay_model=replay_model).run()
+        return
+
+    profiler = Profiler()
+    profiler.add_phase("imports", time.perf_counter() - paita.STARTED_AT)
+    with profiler.recording():
+        app = ChatApp(profiler=profiler, record_dir=parsed.record, replay_model=replay_model)
+        profiler.instrument(app, "callback_on_token")
+        profiler.instrument(app, "_request", label="request", streaming=True)
+        profiler.instrument(MessageBox, "_markdown_update")
+        profiler.instrument(Screen, "_refresh_layout", label="layout")
+        app.run()
+    profile_path, summary_path = profiler.write(parsed.profile)
+    print(profiler.summary())  # noqa: T201
+    print(f"Profile written to {profile_path} and {summary_path}")  # noqa: T201
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from pathlib import PurePath
+from typing import TYPE_CHECKING, List, Optional
+
+from rich.text import Text
+from textual.binding import Binding
+from textual.containers import Horizontal, Vertical
+from textual.screen import ModalScreen
+from textual.widgets import Button, Label, OptionList
+from textual.widgets.option_list import Option
+
+from paita.localization import labels
+
+if TYPE_CHECKING:
+    from textual.app import ComposeResult
+
+    from paita.llm.history_tree import Branch
+
+PREVIEW_LENGTH = 60
+
+
+class BranchScreen(ModalScreen[Optional[str]]):
+    """
+    List of conversation branches. Selecting a branch dismisses the screen with its name.
+    """
+
+    CSS_PATH = PurePath(__file__).parent / "styles" / "branch_screen.tcss"
+    BINDINGS = [Binding("escape", "close", "Close")]
+
+    def __init__(self, branches: List[Branch], *, current: str, previews: List[str]):
+        super().__init__()
+        self._branches: List[Branch] = branches
+        self._current: str = current
+        self._previews: List[str] = previews
+
+    def compose(self) -> ComposeResult:
+        with Vertical(id="branch_screen_vertical"):
+            yield Label(labels.BRANCH_TITLE, id="branch_screen_label")
+            yield OptionList(
+                *(
+                    Option(
+                        Text.assemble(
+                            (branch.name, "bold" if branch.name == self._current else ""),
+                            "  ",
+                            (labels.BRANCH_MESSAGES.format(branch.length), "dim"),
+                            "  ",
+                            preview[:PREVIEW_LENGTH].replace("\n", " "),
+                        ),
+                        id=branch.name,
+                    )
+                    for branch, preview in zip(self._branches, self._previews)
+                ),
+                id="branch_screen_branches",
+            )
+            with Horizontal(id="branch_screen_button_block"):
+                yield Button(labels.APP_DIALOG_BUTTON_CLOSE, variant="primary", id="branch_screen_button")
+
+    def on_mount(self) -> None:
+        options = self.query_one(OptionList)
+        options.highlighted = [branch.name for branch in self._branches].index(self._current)
+        options.focus()
+
+    def on_option_list_option_selected(self, event: OptionList.OptionSelected) -> None:
+        event.stop()
+        self.dismiss(event.option.id)
+
+    def action_close(self) -> None:
+        self.dismiss(None)
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id == "branch_screen_button":
+            self.dismiss(None)
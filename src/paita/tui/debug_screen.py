@@ -0,0 +1,56 @@
+from pathlib import PurePath
+from typing import List
+
+from textual.app import ComposeResult
+from textual.binding import Binding
+from textual.containers import Horizontal, Vertical
+from textual.screen import ModalScreen
+from textual.widgets import Button, DataTable, Label
+
+from paita.localization import labels
+from paita.utils.cache import TieredCache
+
+
+class DebugScreen(ModalScreen[bool]):
+    CSS_PATH = PurePath(__file__).parent / "styles" / "debug_screen.tcss"
+    BINDINGS = [Binding("escape", "close", "Close")]
+
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, caches: List[TieredCache]):
+        super().__init__()
+        self._caches: List[TieredCache] = caches
+
+    def compose(self) -> ComposeResult:
+        with Vertical(id="debug_screen_vertical"):
+            yield Label(labels.DEBUG_CACHE_TITLE, id="debug_screen_label")
+            yield DataTable(id="debug_screen_cache", cursor_type="none", zebra_stripes=True)
+            with Horizontal(id="debug_screen_button_block"):
+                yield Button(labels.APP_DIALOG_BUTTON_CLOSE, variant="primary", id="debug_screen_button")
+
+    def on_mount(self) -> None:
+        self.query_one(DataTable).add_columns(*labels.DEBUG_CACHE_COLUMNS)
+        self.refresh_stats()
+        self.set_interval(self.REFRESH_INTERVAL, self.refresh_stats)
+
+    def refresh_stats(self) -> None:
+        table = self.query_one(DataTable)
+        table.clear()
+        namespaces = [item for cache in self._caches for item in cache.stats().items()]
+        for name, stats in sorted(namespaces, key=lambda item: item[0]):
+            table.add_row(
+                name,
+                stats.memory_hits,
+                stats.disk_hits,
+                stats.misses,
+                stats.evictions,
+                stats.memory_items,
+                f"{stats.hit_rate:.0%}",
+            )
+
+    def action_close(self) -> None:
+        self.dismiss(False)
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id == "debug_screen_button":
+            self.dismiss(False)
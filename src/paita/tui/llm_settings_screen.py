@@ -1,18 +1,25 @@
 from pathlib import PurePath
+from typing import TYPE_CHECKING
 
-from textual import on
+from textual import on, work
 from textual.app import ComposeResult
 from textual.containers import Container, Horizontal, VerticalScroll
 from textual.screen import ModalScreen
 from textual.validation import Function, Number
-from textual.widgets import Button, Checkbox, Header, Input, Select, TextArea
+from textual.widgets import Button, Checkbox, Header, Input, Label, Select, TextArea
 
 import paita.localization.labels as label
-from paita.llm.services.service import LLMSettingsModel
+from paita.llm.enums import HistoryBackend, ModelLoadState
+from paita.llm.model_catalog import get_catalog
+from paita.llm.models import warm_up_model
 from paita.settings.llm_settings import LLMSettings
+from paita.tui.model_picker import ModelPicker
 from paita.utils.logger import log
 from paita.utils.string_utils import dict_to_str, str_to_dict, str_to_num, to_str
 
+if TYPE_CHECKING:
+    from paita.llm.services.service import LLMSettingsModel
+
 
 class LLMSettingsScreen(ModalScreen[bool]):
     CSS_PATH = PurePath(__file__).parent / "styles" / "llm_settings_screen.tcss"
@@ -27,15 +34,28 @@ class LLMSettingsScreen(ModalScreen[bool]):
         self.settings: LLMSettings = settings
         self.settings.model = settings.model.model_copy()
         self.allow_cancel: bool = allow_cancel
+        # AI Service whose models are listed in the AI Model select
+        self._ai_service = self.settings.model.ai_service
 
         self.available_ai_services = self.settings.available_ai_services()
         self.available_ai_models = self.settings.available_ai_models(self.settings.model.ai_service, None)
+        self.available_hedge_models = (
+            self.settings.available_ai_models(self.settings.model.ai_hedge_service, [])
+            if self.settings.model.ai_hedge_service
+            else []
+        )
         log.debug(f"{self.available_ai_services=} {self.available_ai_models=}")
 
     def compose(self) -> ComposeResult:
         yield Header()
         with Container(classes="llm_settings"):
             with VerticalScroll(id="llm_settings"):
+                yield ModelPicker(
+                    self.settings.model_index(),
+                    placeholder=label.AI_MODEL_SEARCH,
+                    id="ai_model_picker",
+                    classes="settings_picker",
+                )
                 with Horizontal(classes="settings_invisible_block"):
                     yield Select(
                         [(item, item) for item in self.available_ai_services],
@@ -59,7 +79,16 @@ class LLMSettingsScreen(ModalScreen[bool]):
                         id="ai_streaming",
                         classes="settings_checkbox",
                     )
+                    yield Checkbox(
+                        label.AI_PROMPT_CACHE,
+                        value=bool(self.settings.model.ai_prompt_cache),
+                        id="ai_prompt_cache",
+                        classes="settings_checkbox",
+                    )
                     # yield Button(label="Refresh", variant="success", id="ai_refresh")  # TODO: ai refresh
+                with Horizontal(classes="settings_invisible_block"):
+                    yield Label("", id="ai_model_state", classes="settings_label")
+                    yield Label("", id="ai_model_info", classes="settings_label")
 
                 yield TextArea(
                     text=self.settings.model.ai_persona,
@@ -75,6 +104,13 @@ class LLMSettingsScreen(ModalScreen[bool]):
                         classes="settings_input",
                         validators=[Function(self.validate_ai_model_kwargs, "Invalid dictionary")],
                     )
+                    yield Input(
+                        placeholder=label.AI_KEEP_ALIVE,
+                        value=self.settings.model.ai_keep_alive or "",
+                        id="ai_keep_alive",
+                        classes="settings_small_input",
+                        max_length=8,
+                    )
                     yield Input(
                         placeholder=label.AI_MAX_TOKENS,
                         value=to_str(self.settings.model.ai_max_tokens),
@@ -93,6 +129,24 @@ class LLMSettingsScreen(ModalScreen[bool]):
                         validators=[Number(minimum=0, maximum=100)],
                         max_length=3,
                     )
+                    yield Input(
+                        placeholder=label.AI_REQUESTS_PER_MINUTE,
+                        value=to_str(self.settings.model.ai_requests_per_minute or ""),
+                        id="ai_requests_per_minute",
+                        classes="settings_small_input",
+                        type="integer",
+                        validators=[Number(minimum=1, maximum=999999)],
+                        max_length=6,
+                    )
+                    yield Input(
+                        placeholder=label.AI_TOKENS_PER_MINUTE,
+                        value=to_str(self.settings.model.ai_tokens_per_minute or ""),
+                        id="ai_tokens_per_minute",
+                        classes="settings_small_input",
+                        type="integer",
+                        validators=[Number(minimum=1, maximum=999999999)],
+                        max_length=9,
+                    )
                     # yield Input(
                     #     placeholder=label.AI_N,
                     #     value=to_str(self.llm_settings.settings_model.ai_n),
@@ -103,6 +157,39 @@ class LLMSettingsScreen(ModalScreen[bool]):
                     #     max_length=4,
                     # )
 
+                with Horizontal(classes="settings_invisible_block"):
+                    yield Select(
+                        [(item, item) for item in self.available_ai_services],
+                        value=self.settings.model.ai_hedge_service or Select.BLANK,
+                        prompt=label.AI_HEDGE_SERVICE,
+                        id="ai_hedge_service",
+                        classes="settings_small_option",
+                    )
+                    yield Select(
+                        [(item, item) for item in self.available_hedge_models],
+                        value=self.settings.model.ai_hedge_model or Select.BLANK,
+                        prompt=label.AI_HEDGE_MODEL,
+                        id="ai_hedge_model",
+                        classes="settings_option",
+                    )
+                    yield Input(
+                        placeholder=label.AI_HEDGE_DELAY,
+                        value=to_str(self.settings.model.ai_hedge_delay),
+                        id="ai_hedge_delay",
+                        classes="settings_small_input",
+                        type="number",
+                        validators=[Number(minimum=0, maximum=600)],
+                        max_length=5,
+                    )
+                    yield Select(
+                        [(item.value, item.value) for item in HistoryBackend],
+                        value=self.settings.model.history_backend,
+                        prompt=label.HISTORY_BACKEND,
+                        id="history_backend",
+                        classes="settings_small_option",
+                        allow_blank=False,
+                    )
+
                 with Horizontal(classes="settings_block"):
                     yield Button(label="Apply", variant="success", id="apply")
                     if self.allow_cancel:
@@ -120,29 +207,71 @@ class LLMSettingsScreen(ModalScreen[bool]):
     async def on_mount(self) -> None:
         if self.settings.model.ai_service is Select.BLANK or self.settings.model.ai_model is Select.BLANK:
             self.query_one("#apply").disabled = True
+        else:
+            self.warm_up_model(self.settings.model.ai_service, self.settings.model.ai_model)
+            self.show_model_info(self.settings.model.ai_service, self.settings.model.ai_model)
+
+    @work(exclusive=True, group="warm_up")
+    async def warm_up_model(self, ai_service: str, ai_model: str) -> None:
+        state_label: Label = self.query_one("#ai_model_state", Label)
+        state_label.update(f"{ai_model}: {ModelLoadState.loading.value}")
+        keep_alive = self.query_one("#ai_keep_alive", Input).value or None
+        state = await warm_up_model(ai_service=ai_service, ai_model=ai_model, keep_alive=keep_alive)
+        state_label.update("" if state is None else f"{ai_model}: {state.value}")
+
+    @work(exclusive=True, group="model_info")
+    async def show_model_info(self, ai_service: str, ai_model: str) -> None:
+        model_info = await get_catalog().get(ai_service=ai_service, ai_model=ai_model)
+        self.query_one("#ai_model_info", Label).update(model_info.summary())
+        # Don't ask for more output than the model can produce
+        max_tokens: Input = self.query_one("#ai_max_tokens", Input)
+        if model_info.max_output_tokens and max_tokens.value and int(max_tokens.value) > model_info.max_output_tokens:
+            max_tokens.value = str(model_info.max_output_tokens)
 
     @on(Checkbox.Changed)
     async def checkbox_changed(self, event: Checkbox.Changed) -> None:
-        self.query_one("#ai_persona").disabled = event.checkbox.value
+        if event.checkbox.id == "ai_streaming":
+            self.query_one("#ai_persona").disabled = event.checkbox.value
+
+    @on(ModelPicker.Selected)
+    def model_picked(self, event: ModelPicker.Selected) -> None:
+        service_select: Select = self.query_one("#ai_service", Select)
+        model_select: Select = self.query_one("#ai_model", Select)
+        if event.ai_service != self._ai_service:
+            self._ai_service = event.ai_service
+            models = self.settings.available_ai_models(event.ai_service, [])
+            model_select.set_options((item, item) for item in models)
+            service_select.value = event.ai_service
+        model_select.value = event.ai_model
+        model_select.focus()
 
     @on(Select.Changed)
     async def select_changed(self, event: Select.Changed) -> None:
         if event.control.id == "ai_service":
             value = event.value
-            if value == self.settings.model.ai_service:
+            if value == self._ai_service:
                 return
-            self.settings.ai_service = value
+            self._ai_service = value
 
             log.debug(f"{event.value}")
             models = self.settings.available_ai_models(event.value, Select.BLANK)
             widget: Select = self.query_one("#ai_model", Select)
             widget.set_options((item, item) for item in models)
+        elif event.control.id == "ai_hedge_service":
+            models = self.settings.available_ai_models(event.value, []) if event.value is not Select.BLANK else []
+            widget: Select = self.query_one("#ai_hedge_model", Select)
+            widget.set_options((item, item) for item in models)
+        elif event.control.id in ("ai_hedge_model", "history_backend"):
+            pass
         elif event.control.id == "ai_model":
             value = event.value
             if value == self.settings.model.ai_model:
                 return
             self.settings.ai_model = value
             self.query_one("#apply").disabled = False
+            if value is not Select.BLANK:
+                self.warm_up_model(self.query_one("#ai_service", Select).value, value)
+                self.show_model_info(self.query_one("#ai_service", Select).value, value)
         else:
             log.error(f"Undefined {event.control.id=}")
 
@@ -158,26 +287,42 @@ class LLMSettingsScreen(ModalScreen[bool]):
         #     self.parent.pop_screen()
         #     return
 
-        model: LLMSettingsModel = LLMSettingsModel(
-            ai_service=self.query_one("#ai_service", Select).value,
-            ai_model=self.query_one("#ai_model", Select).value,
+        # Start from current settings so that settings not shown on this screen are preserved
+        model: LLMSettingsModel = self.settings.model.model_copy(
+            update={
+                "ai_service": self.query_one("#ai_service", Select).value,
+                "ai_model": self.query_one("#ai_model", Select).value,
+            }
         )
         if (value := self.query_one("#ai_persona", TextArea).text) != "":
             model.ai_persona = value
-        if (value := self.query_one("#ai_model_kwargs", Input).value) != "":
-            model.ai_model_kwargs = str_to_dict(value)
+        value = self.query_one("#ai_model_kwargs", Input).value
+        model.ai_model_kwargs = str_to_dict(value) if value != "" else {}
         model.ai_streaming = self.query_one("#ai_streaming", Checkbox).value
+        model.ai_prompt_cache = self.query_one("#ai_prompt_cache", Checkbox).value
         # if (value := self.query_one("#ai_n").value) != "":
         #     model.ai_n = str_to_num(value)
         if (value := self.query_one("#ai_max_tokens", Input).value) != "":
             model.ai_max_tokens = str_to_num(value)
         if (value := self.query_one("#ai_history_depth", Input).value) != "":
             model.ai_history_depth = str_to_num(value)
+        hedge_service = self.query_one("#ai_hedge_service", Select).value
+        hedge_model = self.query_one("#ai_hedge_model", Select).value
+        model.ai_hedge_service = None if hedge_service is Select.BLANK else hedge_service
+        model.ai_hedge_model = None if hedge_model is Select.BLANK else hedge_model
+        model.ai_keep_alive = self.query_one("#ai_keep_alive", Input).value or None
+        if (value := self.query_one("#ai_hedge_delay", Input).value) != "":
+            model.ai_hedge_delay = float(value)
+        value = self.query_one("#ai_requests_per_minute", Input).value
+        model.ai_requests_per_minute = str_to_num(value) if value != "" else None
+        value = self.query_one("#ai_tokens_per_minute", Input).value
+        model.ai_tokens_per_minute = str_to_num(value) if value != "" else None
+        model.history_backend = self.query_one("#history_backend", Select).value
 
         self.settings.model = model
 
         if event.button.id == "apply":
             await self.settings.save()
-            await self.dismiss(True)
+            self.dismiss(True)
         else:
-            await self.dismiss(False)
+            self.dismiss(False)
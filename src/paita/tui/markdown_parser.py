@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import re
+import threading
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple, Union
+
+import markdown_it
+from markdown_it import MarkdownIt
+
+from paita.llm.enums import Tag
+from paita.utils.cache import TieredCache
+
+if TYPE_CHECKING:
+    from markdown_it.token import Token
+
+    from paita.utils.cache import CacheNamespace
+
+MARKDOWN_PRESET = "gfm-like"
+MARKDOWN_CACHE_NAME = "markdown_cache"
+CACHE_MIN_LENGTH = 512
+CACHE_TTL = 30 * 24 * 60 * 60
+
+_parsers = threading.local()
+
+
+class ThreadLocalParser:
+    """
+    Markdown parses in executor threads. Parser is created once per thread instead of on every update.
+    """
+
+    def parse(self, src: str, env: Optional[Any] = None) -> List[Token]:
+        parser = getattr(_parsers, "parser", None)
+        if parser is None:
+            parser = _parsers.parser = MarkdownIt(MARKDOWN_PRESET)
+        return parser.parse(src, env)
+
+
+class CachedParser:
+    """
+    Parser which keeps tokens of parsed markdown in a persistent cache keyed by content hash. Content of history
+    messages does not change so reopening a session does not parse them again. Short messages are cheaper to parse
+    than to look up.
+    """
+
+    def __init__(self, cache: CacheNamespace, *, parser: ThreadLocalParser, min_length: int = CACHE_MIN_LENGTH):
+        self.cache: CacheNamespace = cache
+        self.min_length: int = min_length
+        self._parser: ThreadLocalParser = parser
+
+    @classmethod
+    def key(cls, src: str) -> str:
+        # Tokens depend on parser version and preset as well as content
+        content = f"{markdown_it.__version__}:{MARKDOWN_PRESET}:{src}"
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def parse(self, src: str, env: Optional[Any] = None) -> List[Token]:
+        if len(src) < self.min_length or env:
+            return self._parser.parse(src, env)
+        key = self.key(src)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            tokens = self._parser.parse(src)
+            self.cache.set(key, tokens)
+        return tokens
+
+
+class SourceMap:
+    """
+    Map from the top level blocks Markdown widget creates to character ranges of the markdown source, so that the
+    source of a block is a slice instead of text rebuilt from widgets.
+    """
+
+    LEAF_BLOCKS = frozenset(("fence", "code_block"))
+
+    def __init__(self, source: str, tokens: List[Token]):
+        self.source: str = source
+        line_starts = [0] + [match.end() for match in re.finditer("\n", source)]
+        self.ranges: List[Tuple[int, int]] = []
+        for token in tokens:
+            # Same tokens that Markdown widget turns into top level blocks, it yields rules at any level
+            top_level = token.level == 0 and (token.nesting == 1 or token.type in self.LEAF_BLOCKS)
+            if not (top_level or token.type == "hr"):
+                continue
+            begin, end = token.map if token.map else (0, 0)
+            start = line_starts[begin] if begin < len(line_starts) else len(source)
+            stop = line_starts[end] if end < len(line_starts) else len(source)
+            self.ranges.append((start, len(source[start:stop].rstrip()) + start))
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def block(self, index: int) -> str:
+        start, stop = self.ranges[index]
+        return self.source[start:stop]
+
+    def block_at(self, offset: int) -> Optional[int]:
+        """Return index of the block containing character offset, None if it is between blocks"""
+        index = bisect.bisect_right(self.ranges, (offset, len(self.source))) - 1
+        if index >= 0 and self.ranges[index][0] <= offset < self.ranges[index][1]:
+            return index
+        return None
+
+
+class SourceMappedParser:
+    """
+    Parser which reports the source map of every parsed document
+    """
+
+    def __init__(self, parser: Union[ThreadLocalParser, CachedParser], *, on_parse: Callable[[SourceMap], None]):
+        self._parser: Union[ThreadLocalParser, CachedParser] = parser
+        self._on_parse = on_parse
+
+    def parse(self, src: str, env: Optional[Any] = None) -> List[Token]:
+        tokens = self._parser.parse(src, env)
+        self._on_parse(SourceMap(src, tokens))
+        return tokens
+
+
+_thread_local_parser = ThreadLocalParser()
+_cached_parser: Optional[CachedParser] = None
+_markdown_cache: Optional[TieredCache] = None
+
+
+def thread_local_parser() -> ThreadLocalParser:
+    return _thread_local_parser
+
+
+def markdown_cache() -> TieredCache:
+    """Return the cache of markdown tokens, it is kept apart from the application wide cache"""
+    global _markdown_cache  # noqa: PLW0603
+    if _markdown_cache is None:
+        _markdown_cache = TieredCache(name=MARKDOWN_CACHE_NAME)
+    return _markdown_cache
+
+
+def cached_parser() -> CachedParser:
+    global _cached_parser  # noqa: PLW0603
+    if _cached_parser is None:
+        cache = markdown_cache().namespace(Tag.MARKDOWN_TOKENS.value, ttl=CACHE_TTL, max_memory_items=64)
+        _cached_parser = CachedParser(cache, parser=_thread_local_parser)
+    return _cached_parser
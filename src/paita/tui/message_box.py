@@ -1,18 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import time
 from pathlib import PurePath
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Tuple
 
 import pyperclip
 from rich.syntax import Syntax
-from textual.app import ComposeResult
+from textual.await_complete import AwaitComplete
 from textual.binding import Binding
-from textual.containers import Horizontal
-from textual.widgets import Label, Markdown, Static
-from textual.widgets._markdown import MarkdownBlock, MarkdownBullet, MarkdownFence
+from textual.containers import Horizontal, Vertical
+from textual.message import Message
+from textual.widgets import Button, Label, Markdown, Static
+from textual.widgets._markdown import MarkdownFence
+
+from paita.localization import labels
+from paita.tui.markdown_parser import SourceMap, SourceMappedParser, cached_parser, thread_local_parser
+from paita.utils.cache import LRUCache
 
 if TYPE_CHECKING:
+    from rich.text import Text
+    from textual.app import ComposeResult
     from textual.timer import Timer
+    from textual.widget import Widget
 
 ROLE_ABBREVIATIONS = {"question": "Q", "answer": "A", "info": "i", "error": "!"}
+MOUNT_CHUNK = 10
+MOUNT_SLICE = 1 / 60
+FOCUS_COLOR = "#0178D4"
+SYNTAX_CACHE_SIZE = 128
+LARGE_MESSAGE_CHARS = int(os.getenv("PAITA_LARGE_MESSAGE_CHARS", str(64 * 1024)))
+FENCE_MARKERS = ("```", "~~~")
+
+
+class HighlightedSyntax(Syntax):
+    """
+    Syntax which highlights its code once and reuses the result when rendered again
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._highlighted: Optional[Tuple[Tuple[str, Any], Text]] = None
+
+    def highlight(self, code: str, line_range: Optional[Tuple[Optional[int], Optional[int]]] = None) -> Text:
+        if self._highlighted is None or self._highlighted[0] != (code, line_range):
+            self._highlighted = ((code, line_range), super().highlight(code, line_range))
+        # Rendering modifies the text so each render gets a copy
+        return self._highlighted[1].copy()
+
+
+_syntax_cache = LRUCache(max_items=SYNTAX_CACHE_SIZE)
+
+
+def highlighted_syntax(code: str, *, lexer: str, theme: str, highlight: bool) -> HighlightedSyntax:
+    """
+    Return code fence renderable. Renderables are shared by all messages so moving focus between fences does not
+    highlight code again.
+    """
+    key = (hashlib.sha256(code.encode()).hexdigest(), lexer, theme, highlight)
+    syntax = _syntax_cache.get(key)
+    if syntax is None:
+        syntax = HighlightedSyntax(
+            code,
+            lexer=lexer,
+            word_wrap=False,
+            indent_guides=True,
+            padding=(1, 2),
+            theme=theme,
+            background_color=FOCUS_COLOR if highlight else None,
+        )
+        _syntax_cache.set(key, syntax)
+    return syntax
 
 
 class MessageContent(Markdown, can_focus=True, can_focus_children=False):
@@ -22,8 +82,53 @@ class MessageContent(Markdown, can_focus=True, can_focus_children=False):
         Binding("tab,down,right", "focus_next", priority=True),
         Binding("shift+tab,up,left", "focus_previous", priority=True),
         Binding("c", "copy", "Copy", show=True, key_display="c", priority=True),
+        Binding("r", "quote", "Quote", show=True, key_display="r", priority=True),
+        Binding("f", "fork", "Fork", show=True, key_display="f", priority=True),
     ]
 
+    class Quoted(Message):
+        def __init__(self, text: str):
+            super().__init__()
+            self.text: str = text
+
+    class Forked(Message):
+        def __init__(self, message_box: MessageBox):
+            super().__init__()
+            self.message_box: MessageBox = message_box
+
+    def __init__(self, markdown: Optional[str] = None, *, cache_tokens: bool = False, **kwargs):
+        kwargs.setdefault("parser_factory", self._parser)
+        super().__init__(markdown, **kwargs)
+        self.cache_tokens: bool = cache_tokens
+        self.source_map: SourceMap = SourceMap(markdown or "", [])
+
+    def _parser(self) -> SourceMappedParser:
+        # Partial answers change on every update so only complete messages go to the cache
+        parser = cached_parser() if self.cache_tokens else thread_local_parser()
+        return SourceMappedParser(parser, on_parse=self._set_source_map)
+
+    def _set_source_map(self, source_map: SourceMap):
+        self.source_map = source_map
+
+    def mount_all(
+        self, widgets: Iterable[Widget], *, before: Optional[Any] = None, after: Optional[Any] = None
+    ) -> AwaitComplete:
+        """
+        Mount blocks of a markdown update in small chunks and yield to the event loop between time slices,
+        so that large messages do not block input while they are mounted.
+        """
+        if before is not None or after is not None:
+            return AwaitComplete(super().mount_all(widgets, before=before, after=after))
+        return AwaitComplete(self._mount_in_slices(list(widgets)))
+
+    async def _mount_in_slices(self, widgets: List[Widget]):
+        started = time.monotonic()
+        for i in range(0, len(widgets), MOUNT_CHUNK):
+            await super().mount_all(widgets[i : i + MOUNT_CHUNK])
+            if time.monotonic() - started >= MOUNT_SLICE:
+                await asyncio.sleep(0)
+                started = time.monotonic()
+
     def action_enable_focus_children(self) -> None:
         self.can_focus_children = True
         for child in self.children:
@@ -76,86 +181,237 @@ class MessageContent(Markdown, can_focus=True, can_focus_children=False):
         *,
         highlight: bool,
     ) -> None:
-        if highlight:
-            accent_color = "#0178D4"
-            block = Syntax(
-                fence.code,
-                lexer=fence.lexer,
-                word_wrap=False,
-                indent_guides=True,
-                padding=(1, 2),
-                theme=fence.theme,
-                background_color=accent_color,
-            )
-        else:
-            block = Syntax(
-                fence.code,
-                lexer=fence.lexer,
-                word_wrap=False,
-                indent_guides=True,
-                padding=(1, 2),
-                theme=fence.theme,
-            )
-
+        block = highlighted_syntax(fence.code, lexer=fence.lexer, theme=fence.theme, highlight=highlight)
         fence.get_child_by_type(Static).update(block)
 
     def action_copy(self) -> None:
-        if self.has_focus:
-            content = self.parse_from_children(self)
-        else:
-            for child in self.children:
-                if child.has_focus:
-                    content = self.parse_from_children(child)
+        pyperclip.copy(self.focused_source())
+
+    def action_quote(self) -> None:
+        quote = "\n".join(f"> {line}" if line else ">" for line in self.focused_source().splitlines())
+        self.post_message(self.Quoted(quote + "\n\n"))
+
+    def action_fork(self) -> None:
+        message_box = self._message_box()
+        if message_box is not None:
+            self.post_message(self.Forked(message_box))
+
+    def focused_source(self) -> str:
+        """
+        Return markdown source of the focused block, or the whole message if no block has focus. Message split to
+        chunks is copied from the message, not from the chunk of this widget.
+        """
+        message_box = self._message_box()
+        source_map = self.source_map
+        if not self.has_focus:
+            for index, child in enumerate(self.children):
+                if child.has_focus and index < len(source_map):
+                    if message_box is None:
+                        return source_map.block(index)
+                    return message_box.block_source(self, index)
+        return message_box.data if message_box is not None else source_map.source
 
-        pyperclip.copy(content)
+    def _message_box(self) -> Optional[MessageBox]:
+        for ancestor in self.ancestors:
+            if isinstance(ancestor, MessageBox):
+                return ancestor
+        return None
 
-    def parse_from_children(self, block: MarkdownBlock, indent_depth: int = -2) -> str:
-        children = block.children
 
-        if isinstance(block, MarkdownFence):
-            return block.code
+def split_markdown(text: str, *, chunk_chars: int) -> List[str]:
+    """
+    Split markdown to chunks of about chunk_chars. Chunks end at blank lines, or at any line if there is no blank
+    line for a while. Code fences longer than a chunk are closed at the end of a chunk and reopened in the next one.
+    """
+    return [chunk for _, chunk in markdown_chunks(text, chunk_chars=chunk_chars)]
 
-        if len(children) > 0:
-            text = ""
-            for child in children:
-                text += self.parse_from_children(child, indent_depth + 1)
-            return text
-        if isinstance(block, MarkdownBullet):
-            return " " * indent_depth + "- "
-        if isinstance(block, MarkdownFence):
-            return block.code
-        return str(block.renderable) + "\n"
+
+def markdown_chunks(text: str, *, chunk_chars: int) -> List[Tuple[int, str]]:
+    """
+    Chunks of split_markdown with their start offsets in text, so that offset start + i of text is character i
+    of the chunk. Reopened fence line of a chunk is counted before its start.
+    """
+    chunks: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    size = 0
+    start = position = 0
+    fence: Optional[str] = None
+    for line in text.splitlines(keepends=True):
+        position += len(line)
+        stripped = line.strip()
+        marker = stripped[:3]
+        if fence is None:
+            if marker in FENCE_MARKERS:
+                fence = line
+        elif stripped.startswith(fence.strip()[:3]) and stripped == stripped[0] * len(stripped):
+            fence = None
+        lines.append(line)
+        size += len(line)
+        if size < chunk_chars:
+            continue
+        if fence is not None and line is not fence:
+            closing = fence.strip()[:3]
+            chunks.append((start, "".join(lines).rstrip("\n") + f"\n{closing}"))
+            lines, size = [fence], len(fence)
+            start = position - len(fence)
+        elif fence is None and (not stripped or size >= 2 * chunk_chars):
+            chunks.append((start, "".join(lines)))
+            lines, size = [], 0
+            start = position
+    if lines or not chunks:
+        chunks.append((start, "".join(lines)))
+    return chunks
 
 
 class MessageBox(Horizontal, can_focus=False):
+    """
+    Message shown as markdown. Messages larger than large_message_chars are split to chunks and only the first
+    chunk is rendered until more is asked for, so that layout and memory cost scale with what is shown.
+    """
+
     CSS_PATH = PurePath(__file__).parent / "styles" / "message_box.tcss"
 
-    def __init__(self, data: str, *, role: str) -> None:
+    def __init__(
+        self,
+        data: str,
+        *,
+        role: str,
+        cache_tokens: bool = False,
+        large_message_chars: int = LARGE_MESSAGE_CHARS,
+    ) -> None:
         super().__init__(classes=f"message {role}")
         self.data: str = data
+        self.large_message_chars: int = large_message_chars
         self._role: str = role
-        self._message_content: MessageContent = None
+        self._cache_tokens: bool = cache_tokens
+        self._contents: List[MessageContent] = []
+        self._rendered_chunks: List[str] = []
         self._update_timer: Timer = None
+        self._rendered_data: str = data
+        self._rendering: Optional[AwaitComplete] = None
+        # Chunks with their start offsets are kept until data changes
+        self._split_data: Optional[str] = None
+        self._split: List[Tuple[int, str]] = []
+        # Source map of the whole message, built off the event loop once a large message is complete
+        self._source_map: Optional[SourceMap] = None
+
+    @property
+    def role(self) -> str:
+        return self._role
+
+    @property
+    def chunks(self) -> List[str]:
+        return [chunk for _, chunk in self._markdown_chunks()]
+
+    def _markdown_chunks(self) -> List[Tuple[int, str]]:
+        if self._split_data is not self.data:
+            self._split_data = self.data
+            if len(self.data) <= self.large_message_chars:
+                self._split = [(0, self.data)]
+            else:
+                self._split = markdown_chunks(self.data, chunk_chars=self.large_message_chars // 2)
+        return self._split
 
     def compose(self) -> ComposeResult:
         role_label = ROLE_ABBREVIATIONS[self._role]
         yield Label(role_label, classes=f"{self._role}_label")
-        self._message_content = MessageContent(self.data, classes="markdown")
-        yield self._message_content
+        chunks = self.chunks
+        with Vertical(classes="message_body"):
+            yield self._new_content(chunks[0])
+            yield Button(variant="default", classes="show_more")
 
     def on_mount(self) -> None:
         self._update_timer = self.set_interval(1 / 4, self._markdown_update, pause=True)
+        self._update_show_more(self.chunks)
+        if self._cache_tokens:
+            self._map_source()
+
+    def _new_content(self, chunk: str) -> MessageContent:
+        content = MessageContent(chunk, cache_tokens=self._cache_tokens, classes="markdown")
+        self._contents.append(content)
+        self._rendered_chunks.append(chunk)
+        return content
+
+    def _update_show_more(self, chunks: List[str]):
+        button = self.query_one(".show_more", Button)
+        hidden = chunks[len(self._contents) :]
+        button.display = bool(hidden)
+        if hidden:
+            hidden_size = sum(len(chunk) for chunk in hidden)
+            button.label = labels.MESSAGE_SHOW_MORE.format(len(hidden), round(hidden_size / 1024))
+
+    async def on_button_pressed(self, event: Button.Pressed) -> None:
+        if "show_more" not in event.button.classes:
+            return
+        event.stop()
+        chunks = self.chunks
+        if len(self._contents) < len(chunks):
+            content = self._new_content(chunks[len(self._contents)])
+            await self.query_one(".message_body").mount(content, before=event.button)
+        self._update_show_more(chunks)
+
+    def block_source(self, content: MessageContent, index: int) -> str:
+        """Markdown source of the message block shown as block index of content"""
+        source_map = self._source_map
+        if source_map is None or source_map.source is not self.data:
+            # Message fits in one chunk, or the whole message is not mapped yet
+            return content.source_map.block(index)
+        # Block is looked up in the whole message by the chunk start, e.g. a code fence may continue over chunks
+        start, _ = self._markdown_chunks()[self._contents.index(content)]
+        block = source_map.block_at(start + content.source_map.ranges[index][0])
+        return source_map.block(block) if block is not None else content.source_map.block(index)
+
+    def _map_source(self):
+        if len(self.data) > self.large_message_chars:
+            self.run_worker(self._parse_source(), group="source_map", exclusive=True)
+
+    async def _parse_source(self):
+        data = self.data
+        source_map = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: SourceMap(data, thread_local_parser().parse(data))
+        )
+        if data is self.data:
+            self._source_map = source_map
 
     def append(self, data: str):
         self.data += data
         self._update_timer.resume()
 
-    def flush(self):
+    def flush(self, *, complete: bool = False):
         if self._update_timer:
             self._update_timer.pause()
+        if complete and not self._cache_tokens:
+            self._cache_tokens = True
+            for content in self._contents:
+                content.cache_tokens = True
+            if self.data == self._rendered_data:
+                # Already rendered, store tokens for the next time the session is opened
+                for chunk in self._rendered_chunks:
+                    asyncio.get_running_loop().run_in_executor(None, cached_parser().parse, chunk)
+        if complete:
+            self._map_source()
         self._markdown_update()
 
     def _markdown_update(self):
-        if self._message_content:
-            self._message_content.update(self.data)
+        if self._contents:
+            if self._rendering is not None and not self._rendering.is_done:
+                # Previous update is still being applied, latest data is rendered on a later tick
+                if self._update_timer:
+                    self._update_timer.resume()
+                return
+            if self.data == self._rendered_data:
+                if self._update_timer:
+                    self._update_timer.pause()
+                return
+            self._rendered_data = self.data
+            # Only chunks that are shown are rendered, usually just the last one changes
+            chunks = self.chunks
+            updates = []
+            for index, content in enumerate(self._contents):
+                chunk = chunks[index] if index < len(chunks) else ""
+                if chunk != self._rendered_chunks[index]:
+                    self._rendered_chunks[index] = chunk
+                    updates.append(content.update(chunk))
+            self._rendering = AwaitComplete(*updates)
+            self._update_show_more(chunks)
         self.parent.scroll_end(animate=False)
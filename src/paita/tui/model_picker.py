@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Tuple
+
+from rich.text import Text
+from textual import on
+from textual.binding import Binding
+from textual.containers import Vertical
+from textual.message import Message
+from textual.widgets import Input, OptionList
+from textual.widgets.option_list import Option
+
+if TYPE_CHECKING:
+    from textual.app import ComposeResult
+
+    from paita.utils.fuzzy_index import FuzzyIndex
+
+
+class ModelPicker(Vertical):
+    """
+    Type-ahead AI Model search over all AI Services. Ranked matches are shown under the input while typing.
+    """
+
+    BINDINGS = [
+        Binding("down", "cursor_down", show=False),
+        Binding("up", "cursor_up", show=False),
+        Binding("escape", "clear", show=False),
+    ]
+
+    MAX_MATCHES = 10
+
+    class Selected(Message):
+        def __init__(self, ai_service: str, ai_model: str):
+            super().__init__()
+            self.ai_service: str = ai_service
+            self.ai_model: str = ai_model
+
+    def __init__(self, index: FuzzyIndex[Tuple[str, str]], *, placeholder: str = "", **kwargs):
+        super().__init__(**kwargs)
+        self.index: FuzzyIndex[Tuple[str, str]] = index
+        self._placeholder: str = placeholder
+        self._matches: List[Tuple[str, str]] = []
+
+    def compose(self) -> ComposeResult:
+        yield Input(placeholder=self._placeholder, id="model_picker_input")
+        yield OptionList(id="model_picker_matches")
+
+    def on_mount(self) -> None:
+        self.query_one(OptionList).display = False
+
+    @on(Input.Changed, "#model_picker_input")
+    def search(self, event: Input.Changed) -> None:
+        event.stop()
+        options = self.query_one(OptionList)
+        self._matches = self.index.search(event.value, limit=self.MAX_MATCHES) if event.value else []
+        options.clear_options()
+        options.add_options(
+            Option(Text.assemble(ai_model, "  ", (ai_service, "dim"))) for ai_service, ai_model in self._matches
+        )
+        options.display = bool(self._matches)
+        if self._matches:
+            options.highlighted = 0
+
+    def action_cursor_down(self) -> None:
+        self.query_one(OptionList).action_cursor_down()
+
+    def action_cursor_up(self) -> None:
+        self.query_one(OptionList).action_cursor_up()
+
+    def action_clear(self) -> None:
+        self.query_one(Input).value = ""
+
+    @on(Input.Submitted, "#model_picker_input")
+    def submit(self, event: Input.Submitted) -> None:
+        event.stop()
+        highlighted = self.query_one(OptionList).highlighted
+        if highlighted is not None and highlighted < len(self._matches):
+            self._select(highlighted)
+
+    @on(OptionList.OptionSelected, "#model_picker_matches")
+    def option_selected(self, event: OptionList.OptionSelected) -> None:
+        event.stop()
+        self._select(event.option_index)
+
+    def _select(self, index: int) -> None:
+        ai_service, ai_model = self._matches[index]
+        self.post_message(self.Selected(ai_service, ai_model))
+        self.action_clear()
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from appdirs import user_config_dir
+from cache3 import DiskCache
+from pydantic import BaseModel
+
+from paita.localization import labels
+
+_MISSING = object()
+
+
+class CacheStats(BaseModel):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    memory_items: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class LRUCache:
+    """
+    Thread safe in-memory LRU with per entry expiry
+    """
+
+    def __init__(
+        self,
+        *,
+        max_items: int,
+        on_evict: Optional[Callable[[Hashable], None]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_items: int = max_items
+        self._on_evict = on_evict
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, Tuple[Any, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, *, expires_at: Optional[float] = None):
+        evicted: List[Hashable] = []
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                evicted_key, _ = self._entries.popitem(last=False)
+                evicted.append(evicted_key)
+        if self._on_evict:
+            for evicted_key in evicted:
+                self._on_evict(evicted_key)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def keys(self) -> List[Hashable]:
+        now = self._clock()
+        with self._lock:
+            return [key for key, (_, expires_at) in self._entries.items() if expires_at is None or expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheNamespace:
+    """
+    Namespace of TieredCache. Values are looked up from the in-memory LRU first and then from the disk tier.
+    Values found on disk are promoted to memory.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        disk: Optional[DiskCache],
+        ttl: Optional[float],
+        max_memory_items: int,
+        max_disk_items: int,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name: str = name
+        self.ttl: Optional[float] = ttl
+        self.max_disk_items: int = max_disk_items
+        self.stats: CacheStats = CacheStats()
+        self._disk: Optional[DiskCache] = disk
+        self._clock = clock
+        self._memory = LRUCache(max_items=max_memory_items, on_evict=self._on_memory_evict, clock=clock)
+        self._disk_items: Optional[int] = None
+
+    @property
+    def persistent(self) -> bool:
+        return self._disk is not None
+
+    def _on_memory_evict(self, _key: Hashable):
+        # Entries evicted from memory are still on disk in persistent namespaces
+        if not self.persistent:
+            self.stats.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats.memory_hits += 1
+            return value
+        if self._disk is not None:
+            value = self._disk.get(key, _MISSING, tag=self.name)
+            if value is not _MISSING:
+                self.stats.disk_hits += 1
+                ttl = self._disk.ttl(key, tag=self.name)
+                expires_at = self._clock() + ttl if isinstance(ttl, (int, float)) and ttl >= 0 else None
+                self._memory.set(key, value, expires_at=expires_at)
+                self.stats.memory_items = len(self._memory)
+                return value
+        self.stats.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, *, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = self._clock() + ttl if ttl is not None else None
+        self._memory.set(key, value, expires_at=expires_at)
+        self.stats.memory_items = len(self._memory)
+        if self._disk is not None:
+            added = not self._disk.has_key(key, tag=self.name)
+            self._disk.set(key, value, ttl, tag=self.name)
+            self._trim_disk(added=added)
+
+    def delete(self, key: Hashable):
+        self._memory.delete(key)
+        self.stats.memory_items = len(self._memory)
+        if self._disk is not None:
+            self._disk.delete(key, tag=self.name)
+            self._disk_items = None
+
+    def keys(self) -> List[Hashable]:
+        if self._disk is not None:
+            return list(self._disk.keys(tag=self.name))
+        return self._memory.keys()
+
+    def clear(self):
+        for key in self.keys():
+            self.delete(key)
+        self._memory.clear()
+        self.stats.memory_items = 0
+
+    def _trim_disk(self, *, added: bool):
+        # Counting keys needs a scan so the count is kept in memory and trimming removes a batch of the oldest items
+        if self._disk_items is None:
+            self._disk_items = sum(1 for _ in self._disk.keys(tag=self.name))
+        elif added:
+            self._disk_items += 1
+        if self._disk_items <= self.max_disk_items:
+            return
+        keys = list(self._disk.keys(tag=self.name))
+        excess = len(keys) - int(self.max_disk_items * 0.9)
+        for key in keys[: max(excess, 0)]:
+            self._disk.delete(key, tag=self.name)
+            self._memory.delete(key)
+            self.stats.evictions += 1
+        self._disk_items = len(keys) - max(excess, 0)
+        self.stats.memory_items = len(self._memory)
+
+
+class TieredCache:
+    """
+    Cache with an in-memory LRU tier in front of a cache3 DiskCache tier. Each namespace has its own TTL and
+    size limits, and keeps hit/miss/eviction statistics.
+    """
+
+    DEFAULT_DIR = user_config_dir(appname=labels.APP_TITLE, appauthor=labels.APP_AUTHOR)
+    DEFAULT_NAME = "cache"
+
+    def __init__(
+        self, directory: str = DEFAULT_DIR, name: str = DEFAULT_NAME, *, clock: Callable[[], float] = time.time
+    ):
+        self.directory: str = directory
+        self.name: str = name
+        self._clock = clock
+        self._disk: Optional[DiskCache] = None
+        self._namespaces: Dict[str, CacheNamespace] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def disk(self) -> DiskCache:
+        if self._disk is None:
+            self._disk = DiskCache(self.directory, self.name)
+        return self._disk
+
+    def namespace(
+        self,
+        name: str,
+        *,
+        ttl: Optional[float] = None,
+        max_memory_items: int = 256,
+        max_disk_items: int = 4096,
+        persistent: bool = True,
+    ) -> CacheNamespace:
+        """Return namespace by name. Configuration is given by the first caller."""
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = CacheNamespace(
+                    name,
+                    disk=self.disk if persistent else None,
+                    ttl=ttl,
+                    max_memory_items=max_memory_items,
+                    max_disk_items=max_disk_items,
+                    clock=self._clock,
+                )
+            return self._namespaces[name]
+
+    def namespaces(self) -> Iterable[CacheNamespace]:
+        return list(self._namespaces.values())
+
+    def stats(self) -> Dict[str, CacheStats]:
+        return {namespace.name: namespace.stats for namespace in self.namespaces()}
+
+
+_cache: Optional[TieredCache] = None
+
+
+def get_cache() -> TieredCache:
+    """Return the application wide cache"""
+    global _cache  # noqa: PLW0603
+    if _cache is None:
+        _cache = TieredCache()
+    return _cache
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import heapq
+from collections import defaultdict
+from typing import Callable, Dict, Generic, List, Optional, Sequence, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SEPARATORS = frozenset(" -_.:/@")
+TRIGRAM_MIN_RATIO = 0.4
+WORD_START_BONUS = 8
+CONSECUTIVE_BONUS = 4
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def subsequence_score(query: str, text: str) -> Optional[float]:
+    """
+    Score query as a subsequence of text, None if it is not one. Matches are first found greedily forward and
+    then tightened backward from the end, and characters at word starts or right after the previous match
+    score higher while skipped characters score lower.
+    """
+    end = -1
+    for char in query:
+        end = text.find(char, end + 1)
+        if end < 0:
+            return None
+    positions = []
+    position = end + 1
+    for char in reversed(query):
+        position = text.rfind(char, 0, position)
+        positions.append(position)
+    positions.reverse()
+
+    score = 0.0
+    for i, position in enumerate(positions):
+        if position == 0 or text[position - 1] in SEPARATORS:
+            score += WORD_START_BONUS
+        if i and position == positions[i - 1] + 1:
+            score += CONSECUTIVE_BONUS
+    return score - (positions[-1] - positions[0] + 1 - len(query))
+
+
+def _is_subsequence(query: str, text: str) -> bool:
+    position = -1
+    for char in query:
+        position = text.find(char, position + 1)
+        if position < 0:
+            return False
+    return True
+
+
+class FuzzyIndex(Generic[T]):
+    """
+    Type-ahead search index. Items are ranked by substring match, then subsequence match (e.g. "c35s" finds
+    "claude-3-5-sonnet"), then trigram overlap which tolerates typos. Trigram postings are precomputed and
+    subsequence candidates are narrowed incrementally while the query grows one keystroke at a time.
+    """
+
+    def __init__(self, items: Sequence[T], *, key: Callable[[T], str] = str):
+        self.items: List[T] = list(items)
+        self._texts: List[str] = [key(item).lower() for item in self.items]
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for index, text in enumerate(self._texts):
+            for trigram in trigrams(text):
+                self._postings[trigram].append(index)
+        self._last_query: str = ""
+        self._last_matches: List[int] = list(range(len(self.items)))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _subsequence_candidates(self, query: str) -> List[int]:
+        # Items matching a longer query are a subset of the items that matched its prefix
+        candidates = self._last_matches if self._last_query and query.startswith(self._last_query) else None
+        if candidates is None:
+            candidates = range(len(self._texts))
+        texts = self._texts
+        matches = [index for index in candidates if _is_subsequence(query, texts[index])]
+        self._last_query, self._last_matches = query, matches
+        return matches
+
+    def _score(self, query: str, index: int, trigram_hits: int, query_trigrams: int) -> float:
+        text = self._texts[index]
+        position = text.find(query)
+        if position >= 0:
+            word_start = position == 0 or text[position - 1] in SEPARATORS
+            return 300 + (50 if word_start else 0) - position - len(text) * 0.01
+        score = subsequence_score(query, text)
+        if score is not None:
+            return 200 + score - len(text) * 0.01
+        return 100 * trigram_hits / query_trigrams - len(text) * 0.01
+
+    def search(self, query: str, *, limit: int = 20) -> List[T]:
+        return [item for item, _ in self.search_with_scores(query, limit=limit)]
+
+    def search_with_scores(self, query: str, *, limit: int = 20) -> List[Tuple[T, float]]:
+        query = query.strip().lower()
+        if not query:
+            return [(item, 0.0) for item in self.items[:limit]]
+
+        hits: Dict[int, int] = defaultdict(int)
+        query_trigrams = trigrams(query)
+        for trigram in query_trigrams:
+            for index in self._postings.get(trigram, ()):
+                hits[index] += 1
+        candidates = {index for index, count in hits.items() if count >= len(query_trigrams) * TRIGRAM_MIN_RATIO}
+        candidates.update(self._subsequence_candidates(query))
+
+        scored = (
+            (self._score(query, index, hits.get(index, 0), len(query_trigrams) or 1), index) for index in candidates
+        )
+        best = heapq.nlargest(limit, scored, key=lambda scored_index: (scored_index[0], -scored_index[1]))
+        return [(self.items[index], score) for score, index in best]
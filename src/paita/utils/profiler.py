@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import functools
+import inspect
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_FILE_PREFIX = "paita-profile"
+SAMPLE_INTERVAL = 0.01
+IDLE = "idle"
+STREAMING = "streaming"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Profiler:
+    """
+    Records startup phases, durations of instrumented calls and event loop lag, and writes a cProfile file with a
+    short summary report. Calls are instrumented by patching them only while recording, so nothing is measured and
+    nothing costs anything when profiling is not enabled.
+    """
+
+    def __init__(self, *, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self.phases: List[Tuple[str, float]] = []
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.loop_lag: Dict[str, List[float]] = defaultdict(list)
+        self._in_flight: int = 0
+        self._patched: List[Tuple[Any, str, Any]] = []
+        self._profile: Optional[cProfile.Profile] = None
+
+    def add_phase(self, name: str, duration: float):
+        self.phases.append((name, duration))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.add_phase(name, self._clock() - started)
+
+    def instrument(self, owner: Any, name: str, *, label: Optional[str] = None, streaming: bool = False):
+        """
+        Replace owner's function with one which records its durations under label. Coroutine functions marked
+        streaming also label event loop lag samples taken while they run.
+        """
+        func = getattr(owner, name)
+        label = label or name
+        timings = self.timings[label]
+        clock = self._clock
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def timed(*args, **kwargs):
+                started = clock()
+                self._in_flight += streaming
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self._in_flight -= streaming
+                    timings.append(clock() - started)
+
+        else:
+
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                started = clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    timings.append(clock() - started)
+
+        # Functions inherited or bound to an instance are restored by removing the patch
+        self._patched.append((owner, name, vars(owner).get(name)))
+        setattr(owner, name, timed)
+
+    def restore(self):
+        for owner, name, original in reversed(self._patched):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._patched = []
+
+    async def sample_loop(self, interval: float = SAMPLE_INTERVAL):
+        """Sample how late the event loop wakes up from sleep, samples taken during requests are kept apart"""
+        while True:
+            started = self._clock()
+            await asyncio.sleep(interval)
+            lag = self._clock() - started - interval
+            self.loop_lag[STREAMING if self._in_flight else IDLE].append(max(lag, 0.0))
+
+    @contextmanager
+    def recording(self) -> Iterator[Profiler]:
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        try:
+            yield self
+        finally:
+            self._profile.disable()
+            self.restore()
+
+    def summary(self) -> str:
+        lines = ["Startup phases (ms)"]
+        lines.extend(f"  {name:<24}{duration * 1000:>10.1f}" for name, duration in self.phases)
+        lines.append("")
+        lines.append(f"{'Calls (ms)':<26}{'count':>8}{'total':>10}{'mean':>10}{'p95':>10}{'max':>10}")
+        for name, durations in self.timings.items():
+            if not durations:
+                continue
+            total = sum(durations)
+            lines.append(
+                f"  {name:<24}{len(durations):>8}{total * 1000:>10.1f}{total / len(durations) * 1000:>10.2f}"
+                f"{percentile(durations, 0.95) * 1000:>10.2f}{max(durations) * 1000:>10.2f}"
+            )
+        lines.append("")
+        lines.append(f"{'Event loop lag (ms)':<26}{'samples':>8}{'p50':>10}{'p95':>10}{'max':>10}")
+        for name, lags in self.loop_lag.items():
+            if not lags:
+                continue
+            lines.append(
+                f"  {name:<24}{len(lags):>8}{percentile(lags, 0.5) * 1000:>10.1f}"
+                f"{percentile(lags, 0.95) * 1000:>10.1f}{max(lags) * 1000:>10.1f}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str) -> Tuple[Path, Path]:
+        """Write cProfile stats and the summary report to directory. Returns their paths."""
+        timestamp = datetime.now(tz=timezone.utc).strftime("%Y%m%d-%H%M%S")
+        profile_path = Path(directory) / f"{PROFILE_FILE_PREFIX}-{timestamp}.prof"
+        summary_path = profile_path.with_suffix(".txt")
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        if self._profile is not None:
+            self._profile.dump_stats(str(profile_path))
+        summary_path.write_text(self.summary(), encoding="utf-8")
+        return profile_path, summary_path
+
+
+def phase(profiler: Optional[Profiler], name: str) -> ContextManager:
+    """Return context which records a phase, or does nothing if profiler is not enabled"""
+    return nullcontext() if profiler is None else profiler.phase(name)
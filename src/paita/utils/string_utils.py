@@ -63,14 +63,15 @@ def fix_url(url: str, protocol: str = "http") -> str:
     return url
 
 
-def split_and_fix(source: str) -> [str]:
+def split_and_fix(source: str, *, simple_host: bool = False) -> [str]:
     pattern = r"[,\s;]+"
-    urls = re.split(pattern, source)
+    urls = re.split(pattern, source.strip())
 
     fixed_urls = []
     for url in urls:
         fixed_url = fix_url(url)
-        if not validators.url(fixed_url):
+        # simple_host allows host names without domain e.g. localhost
+        if not validators.url(fixed_url, simple_host=simple_host):
             error_str = f"Invalid URL: {fixed_url}"
             raise ValueError(error_str)
         fixed_urls.append(fixed_url)
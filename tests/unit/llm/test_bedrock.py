@@ -0,0 +1,198 @@
+import asyncio
+import gc
+import json
+import struct
+import warnings
+import zlib
+
+import boto3
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from botocore.exceptions import ClientError
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from paita.llm.callbacks import UsageHandler
+from paita.llm.scheduler import RequestStats, is_throttling_error
+from paita.llm.services.bedrock import CACHE_POINT, ChatBedrockAsync, convert_messages
+from paita.llm.services.bedrock_transport import BedrockTransport
+
+STRING_HEADER = 7
+
+
+def encode_message(headers: dict, payload: dict) -> bytes:
+    header_bytes = b""
+    for name, value in headers.items():
+        name_bytes, value_bytes = name.encode(), value.encode()
+        header_bytes += struct.pack("!B", len(name_bytes)) + name_bytes
+        header_bytes += struct.pack("!BH", STRING_HEADER, len(value_bytes)) + value_bytes
+    payload_bytes = json.dumps(payload).encode()
+    prelude = struct.pack("!II", 16 + len(header_bytes) + len(payload_bytes), len(header_bytes))
+    prelude += struct.pack("!I", zlib.crc32(prelude))
+    message = prelude + header_bytes + payload_bytes
+    return message + struct.pack("!I", zlib.crc32(message))
+
+
+def event(event_type: str, payload: dict) -> bytes:
+    return encode_message({":message-type": "event", ":event-type": event_type}, payload)
+
+
+class BedrockStub:
+    def __init__(self):
+        self.requests = []
+
+    async def list_foundation_models(self, request: web.Request) -> web.Response:
+        self.requests.append((request.path, dict(request.query), request.headers.get("Authorization")))
+        return web.json_response({"modelSummaries": [{"modelId": "model-b"}, {"modelId": "model-a"}]})
+
+    async def converse_stream(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests.append((request.raw_path, body, request.headers.get("Authorization")))
+        if request.match_info["model_id"] == "throttled":
+            return web.json_response(
+                {"message": "Too many requests"},
+                status=429,
+                headers={"x-amzn-ErrorType": "ThrottlingException:http://"},
+            )
+        response = web.StreamResponse(headers={"Content-Type": "application/vnd.amazon.eventstream"})
+        await response.prepare(request)
+        await response.write(event("messageStart", {"role": "assistant"}))
+        for text in ("Hello", " from", " paita"):
+            await response.write(event("contentBlockDelta", {"contentBlockIndex": 0, "delta": {"text": text}}))
+        if request.match_info["model_id"] == "failing":
+            exception = {":message-type": "exception", ":exception-type": "throttlingException"}
+            await response.write(encode_message(exception, {"message": "Slow down"}))
+        else:
+            await response.write(event("messageStop", {"stopReason": "end_turn"}))
+            usage = {"inputTokens": 10, "outputTokens": 3, "totalTokens": 13, "cacheReadInputTokens": 8}
+            await response.write(event("metadata", {"usage": usage, "metrics": {"latencyMs": 100}}))
+        await response.write_eof()
+        return response
+
+
+@pytest.fixture
+def stub() -> BedrockStub:
+    return BedrockStub()
+
+
+@pytest_asyncio.fixture
+async def transport(stub):
+    app = web.Application()
+    app.add_routes(
+        [
+            web.get("/foundation-models", stub.list_foundation_models),
+            web.post("/model/{model_id}/converse-stream", stub.converse_stream),
+        ]
+    )
+    async with TestServer(app) as server:
+        session = boto3.Session(aws_access_key_id="test", aws_secret_access_key="test", region_name="eu-west-1")
+        _transport = BedrockTransport(session=session, endpoint_url=str(server.make_url("/")))
+        yield _transport
+        await _transport.close()
+
+
+def test_convert_messages():
+    messages = [
+        SystemMessage(content="Be brief"),
+        HumanMessage(content="Hi"),
+        HumanMessage(content="Anyone?"),
+        AIMessage(content="Hello"),
+    ]
+    assert convert_messages(messages) == {
+        "system": [{"text": "Be brief"}],
+        "messages": [
+            {"role": "user", "content": [{"text": "Hi"}, {"text": "Anyone?"}]},
+            {"role": "assistant", "content": [{"text": "Hello"}]},
+        ],
+    }
+
+    # Trailing assistant message is a prefix to continue
+    prefix = convert_messages([HumanMessage(content="Hi"), AIMessage(content="Hello ")])
+    assert prefix["messages"][-1] == {"role": "assistant", "content": [{"text": "Hello"}]}
+
+
+def test_convert_messages_cache_points():
+    messages = [
+        SystemMessage(content="Be brief"),
+        HumanMessage(content="Q1"),
+        AIMessage(content="A1"),
+        HumanMessage(content="Q2"),
+    ]
+    # Prompt is cached up to the persona and up to the end of history
+    assert convert_messages(messages, cache_points=True) == {
+        "system": [{"text": "Be brief"}, CACHE_POINT],
+        "messages": [
+            {"role": "user", "content": [{"text": "Q1"}]},
+            {"role": "assistant", "content": [{"text": "A1"}, CACHE_POINT]},
+            {"role": "user", "content": [{"text": "Q2"}]},
+        ],
+    }
+    assert convert_messages([HumanMessage(content="Q1")], cache_points=True) == {
+        "messages": [{"role": "user", "content": [{"text": "Q1"}]}]
+    }
+
+
+@pytest.mark.asyncio
+async def test_list_foundation_models(transport, stub):
+    response = await transport.list_foundation_models(byOutputModality="TEXT")
+    assert [model["modelId"] for model in response["modelSummaries"]] == ["model-b", "model-a"]
+    path, query, authorization = stub.requests[0]
+    assert path == "/foundation-models"
+    assert query == {"byOutputModality": "TEXT"}
+    assert authorization.startswith("AWS4-HMAC-SHA256 Credential=test/")
+    assert "/eu-west-1/bedrock/aws4_request" in authorization
+
+
+@pytest.mark.asyncio
+async def test_sessions_of_closed_loops_are_closed(transport):
+    # Request in an event loop of its own, like the sync interface makes, leaves a session behind
+    await asyncio.get_running_loop().run_in_executor(None, asyncio.run, transport.list_foundation_models())
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        await transport.list_foundation_models()
+        gc.collect()
+    assert not [warning for warning in caught if "Unclosed client session" in str(warning.message)]
+
+
+@pytest.mark.asyncio
+async def test_chat_model_stream(transport, stub):
+    model = ChatBedrockAsync(transport=transport, model_id="anthropic.claude:0", model_kwargs={"temperature": 0.5})
+    chunks = [chunk async for chunk in model.astream([HumanMessage(content="Hi")])]
+    assert "".join(chunk.content for chunk in chunks) == "Hello from paita"
+    assert chunks[-1].usage_metadata == {"input_tokens": 10, "output_tokens": 3, "total_tokens": 13}
+
+    path, body, _ = stub.requests[0]
+    assert path == "/model/anthropic.claude%3A0/converse-stream"
+    assert body == {
+        "messages": [{"role": "user", "content": [{"text": "Hi"}]}],
+        "inferenceConfig": {"temperature": 0.5},
+    }
+
+    result = await model.ainvoke([HumanMessage(content="Hi")])
+    assert result.content == "Hello from paita"
+
+
+@pytest.mark.asyncio
+async def test_throttling_errors(transport):
+    with pytest.raises(ClientError) as e:
+        await ChatBedrockAsync(transport=transport, model_id="throttled").ainvoke("Hi")
+    assert is_throttling_error(e.value)
+
+    with pytest.raises(ClientError) as e:
+        await ChatBedrockAsync(transport=transport, model_id="failing").ainvoke("Hi")
+    assert is_throttling_error(e.value)
+    assert e.value.response["Error"]["Message"] == "Slow down"
+
+
+@pytest.mark.asyncio
+async def test_prompt_cache(transport, stub):
+    model = ChatBedrockAsync(transport=transport, model_id="anthropic.claude:0", prompt_cache=True)
+    stats = RequestStats()
+    messages = [SystemMessage(content="Be brief"), HumanMessage(content="Q1"), AIMessage(content="A1")]
+    await model.ainvoke([*messages, HumanMessage(content="Q2")], config={"callbacks": [UsageHandler(stats)]})
+
+    _, body, _ = stub.requests[0]
+    assert body["system"][-1] == CACHE_POINT
+    assert body["messages"][1]["content"][-1] == CACHE_POINT
+    assert (stats.input_tokens, stats.output_tokens, stats.cache_read_tokens) == (10, 3, 8)
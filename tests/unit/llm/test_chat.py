@@ -1,8 +1,18 @@
+import asyncio
+import time
+from typing import List, Optional
+
 import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.pydantic_v1 import Field
 
-from paita.llm.chat import AsyncHandler, Chat
+from paita.llm.chat import CONTINUE_INSTRUCTION, AsyncHandler, Chat
 from paita.llm.chat_history import ChatHistory
 from paita.llm.enums import AIService
+from paita.llm.journal import AnswerJournal
+from paita.llm.model_info import ModelInfo
+from paita.llm.services import bedrock, ollama, openai
 from paita.settings.llm_settings import LLMSettingsModel
 
 ai_service_models = {
@@ -41,3 +51,261 @@ def mock_env(monkeypatch):
 @pytest.fixture
 def chat_history():
     return ChatHistory(app_name="test", app_author="test", file_history=False)
+
+
+class SlowChatModel(GenericFakeChatModel):
+    delay: float = 0.0
+    chunk_delay: float = 0.0
+    fail: bool = False
+    fail_after: Optional[int] = None
+
+    async def _astream(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            msg = "Primary failed"
+            raise ConnectionError(msg)
+        chunks = 0
+        async for chunk in super()._astream(*args, **kwargs):
+            if chunks == self.fail_after:
+                msg = "Connection lost"
+                raise ConnectionError(msg)
+            chunks += 1
+            yield chunk
+            await asyncio.sleep(self.chunk_delay)
+
+
+class RecordingChatModel(SlowChatModel):
+    received: List[BaseMessage] = Field(default_factory=list)
+
+    async def _astream(self, messages, *args, **kwargs):
+        self.received.extend(messages)
+        async for chunk in super()._astream(messages, *args, **kwargs):
+            yield chunk
+
+
+def mock_chat_models(monkeypatch, *, primary: SlowChatModel, secondary: SlowChatModel):
+    monkeypatch.setattr(ollama.Ollama, "chat_model", lambda self: primary)  # noqa: ARG005
+    monkeypatch.setattr(openai.OpenAI, "chat_model", lambda self: secondary)  # noqa: ARG005
+
+
+@pytest.fixture
+def hedged_settings_model():
+    return LLMSettingsModel(
+        ai_service=AIService.Ollama.value,
+        ai_model="primary",
+        ai_hedge_service=AIService.OpenAI.value,
+        ai_hedge_model="secondary",
+        ai_hedge_delay=0.05,
+    )
+
+
+def answer_model(answer: str, **kwargs) -> SlowChatModel:
+    return SlowChatModel(messages=iter([AIMessage(content=answer)]), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_primary_wins(monkeypatch, chat, hedged_settings_model, chat_history):
+    hedged_settings_model.ai_hedge_delay = 10.0
+    mock_chat_models(monkeypatch, primary=answer_model("From primary"), secondary=answer_model("From secondary"))
+    chat.init_model(settings_model=hedged_settings_model, chat_history=chat_history)
+
+    answer = "".join([chunk async for chunk in chat.stream("Question")])
+    assert answer == "From primary"
+    assert not chat.last_request_stats.hedged
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_slow_primary(monkeypatch, chat, hedged_settings_model, chat_history):
+    mock_chat_models(
+        monkeypatch,
+        primary=answer_model("From primary", delay=2.0),
+        secondary=answer_model("From secondary"),
+    )
+    chat.init_model(settings_model=hedged_settings_model, chat_history=chat_history)
+
+    answer = "".join([chunk async for chunk in chat.stream("Question")])
+    assert answer == "From secondary"
+    assert chat.last_request_stats.hedged
+    assert chat.last_request_stats.served_by == f"{AIService.OpenAI.value}/secondary"
+    messages = await chat_history.history.aget_messages()
+    assert [message.content for message in messages] == ["Question", "From secondary"]
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_slow_stream(monkeypatch, chat, hedged_settings_model, chat_history):
+    secondary = RecordingChatModel(messages=iter([AIMessage(content="From secondary")]))
+    mock_chat_models(
+        monkeypatch,
+        primary=answer_model("From primary streaming slowly", chunk_delay=0.04),
+        secondary=secondary,
+    )
+    chat.init_model(settings_model=hedged_settings_model, chat_history=chat_history)
+
+    # Stream of the primary lasts well past the hedge delay
+    answer = "".join([chunk async for chunk in chat.stream("Question")])
+    assert answer == "From primary streaming slowly"
+    assert not chat.last_request_stats.hedged
+    assert secondary.received == []
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_failover(monkeypatch, chat, hedged_settings_model, chat_history):
+    hedged_settings_model.ai_hedge_delay = 10.0
+    mock_chat_models(
+        monkeypatch,
+        primary=answer_model("From primary", fail=True),
+        secondary=answer_model("From secondary"),
+    )
+    chat.init_model(settings_model=hedged_settings_model, chat_history=chat_history)
+
+    started = time.monotonic()
+    answer = "".join([chunk async for chunk in chat.stream("Question")])
+    assert answer == "From secondary"
+    # Failover does not wait for hedge delay
+    assert time.monotonic() - started < hedged_settings_model.ai_hedge_delay
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_all_fail(monkeypatch, chat, hedged_settings_model, chat_history):
+    mock_chat_models(
+        monkeypatch,
+        primary=answer_model("From primary", fail=True),
+        secondary=answer_model("From secondary", fail=True),
+    )
+    chat.init_model(settings_model=hedged_settings_model, chat_history=chat_history)
+
+    with pytest.raises(ConnectionError):
+        await chat.request("Question")
+
+
+@pytest.mark.asyncio
+async def test_history_fits_context_window(monkeypatch, chat, chat_history):
+    model = RecordingChatModel(messages=iter([AIMessage(content="Answer")]))
+    monkeypatch.setattr(ollama.Ollama, "chat_model", lambda self: model)  # noqa: ARG005
+    settings_model = LLMSettingsModel(
+        ai_service=AIService.Ollama.value, ai_model="small", ai_persona="", ai_max_tokens=10
+    )
+    model_info = ModelInfo(ai_service=AIService.Ollama.value, ai_model="small", context_length=80)
+    chat.init_model(settings_model=settings_model, chat_history=chat_history, model_info=model_info)
+
+    # Each old message is roughly 25 tokens so only two of them fit next to the request and the answer
+    old_messages = [HumanMessage(content="x" * 100), AIMessage(content="y" * 100)] * 3
+    await chat_history.history.aadd_messages(old_messages)
+    await chat.request("Question")
+
+    # Stored history is not trimmed, only the window sent to the model is
+    assert [message.content for message in model.received[1:]] == ["x" * 100, "y" * 100, "Question"]
+    messages = await chat_history.history.aget_messages()
+    assert [message.content for message in messages] == [message.content for message in old_messages] + [
+        "Question",
+        "Answer",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_request_cost(monkeypatch, chat, chat_history):
+    usage = {"input_tokens": 2000, "output_tokens": 500, "total_tokens": 2500}
+    model = SlowChatModel(messages=iter([AIMessage(content="Answer", usage_metadata=usage)]))
+    monkeypatch.setattr(ollama.Ollama, "chat_model", lambda self: model)  # noqa: ARG005
+    settings_model = LLMSettingsModel(ai_service=AIService.Ollama.value, ai_model="model", ai_streaming=False)
+    model_info = ModelInfo(ai_service=AIService.Ollama.value, ai_model="model", input_price=3.0, output_price=15.0)
+    chat.init_model(settings_model=settings_model, chat_history=chat_history, model_info=model_info)
+
+    await chat.request("Question")
+    stats = chat.last_request_stats
+    assert (stats.input_tokens, stats.output_tokens) == (2000, 500)
+    assert stats.cost == pytest.approx(0.0135)
+
+
+@pytest.mark.asyncio
+async def test_interrupted_answer_is_recovered(monkeypatch, tmp_path, chat, chat_history):
+    monkeypatch.setattr(ollama.Ollama, "chat_model", lambda self: answer_model("One two three", fail_after=2))  # noqa: ARG005
+    chat_history.journal = AnswerJournal(tmp_path / "chat_history.journal")
+    settings_model = LLMSettingsModel(ai_service=AIService.Ollama.value, ai_model="model")
+    chat.init_model(settings_model=settings_model, chat_history=chat_history)
+
+    with pytest.raises(ConnectionError):
+        await chat.request("Question")
+    assert await chat_history.history.aget_messages() == []
+    assert chat_history.journal.recover() == ("Question", "One ")
+
+    assert await chat_history.recover()
+    messages = await chat_history.history.aget_messages()
+    assert [message.content for message in messages] == ["Question", "One "]
+    assert messages[-1].response_metadata["partial"]
+    assert chat_history.journal.recover() is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("ai_service", "service", "instruction"),
+    [
+        (AIService.AWSBedRock, bedrock.Bedrock, []),
+        (AIService.Ollama, ollama.Ollama, [("human", CONTINUE_INSTRUCTION)]),
+    ],
+)
+async def test_resume_interrupted_answer(monkeypatch, tmp_path, chat, chat_history, ai_service, service, instruction):
+    chat_history.journal = AnswerJournal(tmp_path / "chat_history.journal")
+    settings_model = LLMSettingsModel(ai_service=ai_service.value, ai_model="model")
+    monkeypatch.setattr(service, "chat_model", lambda self: answer_model("One two three", fail_after=2))  # noqa: ARG005
+    chat.init_model(settings_model=settings_model, chat_history=chat_history)
+    with pytest.raises(ConnectionError):
+        await chat.request("Question")
+
+    continuation = RecordingChatModel(messages=iter([AIMessage(content="two three")]))
+    monkeypatch.setattr(service, "chat_model", lambda self: continuation)  # noqa: ARG005
+    chat.init_model(settings_model=settings_model, chat_history=chat_history)
+    answer = "".join([chunk async for chunk in chat.resume()])
+
+    # Only the missing part is generated, partial answer is sent as the prefix and models without prefill
+    # are asked to continue it
+    assert answer == "two three"
+    received = [(message.type, message.content) for message in continuation.received]
+    assert received[-2 - len(instruction) :] == [("human", "Question"), ("ai", "One "), *instruction]
+    messages = await chat_history.history.aget_messages()
+    assert [message.content for message in messages] == ["Question", "One two three"]
+    assert chat_history.interrupted() is None
+
+    with pytest.raises(ValueError, match="No interrupted answer"):
+        await chat.resume().__anext__()
+
+
+@pytest.mark.asyncio
+async def test_prompt_cache_keeps_history_window_stable(monkeypatch, chat, chat_history):
+    model = RecordingChatModel(messages=iter([AIMessage(content="Answer")] * 6))
+    monkeypatch.setattr(ollama.Ollama, "chat_model", lambda self: model)  # noqa: ARG005
+    settings_model = LLMSettingsModel(
+        ai_service=AIService.Ollama.value, ai_model="model", ai_history_depth=20, ai_prompt_cache=True
+    )
+    chat.init_model(settings_model=settings_model, chat_history=chat_history)
+    await chat_history.history.aadd_messages(
+        [HumanMessage(content=str(i)) if i % 2 == 0 else AIMessage(content=str(i)) for i in range(32)]
+    )
+
+    # Window grows with the conversation and keeps its start so that the prompt prefix stays the same,
+    # until it is moved forward by half of the history depth
+    windows = []
+    for _ in range(6):
+        model.received.clear()
+        await chat.request("Question")
+        history = model.received[1:-1]
+        windows.append((history[0].content, len(history)))
+    assert windows == [("20", 12), ("20", 14), ("20", 16), ("20", 18), ("20", 20), ("30", 12)]
+
+
+@pytest.mark.asyncio
+async def test_prompt_cache_keeps_history_in_token_budget(monkeypatch, chat, chat_history):
+    model = RecordingChatModel(messages=iter([AIMessage(content="Answer")]))
+    monkeypatch.setattr(ollama.Ollama, "chat_model", lambda self: model)  # noqa: ARG005
+    settings_model = LLMSettingsModel(
+        ai_service=AIService.Ollama.value, ai_model="small", ai_persona="", ai_max_tokens=10, ai_prompt_cache=True
+    )
+    model_info = ModelInfo(ai_service=AIService.Ollama.value, ai_model="small", context_length=364)
+    chat.init_model(settings_model=settings_model, chat_history=chat_history, model_info=model_info)
+    await chat_history.history.aadd_messages(
+        [HumanMessage(content="x" * 400) if i % 2 == 0 else AIMessage(content="y" * 400) for i in range(24)]
+    )
+
+    # Only three messages fit in the token budget, moving their start to the next step would drop all of them
+    await chat.request("Question")
+    assert [message.content for message in model.received[1:-1]] == ["y" * 400, "x" * 400, "y" * 400]
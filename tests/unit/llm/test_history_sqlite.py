@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from paita.llm.chat_history import ChatHistory
+from paita.llm.enums import HistoryBackend, Role
+from paita.llm.history_sqlite import SQLiteHistoryTree
+from paita.llm.history_tree import MAIN_BRANCH
+
+
+def conversation(*contents):
+    return [
+        HumanMessage(content=content) if i % 2 == 0 else AIMessage(content=content)
+        for i, content in enumerate(contents)
+    ]
+
+
+def contents_of(messages):
+    return [message.content for message in messages]
+
+
+def contents(tree, branch=None):
+    return contents_of(tree.messages(branch))
+
+
+def test_concurrent_instances(tmp_path):
+    path = tmp_path / "history.sqlite"
+    first = SQLiteHistoryTree(path, session="default")
+    second = SQLiteHistoryTree(path, session="default")
+    first.add(conversation("Q1", "A1"))
+    second.add(conversation("Q2", "A2"))
+    assert contents(first) == ["Q1", "A1", "Q2", "A2"]
+
+    # Sessions have their own branches
+    other = SQLiteHistoryTree(path, session="other")
+    assert other.created
+    assert not SQLiteHistoryTree(path, session="default").created
+    assert contents(other) == []
+
+
+def test_concurrent_writers(tmp_path):
+    path = tmp_path / "history.sqlite"
+    writers = 4
+    messages = 25
+
+    def write(number):
+        tree = SQLiteHistoryTree(path, session="default")
+        for i in range(messages):
+            tree.add([HumanMessage(content=f"{number}-{i}")])
+
+    threads = [threading.Thread(target=write, args=(number,)) for number in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    tree = SQLiteHistoryTree(path, session="default")
+    assert tree.length() == writers * messages
+    assert len(set(contents(tree))) == writers * messages
+
+
+def test_fork_and_switch(tmp_path):
+    path = tmp_path / "history.sqlite"
+    tree = SQLiteHistoryTree(path, session="default")
+    tree.add(conversation("Q1", "A1", "Q2", "A2"))
+    name = tree.fork(length=2)
+    tree.add(conversation("Other Q2"))
+    assert contents(tree) == ["Q1", "A1", "Other Q2"]
+    assert contents(tree, MAIN_BRANCH) == ["Q1", "A1", "Q2", "A2"]
+    assert len(tree) == 5
+
+    # Current branch is kept in the database
+    reopened = SQLiteHistoryTree(path, session="default")
+    assert reopened.branch == name
+    assert {branch.name: branch.length for branch in reopened.branches()} == {MAIN_BRANCH: 4, name: 3}
+
+    reopened.switch(MAIN_BRANCH)
+    reopened.reset()
+    assert contents(reopened) == []
+    assert contents(reopened, name) == ["Q1", "A1", "Other Q2"]
+    with pytest.raises(ValueError, match="Cannot fork"):
+        reopened.fork(length=1)
+    with pytest.raises(ValueError, match="Unknown branch"):
+        reopened.switch("missing")
+
+
+def test_window_and_records(tmp_path):
+    tree = SQLiteHistoryTree(tmp_path / "history.sqlite", session="default")
+    tree.add(conversation("x" * 100, "y" * 100, "Q2", "A2"))
+    assert contents_of(tree.window(max_length=3)) == ["y" * 100, "Q2", "A2"]
+    assert contents_of(tree.window(max_length=10, max_tokens=10)) == ["Q2", "A2"]
+
+    tree.add([HumanMessage(content=[{"type": "text", "text": "Q3"}]), AIMessage(content="A3 ✓")])
+    view = tree.messages()
+    assert view[-1] == AIMessage(content="A3 ✓")
+    assert [(record.content, record.role) for record in view[-2:].records()] == [
+        ([{"type": "text", "text": "Q3"}], Role.question),
+        ("A3 ✓", Role.answer),
+    ]
+
+
+def test_chat_history_close(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    chat_history = ChatHistory(app_name="test", app_author="test", backend=HistoryBackend.sqlite.value)
+    chat_history.tree.add(conversation("Q1", "A1"))
+    chat_history.close()
+    with pytest.raises(sqlite3.ProgrammingError, match="closed"):
+        chat_history.tree.length()
+
+    # File backend has nothing to close
+    ChatHistory(app_name="test", app_author="test", file_history=False).close()
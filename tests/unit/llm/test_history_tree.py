@@ -0,0 +1,98 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from paita.llm.enums import Role
+from paita.llm.history_tree import MAIN_BRANCH, HistoryTree
+
+
+def conversation(*contents):
+    return [
+        HumanMessage(content=content) if i % 2 == 0 else AIMessage(content=content)
+        for i, content in enumerate(contents)
+    ]
+
+
+def contents_of(messages):
+    return [message.content for message in messages]
+
+
+def contents(tree, branch=None):
+    return contents_of(tree.messages(branch))
+
+
+def test_fork_shares_prefix(tmp_path):
+    tree = HistoryTree(tmp_path / "history.tree")
+    tree.add(conversation("Q1", "A1", "Q2", "A2"))
+    assert len(tree) == 4
+
+    # Forking stores nothing but the branch pointer
+    name = tree.fork(length=2)
+    assert tree.branch == name
+    assert contents(tree) == ["Q1", "A1"]
+    assert len(tree) == 4
+
+    tree.add(conversation("Other Q2", "Other A2"))
+    assert contents(tree) == ["Q1", "A1", "Other Q2", "Other A2"]
+    assert contents(tree, MAIN_BRANCH) == ["Q1", "A1", "Q2", "A2"]
+    assert len(tree) == 6
+
+    # Same message on the same parent is the same node
+    tree.switch(MAIN_BRANCH)
+    tree.fork(length=2)
+    tree.add(conversation("Q2"))
+    assert len(tree) == 6
+
+    with pytest.raises(ValueError, match="Cannot fork"):
+        tree.fork(length=10)
+
+
+def test_reset_keeps_other_branches():
+    tree = HistoryTree()
+    tree.add(conversation("Q1", "A1"))
+    name = tree.fork(length=2)
+    tree.reset()
+    assert contents(tree) == []
+    assert contents(tree, MAIN_BRANCH) == ["Q1", "A1"]
+    assert {branch.name: branch.length for branch in tree.branches()} == {MAIN_BRANCH: 2, name: 0}
+
+
+def test_persistence(tmp_path):
+    path = tmp_path / "history.tree"
+    tree = HistoryTree(path)
+    tree.add(conversation("Q1", "A1"))
+    name = tree.fork(length=1)
+    tree.add([AIMessage(content="Other A1")])
+    with open(path, "a", encoding="utf-8") as tree_file:
+        tree_file.write('{"type": "no')
+
+    loaded = HistoryTree(path)
+    assert loaded.branch == name
+    assert contents(loaded) == ["Q1", "Other A1"]
+    assert contents(loaded, MAIN_BRANCH) == ["Q1", "A1"]
+    assert len(loaded) == 3
+
+
+def test_window():
+    tree = HistoryTree()
+    tree.add(conversation("x" * 100, "y" * 100, "Q2", "A2"))
+    assert contents_of(tree.window(max_length=3)) == ["y" * 100, "Q2", "A2"]
+    # Each long message is roughly 25 tokens
+    assert contents_of(tree.window(max_length=10, max_tokens=30)) == ["y" * 100, "Q2", "A2"]
+    assert contents_of(tree.window(max_length=10, max_tokens=10)) == ["Q2", "A2"]
+
+
+def test_messages_round_trip(tmp_path):
+    path = tmp_path / "history.tree"
+    messages = [
+        HumanMessage(content=[{"type": "text", "text": "Q1"}]),
+        AIMessage(content="A1 ✓", response_metadata={"partial": True}),
+    ]
+    HistoryTree(path).add(messages)
+
+    view = HistoryTree(path).messages()
+    assert list(view) == messages
+    assert view[-1].response_metadata == {"partial": True}
+    assert [(record.content, record.role) for record in view.records()] == [
+        ([{"type": "text", "text": "Q1"}], Role.question),
+        ("A1 ✓", Role.answer),
+    ]
@@ -0,0 +1,63 @@
+import pytest
+
+from paita.llm.journal import AnswerJournal
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def append_torn_record(path):
+    with open(path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"type": "chunk", "te')
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def journal(tmp_path, clock) -> AnswerJournal:
+    return AnswerJournal(tmp_path / "chat_history.journal", sync_interval=1.0, sync_bytes=100, clock=clock)
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_synced_in_batches(journal, clock):
+    await journal.begin("Question")
+    await journal.append("Hello")
+    await journal.append(" there")
+    # Nothing synced until interval or size limit is reached
+    assert journal.recover() == ("Question", "")
+
+    clock.now = 1.0
+    await journal.append("!")
+    assert journal.recover() == ("Question", "Hello there!")
+
+    await journal.append("x" * 100)
+    assert journal.recover() == ("Question", "Hello there!" + "x" * 100)
+
+
+@pytest.mark.asyncio
+async def test_commit_truncates(journal):
+    assert journal.recover() is None
+    await journal.begin("Question")
+    await journal.append("Answer")
+    await journal.sync()
+    assert journal.recover() == ("Question", "Answer")
+
+    await journal.commit()
+    assert journal.recover() is None
+
+
+@pytest.mark.asyncio
+async def test_torn_record_is_skipped(journal):
+    await journal.begin("Question")
+    await journal.append("Partial")
+    await journal.sync()
+    append_torn_record(journal.path)
+    assert journal.recover() == ("Question", "Partial")
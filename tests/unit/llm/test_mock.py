@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from paita.llm.chat import Chat
+from paita.llm.chat_history import ChatHistory
+from paita.llm.enums import AIService
+from paita.llm.models import list_models
+from paita.llm.services.mock import MOCK_SERVICE_ENV, Mock, MockChatModel
+from paita.settings.llm_settings import LLMSettingsModel
+from paita.tui.message_box import LARGE_MESSAGE_CHARS
+
+
+@pytest.mark.asyncio
+async def test_mock_models_hidden_by_default(monkeypatch):
+    monkeypatch.delenv(MOCK_SERVICE_ENV, raising=False)
+    assert await list_models(AIService.Mock.value) == []
+    monkeypatch.setenv(MOCK_SERVICE_ENV, "1")
+    assert "mock-fast" in await list_models(AIService.Mock.value)
+
+
+@pytest.mark.asyncio
+async def test_mock_chat():
+    settings_model = LLMSettingsModel(
+        ai_service=AIService.Mock.value,
+        ai_model="mock-fast",
+        ai_model_kwargs={"seed": 1, "first_token_delay": 0.0, "unknown": 1},
+        ai_max_tokens=100,
+    )
+    chat_history = ChatHistory(app_name="test", app_author="test", file_history=False)
+    chat = Chat()
+    chat.init_model(settings_model=settings_model, chat_history=chat_history)
+
+    answer = "".join([chunk async for chunk in chat.stream("Question")])
+    assert answer
+    messages = await chat_history.history.aget_messages()
+    assert [message.content for message in messages] == ["Question", answer]
+    # Every token is at most one word
+    assert len(answer.split()) <= settings_model.ai_max_tokens
+
+
+def test_mock_huge_is_a_large_message():
+    # Default max tokens of the settings doesn't cut the answer
+    settings_model = LLMSettingsModel(
+        ai_service=AIService.Mock.value, ai_model="mock-huge", ai_model_kwargs={"seed": 1}
+    )
+    model = Mock(settings_model=settings_model).chat_model()
+
+    # Chunks without streaming them, streaming 50k tokens through LangChain takes seconds
+    answer = "".join(chunk.text for _, chunk in model._chunks([]))  # noqa: SLF001
+    assert len(answer) > LARGE_MESSAGE_CHARS
+
+
+@pytest.mark.asyncio
+async def test_mock_token_rate(monkeypatch):
+    model = MockChatModel(
+        tokens_per_second=1000, first_token_delay=0.05, response_tokens=200, response_tokens_sigma=0, seed=1
+    )
+    # Sleeps advance a fake clock so that delays don't depend on how busy the machine is
+    clock = [0.0]
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+        clock[0] += delay
+
+    with monkeypatch.context() as patch:
+        patch.setattr(asyncio, "sleep", sleep)
+        patch.setattr(asyncio.get_running_loop(), "time", lambda: clock[0])
+        chunks = [chunk async for chunk in model.astream("Question")]
+
+    assert chunks[-1].usage_metadata["output_tokens"] == 200
+    assert delays[0] == pytest.approx(0.05)
+    assert all(delay == pytest.approx(0.001) for delay in delays[1:])
+    # Text chunks arrive at the token rate after the first token delay, usage comes right after the last one
+    assert clock[0] == pytest.approx(0.05 + (len(chunks) - 2) * 0.001)
+
+
+@pytest.mark.asyncio
+async def test_mock_errors():
+    model = MockChatModel(error_rate=1.0, speed=0, seed=1)
+    with pytest.raises(ConnectionError):
+        await model.ainvoke("Question")
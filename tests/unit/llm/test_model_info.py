@@ -0,0 +1,65 @@
+import pytest
+
+from paita.llm import model_catalog
+from paita.llm.enums import AIService
+from paita.llm.model_catalog import ModelCatalog
+from paita.llm.model_info import ModelInfo, bundled_model_info
+from paita.llm.services.ollama import parse_show_response
+from paita.utils.cache import TieredCache
+
+
+def test_bundled_model_info():
+    info = bundled_model_info(ai_service=AIService.OpenAI.value, ai_model="gpt-4o-mini-2024-07-18")
+    assert (info.context_length, info.max_output_tokens, info.input_price) == (128000, 16384, 0.15)
+
+    bedrock = AIService.AWSBedRock.value
+    info = bundled_model_info(ai_service=bedrock, ai_model="us.anthropic.claude-3-haiku-20240307-v1:0")
+    assert info.context_length == 200000
+    assert info.ai_model == "us.anthropic.claude-3-haiku-20240307-v1:0"
+
+    info = bundled_model_info(ai_service=AIService.Ollama.value, ai_model="llama3.1:8b")
+    assert (info.context_length, info.input_price) == (131072, 0.0)
+
+    info = bundled_model_info(ai_service=AIService.OpenAI.value, ai_model="unknown")
+    assert info.context_length is None
+
+
+def test_merge_and_cost():
+    bundled = ModelInfo(ai_service="s", ai_model="m", context_length=8192, input_price=1.0, output_price=2.0)
+    reported = ModelInfo(ai_service="s", ai_model="m", context_length=4096, streaming=False)
+    info = bundled.merge(reported)
+    assert (info.context_length, info.streaming, info.input_price) == (4096, False, 1.0)
+    assert info.cost(input_tokens=1_000_000, output_tokens=500_000) == pytest.approx(2.0)
+    assert info.summary() == "context 4,096, no streaming, $1/$2 per 1M tokens"
+
+
+def test_parse_show_response():
+    response = {"parameters": "stop <|eot_id|>\nnum_ctx 4096", "model_info": {"llama.context_length": 131072}}
+    assert parse_show_response("llama3.1", response).context_length == 4096
+    response = {"model_info": {"llama.context_length": 131072}}
+    assert parse_show_response("llama3.1", response).context_length == 131072
+
+
+@pytest.mark.asyncio
+async def test_catalog(monkeypatch, tmp_path):
+    calls = []
+
+    async def get_model_info(*, ai_service, ai_model):
+        calls.append(ai_model)
+        if ai_model == "failing":
+            msg = "Connection refused"
+            raise ConnectionError(msg)
+        return ModelInfo(ai_service=ai_service, ai_model=ai_model, context_length=4096)
+
+    monkeypatch.setattr(model_catalog, "get_model_info", get_model_info)
+    catalog = ModelCatalog(TieredCache(tmp_path.as_posix()))
+
+    info = await catalog.get(ai_service=AIService.Ollama.value, ai_model="llama3:latest")
+    assert (info.context_length, info.output_price) == (4096, 0.0)
+    assert await catalog.get(ai_service=AIService.Ollama.value, ai_model="llama3:latest") == info
+
+    # Bundled values are used when the AI Service can't be reached, and it is asked again next time
+    info = await catalog.get(ai_service=AIService.Ollama.value, ai_model="failing")
+    assert info.input_price == 0.0
+    await catalog.get(ai_service=AIService.Ollama.value, ai_model="failing")
+    assert calls == ["llama3:latest", "failing", "failing"]
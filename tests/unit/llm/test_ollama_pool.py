@@ -0,0 +1,165 @@
+import httpx
+import pytest
+from ollama import ResponseError
+
+from paita.llm.enums import ModelLoadState
+from paita.llm.services.ollama_pool import CircuitBreaker, OllamaPool, parse_keep_alive
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeClient:
+    def __init__(self, *, available, loaded, fail=False):
+        self.available = available
+        self.loaded = loaded
+        self.fail = fail
+        self.generated = []
+
+    async def list(self):
+        if self.fail:
+            msg = "Connection refused"
+            raise httpx.ConnectError(msg)
+        return {"models": [{"name": name} for name in self.available]}
+
+    async def ps(self):
+        return {"models": [{"name": name} for name in self.loaded]}
+
+    async def generate(self, *, model, prompt, keep_alive):
+        if model not in self.available:
+            msg = f"model '{model}' not found"
+            raise ResponseError(msg, 404)
+        self.generated.append((model, keep_alive))
+        return {"model": model, "response": prompt, "done": True}
+
+
+@pytest.fixture
+def pool() -> OllamaPool:
+    _pool = OllamaPool(["http://gpu1:11434", "http://gpu2:11434", "http://gpu3:11434"])
+    gpu1, gpu2, gpu3 = _pool.endpoints
+    gpu1.client = FakeClient(available=["llama3", "mistral"], loaded=["mistral"])
+    gpu2.client = FakeClient(available=["llama3", "mistral"], loaded=["llama3"])
+    gpu3.client = FakeClient(available=["llama3", "phi3"], loaded=["llama3"], fail=True)
+    return _pool
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.available()
+    breaker.record_failure()
+    assert not breaker.available()
+
+    # Half-open allows a single trial, a failure opens it again
+    clock.now = 10
+    assert breaker.available()
+    breaker.begin()
+    assert not breaker.available()
+    breaker.end()
+    assert breaker.available()
+    breaker.begin()
+    breaker.record_failure()
+    assert not breaker.available()
+
+    clock.now = 20
+    assert breaker.available()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.available()
+
+
+@pytest.mark.asyncio
+async def test_single_trial_when_half_open(pool):
+    clock = FakeClock()
+    _, gpu2, gpu3 = pool.endpoints
+    await pool.refresh()
+    gpu2.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    gpu2.breaker.record_failure()
+    gpu3.breaker = CircuitBreaker(failure_threshold=1)
+    gpu3.breaker.record_failure()
+
+    clock.now = 10
+    async with pool.acquire("llama3") as trial:
+        assert trial is gpu2
+        # Other requests avoid the host until the trial is resolved
+        assert pool.select("llama3") is not gpu2
+    assert not gpu2.breaker.is_open
+    assert pool.select("llama3") is gpu2
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("OLLAMA_ENDPOINT", "gpu1:11434, https://gpu2:11434")
+    pool = OllamaPool.from_env()
+    assert [endpoint.host for endpoint in pool.endpoints] == ["http://gpu1:11434", "https://gpu2:11434"]
+
+    monkeypatch.delenv("OLLAMA_ENDPOINT")
+    assert [endpoint.host for endpoint in OllamaPool.from_env().endpoints] == [None]
+
+
+@pytest.mark.asyncio
+async def test_select_resident_model(pool):
+    await pool.refresh()
+    gpu1, gpu2, _ = pool.endpoints
+    assert pool.models() == ["llama3", "mistral"]
+    assert pool.select("llama3") is gpu2
+    assert pool.select("mistral") is gpu1
+
+
+@pytest.mark.asyncio
+async def test_select_least_loaded(pool):
+    await pool.refresh()
+    gpu1, gpu2, _ = pool.endpoints
+    async with pool.acquire("llama3") as first:
+        assert first is gpu2
+        gpu1.loaded_models.add("llama3")
+        async with pool.acquire("llama3") as second:
+            assert second is gpu1
+    assert gpu1.in_flight == gpu2.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_endpoint_out_of_rotation(pool):
+    gpu1, gpu2, gpu3 = pool.endpoints
+    gpu3.breaker = CircuitBreaker(failure_threshold=1)
+    await pool.refresh()
+    assert not gpu3.breaker.available()
+
+    gpu1.breaker = CircuitBreaker(failure_threshold=1)
+
+    async def request():
+        async with pool.acquire("mistral"):
+            msg = "Connection reset"
+            raise httpx.ConnectError(msg)
+
+    with pytest.raises(httpx.ConnectError):
+        await request()
+    assert pool.select("mistral") is gpu2
+
+
+@pytest.mark.asyncio
+async def test_warm_up(pool):
+    _, gpu2, gpu3 = pool.endpoints
+    gpu3.breaker = CircuitBreaker(failure_threshold=1)
+    await pool.refresh()
+    assert pool.load_state("phi3") is ModelLoadState.unloaded
+    assert pool.load_state("llama3") is ModelLoadState.loaded
+
+    # phi3 is only available on the unhealthy host
+    assert await pool.warm_up("phi3") is ModelLoadState.failed
+    gpu2.client.available.append("phi3")
+    await pool.refresh(force=True)
+    assert await pool.warm_up("phi3", keep_alive="30m") is ModelLoadState.loaded
+    assert gpu2.client.generated == [("phi3", "30m")]
+
+
+def test_parse_keep_alive():
+    assert parse_keep_alive(None) is None
+    assert parse_keep_alive("") is None
+    assert parse_keep_alive("-1") == -1
+    assert parse_keep_alive("30m") == "30m"
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from paita.llm.chat import Chat
+from paita.llm.chat_history import ChatHistory
+from paita.llm.enums import AIService
+from paita.llm.recording import Recording, RecordingHandler, ReplayChatModel
+from paita.settings.llm_settings import LLMSettingsModel
+
+
+@pytest.fixture
+def settings_model():
+    return LLMSettingsModel(ai_service=AIService.Ollama.value, ai_model="model")
+
+
+def chat_history():
+    return ChatHistory(app_name="test", app_author="test", file_history=False)
+
+
+def recording_handler(directory, received):
+    handler = RecordingHandler(directory)
+    handler.register_callbacks(received.append, received.append, received.append)
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path, settings_model):
+    received = []
+    handler = recording_handler(tmp_path, received)
+    model = GenericFakeChatModel(messages=iter([AIMessage(content="Hello from paita")]))
+    chat = Chat()
+    chat.init_model(
+        settings_model=settings_model, chat_history=chat_history(), callback_handler=handler, chat_model=model
+    )
+    await chat.request("Question")
+
+    # Recording handler still forwards callbacks
+    assert received[-1] == "Hello from paita"
+    assert len(handler.recorded) == 1
+    recording = Recording.load(handler.recorded[0])
+    assert recording.text == "Hello from paita"
+    assert [offset for offset, _ in recording.tokens] == sorted(offset for offset, _ in recording.tokens)
+    assert recording.result.generations[0][0].text == "Hello from paita"
+
+    replay_model = ReplayChatModel.from_recording(recording, speed=0)
+    chat.init_model(settings_model=settings_model, chat_history=chat_history(), chat_model=replay_model)
+    answer = "".join([chunk async for chunk in chat.stream("Question")])
+    assert answer == "Hello from paita"
+
+
+@pytest.mark.asyncio
+async def test_replay_timing():
+    model = ReplayChatModel(tokens=[(0.0, "One"), (0.5, " two"), (1.0, " three")], speed=10)
+    started = time.monotonic()
+    chunks = [chunk.content async for chunk in model.astream("Question")]
+    elapsed = time.monotonic() - started
+
+    assert "".join(chunks) == "One two three"
+    # One second of tokens played ten times faster
+    assert 0.09 <= elapsed < 0.5
+
+
+def test_replay_usage_metadata():
+    usage = {"input_tokens": 10, "output_tokens": 3, "total_tokens": 13}
+    model = ReplayChatModel(tokens=[(0.0, "Hi")], usage_metadata=usage, speed=0)
+    result = model.invoke("Question")
+    assert result.content == "Hi"
+    assert result.usage_metadata == usage
@@ -0,0 +1,90 @@
+import pytest
+
+from paita.llm.scheduler import RequestScheduler, RequestStats, TokenBucket, is_throttling_error
+
+
+class ThrottlingException(Exception):  # noqa: N818
+    pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, clock=clock)
+
+    assert bucket.reserve(60) == 0
+    # Bucket is empty, one token per second is refilled
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(2) == pytest.approx(3.0)
+
+    clock.now = 3.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_token_bucket_output_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, clock=clock)
+    bucket.consume(90)
+    assert bucket.reserve(1) == pytest.approx(31.0)
+
+
+def test_is_throttling_error():
+    assert is_throttling_error(ThrottlingException())
+    assert not is_throttling_error(ValueError())
+
+    class ClientError(Exception):
+        response = {"Error": {"Code": "ThrottlingException"}}
+
+    assert is_throttling_error(ClientError())
+
+
+@pytest.mark.asyncio
+async def test_retry_throttled_request():
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ThrottlingException
+        yield "Hello"
+
+    scheduler = RequestScheduler(base_delay=0.001)
+    stats = RequestStats()
+    chunks = [chunk async for chunk in scheduler.stream(("service", "model"), request, tokens=1, stats=stats)]
+    assert chunks == ["Hello"]
+    assert stats.attempts == 3
+
+
+@pytest.mark.asyncio
+async def test_no_retry_after_output():
+    async def request():
+        yield "Hello"
+        raise ThrottlingException
+
+    scheduler = RequestScheduler(base_delay=0.001)
+    stats = RequestStats()
+    with pytest.raises(ThrottlingException):
+        async for _ in scheduler.stream(("service", "model"), request, tokens=1, stats=stats):
+            pass
+    assert stats.attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_give_up_after_max_retries():
+    async def request():
+        raise ThrottlingException
+        yield
+
+    scheduler = RequestScheduler(base_delay=0.001)
+    stats = RequestStats()
+    with pytest.raises(ThrottlingException):
+        async for _ in scheduler.stream(("service", "model"), request, tokens=1, stats=stats, max_retries=2):
+            pass
+    assert stats.attempts == 3
@@ -0,0 +1,3 @@
+# SPDX-FileCopyrightText: 2024-present Ville Kärkkäinen <ville.karkkainen@outlook.com>
+#
+# SPDX-License-Identifier: MIT
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from itertools import cycle
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from paita.llm.chat import Chat
+from paita.llm.enums import AIService
+from paita.llm.services import ollama
+from paita.llm.services.service import LLMSettingsModel
+from paita.server.app import create_app, sse_event
+from paita.server.sessions import SessionStore, validate_session_id
+
+
+def parse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+@pytest.fixture
+def mock_chat_model(monkeypatch):
+    def chat_model(self):  # noqa: ARG001
+        return GenericFakeChatModel(messages=cycle([AIMessage(content="Hello from paita")]))
+
+    monkeypatch.setattr(ollama.Ollama, "chat_model", chat_model)
+
+
+@pytest_asyncio.fixture
+async def client(mock_chat_model):  # noqa: ARG001
+    sessions = SessionStore(app_name="paita_unit_tests", app_author="unit_test", file_history=False)
+    chat = Chat()
+    chat.init_model(
+        settings_model=LLMSettingsModel(ai_service=AIService.Ollama.value, ai_model="mock"),
+        history_factory=sessions.history,
+    )
+    async with TestClient(TestServer(create_app(chat=chat, sessions=sessions, max_concurrency=2))) as test_client:
+        yield test_client
+
+
+def test_sse_event():
+    assert sse_event("token", {"token": "a"}) == b'event: token\ndata: {"token": "a"}\n\n'
+
+
+def test_validate_session_id():
+    assert validate_session_id("team-1_a") == "team-1_a"
+    with pytest.raises(ValueError, match="Invalid session id"):
+        validate_session_id("../etc")
+
+
+@pytest.mark.asyncio
+async def test_post_message_streams_tokens(client):
+    response = await client.post("/sessions/alice/messages", json={"input": "Hi"})
+    assert response.status == 200
+    assert response.headers["Content-Type"] == "text/event-stream"
+
+    events = parse_events(await response.text())
+    tokens = "".join(data["token"] for event, data in events if event == "token")
+    assert tokens == "Hello from paita"
+    event, data = events[-1]
+    assert event == "end"
+    assert data["output"] == "Hello from paita"
+    assert data["stats"]["attempts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_isolated(client):
+    async def post(session_id: str, data: str) -> str:
+        response = await client.post(f"/sessions/{session_id}/messages", json={"input": data})
+        return await response.text()
+
+    await asyncio.gather(post("alice", "From alice"), post("bob", "From bob"))
+
+    response = await client.get("/sessions/alice/messages")
+    messages = (await response.json())["messages"]
+    assert [message["content"] for message in messages] == ["From alice", "Hello from paita"]
+    assert [message["role"] for message in messages] == ["question", "answer"]
+
+    response = await client.delete("/sessions/bob")
+    assert response.status == 204
+    response = await client.get("/sessions/bob/messages")
+    assert (await response.json())["messages"] == []
+
+
+@pytest.mark.asyncio
+async def test_client_disconnects(monkeypatch, client):
+    writes = []
+
+    async def write(self, data):  # noqa: ARG001
+        writes.append(data)
+        raise ConnectionResetError
+
+    monkeypatch.setattr(web.StreamResponse, "write", write)
+    response = await client.post("/sessions/alice/messages", json={"input": "Hi"})
+    # Nothing is written after the client is gone, not even an error event
+    assert await response.text() == ""
+    assert writes == [sse_event("token", {"token": "Hello"})]
+
+
+@pytest.mark.asyncio
+async def test_invalid_requests(client):
+    response = await client.post("/sessions/alice/messages", data="not json")
+    assert response.status == 400
+    response = await client.get("/sessions/a.b/messages")
+    assert response.status == 400
+
+
+@pytest.mark.asyncio
+async def test_delete_waits_for_requests():
+    sessions = SessionStore(app_name="paita_unit_tests", app_author="unit_test", file_history=False)
+    sessions.history("alice")
+    lock = sessions.lock("alice")
+    async with lock:
+        delete = asyncio.create_task(sessions.delete("alice"))
+        await asyncio.sleep(0)
+        assert len(sessions) == 1
+    await delete
+    assert len(sessions) == 0
+    # Requests waiting for the old lock stay in order with requests made after the delete
+    assert sessions.lock("alice") is lock
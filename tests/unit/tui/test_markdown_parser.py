@@ -0,0 +1,54 @@
+import pytest
+
+from paita.tui.markdown_parser import CachedParser, SourceMap, ThreadLocalParser
+from paita.utils.cache import TieredCache
+
+MESSAGE = "# Answer\n\n" + "Some *markdown* with `code` and a [link](https://example.com).\n\n" * 20
+
+
+@pytest.fixture
+def parser() -> ThreadLocalParser:
+    return ThreadLocalParser()
+
+
+def cached_parser(directory, parser: ThreadLocalParser) -> CachedParser:
+    return CachedParser(TieredCache(str(directory), "markdown_cache").namespace("tokens"), parser=parser)
+
+
+def test_tokens_are_cached_by_content(tmp_path, parser):
+    cached = cached_parser(tmp_path, parser)
+    tokens = cached.parse(MESSAGE)
+    assert tokens == parser.parse(MESSAGE)
+    assert cached.parse(MESSAGE) is tokens
+    assert cached.cache.stats.memory_hits == 1
+
+    # Reopening a session loads tokens from disk instead of parsing
+    reopened = cached_parser(tmp_path, parser)
+    assert reopened.parse(MESSAGE) == tokens
+    assert reopened.cache.stats.disk_hits == 1
+
+    assert reopened.parse(MESSAGE + "More") != tokens
+    assert reopened.cache.stats.misses == 1
+
+
+def test_short_messages_are_not_cached(tmp_path, parser):
+    cached = cached_parser(tmp_path, parser)
+    assert cached.parse("*short*") == parser.parse("*short*")
+    assert cached.cache.keys() == []
+
+
+def test_source_map(parser):
+    source = "# Title\n\nPara one\nline two\n\n| a | b |\n|---|---|\n| 1 | 2 |\n\n```py\nx = 1\n```\n\n- a\n- b\n\n---\n> quote\n"
+    source_map = SourceMap(source, parser.parse(source))
+    assert [source_map.block(index) for index in range(len(source_map))] == [
+        "# Title",
+        "Para one\nline two",
+        "| a | b |\n|---|---|\n| 1 | 2 |",
+        "```py\nx = 1\n```",
+        "- a\n- b",
+        "---",
+        "> quote",
+    ]
+    assert source_map.block_at(source.index("line two")) == 1
+    assert source_map.block_at(source.index("\n\n| a") - 1) == 1
+    assert source_map.block_at(source.index("\n\n| a")) is None
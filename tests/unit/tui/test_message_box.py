@@ -0,0 +1,72 @@
+from rich.console import Console
+from rich.syntax import Syntax
+
+from paita.tui.message_box import HighlightedSyntax, highlighted_syntax, markdown_chunks, split_markdown
+
+CODE = "def add(a, b):\n    return a + b\n"
+
+
+def render(renderable) -> str:
+    console = Console(width=40, record=True, force_terminal=True, color_system="truecolor")
+    console.print(renderable)
+    return console.export_text(styles=True)
+
+
+def test_highlighted_syntax_renders_like_syntax(monkeypatch):
+    calls = []
+    highlight = Syntax.highlight
+    monkeypatch.setattr(Syntax, "highlight", lambda self, *args: calls.append(args) or highlight(self, *args))
+
+    syntax = HighlightedSyntax(CODE, lexer="python", indent_guides=True, padding=(1, 2))
+    expected = render(Syntax(CODE, lexer="python", indent_guides=True, padding=(1, 2)))
+    assert render(syntax) == expected
+    assert render(syntax) == expected
+    # One highlight for the plain Syntax and one for both renders of HighlightedSyntax
+    assert len(calls) == 2
+
+
+def test_highlighted_syntax_is_shared():
+    focused = highlighted_syntax(CODE, lexer="python", theme="monokai", highlight=True)
+    assert highlighted_syntax(CODE, lexer="python", theme="monokai", highlight=True) is focused
+    assert highlighted_syntax(CODE, lexer="python", theme="monokai", highlight=False) is not focused
+    assert highlighted_syntax(CODE + "\n", lexer="python", theme="monokai", highlight=True) is not focused
+
+
+def test_split_markdown():
+    paragraphs = "".join(f"Paragraph {i} " + "x" * 80 + "\n\n" for i in range(20))
+    chunks = split_markdown(paragraphs, chunk_chars=500)
+    assert "".join(chunks) == paragraphs
+    assert all(len(chunk) < 600 for chunk in chunks)
+    assert all(chunk.endswith("\n\n") for chunk in chunks)
+
+    assert split_markdown("Short", chunk_chars=500) == ["Short"]
+    assert split_markdown("", chunk_chars=500) == [""]
+
+
+def test_split_markdown_reopens_long_fences():
+    code = "".join(f"print({i})\n" for i in range(100))
+    chunks = split_markdown(f"Intro\n\n```python\n{code}```\n\nOutro\n", chunk_chars=300)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        fences = [line for line in chunk.splitlines() if line.startswith("```")]
+        assert len(fences) % 2 == 0
+    content = [line for chunk in chunks for line in chunk.splitlines() if not line.startswith("```")]
+    assert content == ["Intro", "", *code.splitlines(), "", "Outro"]
+    assert all(chunk.startswith("```python") for chunk in chunks[1:-1])
+
+
+def test_markdown_chunk_starts():
+    paragraphs = "".join(f"Paragraph {i} " + "x" * 80 + "\n\n" for i in range(20))
+    assert all(
+        paragraphs[start : start + len(chunk)] == chunk for start, chunk in markdown_chunks(paragraphs, chunk_chars=500)
+    )
+
+    fence = "```python\n"
+    code = "".join(f"print({i})\n" for i in range(100))
+    text = f"Intro\n\n{fence}{code}```\n\nOutro\n"
+    chunks = markdown_chunks(text, chunk_chars=300)
+    assert [chunk for _, chunk in chunks] == split_markdown(text, chunk_chars=300)
+    # Reopened fence line is before the start and closing fence line is added to the chunk
+    for start, chunk in chunks[1:-1]:
+        body = chunk[len(fence) : -len("```")]
+        assert text[start + len(fence) : start + len(fence) + len(body)] == body
@@ -0,0 +1,99 @@
+import pytest
+
+from paita.utils.cache import LRUCache, TieredCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def cache(tmp_path) -> TieredCache:
+    return TieredCache(tmp_path.as_posix(), "cache")
+
+
+def test_lru_cache():
+    clock = FakeClock()
+    evicted = []
+    lru = LRUCache(max_items=2, on_evict=evicted.append, clock=clock)
+    lru.set("a", 1)
+    lru.set("b", 2, expires_at=clock.now + 10)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert evicted == ["b"]
+    assert lru.keys() == ["a", "c"]
+
+    lru.set("d", 4, expires_at=clock.now + 10)
+    clock.now += 10
+    assert lru.get("d") is None
+    assert lru.keys() == ["c"]
+
+
+def test_memory_and_disk_tiers(cache):
+    namespace = cache.namespace("models", ttl=60, max_memory_items=1)
+    namespace.set("a", ["model-a"])
+    namespace.set("b", ["model-b"])
+
+    assert namespace.get("b") == ["model-b"]
+    # a was dropped from memory but is still found on disk, and promoted back to memory
+    assert namespace.get("a") == ["model-a"]
+    assert namespace.get("a") == ["model-a"]
+    assert namespace.get("c") is None
+    assert namespace.stats.model_dump() == {
+        "memory_hits": 2,
+        "disk_hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "memory_items": 1,
+    }
+    assert namespace.stats.hit_rate == pytest.approx(0.75)
+
+    # Same namespace survives a restart via the disk tier
+    restarted = TieredCache(cache.directory, cache.name).namespace("models", ttl=60)
+    assert sorted(restarted.keys()) == ["a", "b"]
+    assert restarted.get("b") == ["model-b"]
+
+
+def test_namespaces_are_separate(cache):
+    first = cache.namespace("first")
+    second = cache.namespace("second", persistent=False)
+    first.set("key", 1)
+    second.set("key", 2)
+    assert first.get("key") == 1
+    assert second.get("key") == 2
+    assert cache.namespace("first") is first
+
+    first.clear()
+    assert first.keys() == []
+    assert second.keys() == ["key"]
+
+
+def test_disk_size_limit(cache):
+    namespace = cache.namespace("rendered", max_memory_items=2, max_disk_items=10)
+    for i in range(11):
+        namespace.set(i, f"value {i}")
+    # Oldest items are evicted in a batch down to 90% of the limit
+    assert sorted(namespace.keys()) == list(range(2, 11))
+    assert namespace.stats.evictions == 2
+    assert namespace.get(0) is None
+
+    # Overwrites don't add to the size, namespace at the limit is not trimmed
+    namespace = cache.namespace("full", max_disk_items=10)
+    for i in range(10):
+        namespace.set(i, f"value {i}")
+    namespace.set(9, "new value 9")
+    assert sorted(namespace.keys()) == list(range(10))
+
+
+def test_expiry(tmp_path):
+    clock = FakeClock()
+    namespace = TieredCache(tmp_path.as_posix(), clock=clock).namespace("short", ttl=10, persistent=False)
+    namespace.set("key", "value")
+    namespace.set("other", "value", ttl=20)
+    clock.now += 10
+    assert namespace.get("key") is None
+    assert namespace.get("other") == "value"
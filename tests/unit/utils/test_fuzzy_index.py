@@ -0,0 +1,53 @@
+import time
+
+from paita.utils.fuzzy_index import FuzzyIndex, subsequence_score
+
+MODELS = [
+    ("AWS Bedrock", "anthropic.claude-3-5-sonnet-20240620-v1:0"),
+    ("AWS Bedrock", "anthropic.claude-3-haiku-20240307-v1:0"),
+    ("AWS Bedrock", "amazon.titan-text-express-v1"),
+    ("OpenAI", "gpt-4o"),
+    ("OpenAI", "gpt-4o-mini"),
+    ("Ollama", "llama3.1:8b"),
+    ("Ollama", "mistral:latest"),
+]
+
+
+def index() -> FuzzyIndex:
+    return FuzzyIndex(MODELS, key=lambda pair: pair[1])
+
+
+def test_subsequence_score():
+    assert subsequence_score("xyz", "gpt-4o") is None
+    # Word starts score higher than the same characters in the middle of words
+    assert subsequence_score("c35s", "claude-3-5-sonnet") > subsequence_score("c35s", "xc3x5xs")
+
+
+def test_substring_first():
+    assert index().search("gpt-4o") == [("OpenAI", "gpt-4o"), ("OpenAI", "gpt-4o-mini")]
+    assert index().search("sonnet")[0] == ("AWS Bedrock", "anthropic.claude-3-5-sonnet-20240620-v1:0")
+
+
+def test_subsequence_and_typos():
+    assert index().search("c35s")[0][1] == "anthropic.claude-3-5-sonnet-20240620-v1:0"
+    assert index().search("mistarl") == [("Ollama", "mistral:latest")]
+    assert index().search("zzzz") == []
+
+
+def test_type_ahead():
+    _index = index()
+    for length in range(1, len("haiku") + 1):
+        matches = _index.search("haiku"[:length], limit=3)
+    assert matches == [("AWS Bedrock", "anthropic.claude-3-haiku-20240307-v1:0")]
+    # Query that does not extend the previous one starts from all items again
+    assert _index.search("llama") == [("Ollama", "llama3.1:8b")]
+
+
+def test_search_is_fast():
+    models = [(f"service{i % 3}", f"vendor{i % 50}.model-{i}-v{i % 7}:0") for i in range(5000)]
+    _index = FuzzyIndex(models, key=lambda pair: pair[1])
+    start = time.perf_counter()
+    for length in range(1, len("vendor7.model-12") + 1):
+        _index.search("vendor7.model-12"[:length])
+    # Keystrokes on average well under a frame
+    assert (time.perf_counter() - start) / len("vendor7.model-12") < 0.05
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from paita.utils.profiler import IDLE, STREAMING, Profiler, percentile
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Widget:
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+
+    def render(self, duration: float) -> str:
+        self.clock.now += duration
+        return "rendered"
+
+    async def request(self, duration: float):
+        await asyncio.sleep(duration)
+
+
+def test_percentile():
+    assert percentile([], 0.95) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 0.5) == 2.0
+    assert percentile(list(range(100)), 0.95) == 95
+
+
+def test_phases_and_instrumented_calls():
+    clock = FakeClock()
+    profiler = Profiler(clock=clock)
+    with profiler.phase("settings load"):
+        clock.now += 0.25
+    widget = Widget(clock)
+
+    with profiler.recording():
+        profiler.instrument(Widget, "render", label="layout")
+        assert widget.render(0.01) == "rendered"
+        widget.render(0.03)
+    # Patches are removed once recording ends
+    widget.render(0.05)
+
+    assert profiler.phases == [("settings load", 0.25)]
+    assert profiler.timings["layout"] == pytest.approx([0.01, 0.03])
+    assert not hasattr(Widget.render, "__wrapped__")
+
+    summary = profiler.summary()
+    assert "settings load" in summary
+    assert "layout" in summary
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_during_requests():
+    profiler = Profiler()
+    widget = Widget(FakeClock())
+    with profiler.recording():
+        profiler.instrument(widget, "request", streaming=True)
+        sampler = asyncio.create_task(profiler.sample_loop(interval=0.001))
+        await asyncio.sleep(0.02)
+        await widget.request(0.02)
+        sampler.cancel()
+    assert "request" not in vars(widget)
+    assert len(profiler.timings["request"]) == 1
+    assert profiler.loop_lag[IDLE]
+    assert profiler.loop_lag[STREAMING]
+
+
+def test_write(tmp_path):
+    profiler = Profiler()
+    with profiler.recording():
+        profiler.add_phase("imports", 0.5)
+    profile_path, summary_path = profiler.write(str(tmp_path / "profiles"))
+    assert profile_path.suffix == ".prof"
+    assert profile_path.exists()
+    assert "imports" in summary_path.read_text(encoding="utf-8")
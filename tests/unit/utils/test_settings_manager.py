@@ -1,7 +1,7 @@
 import pytest
 
 from paita.llm.enums import AIService
-from paita.llm.services.service import LLMSettingsModel
+from paita.llm.services.service import DEFAULT_MAX_RETRIES, LLMSettingsModel
 from paita.settings.base_settings import delete
 from paita.settings.llm_settings import LLMSettings
 
@@ -36,3 +36,10 @@ async def test_save_load_local():
         assert loaded_manager.model == model
     finally:
         await delete(file_name=manager.FILE_NAME, app_name="paita_unit_tests", app_author="unit_test")
+
+
+def test_missing_max_retries_uses_default():
+    assert LLMSettingsModel(ai_max_retries=None).ai_max_retries == DEFAULT_MAX_RETRIES
+    assert LLMSettingsModel.model_validate_json('{"ai_max_retries": null}').ai_max_retries == DEFAULT_MAX_RETRIES
+    with pytest.raises(ValueError, match="greater than or equal to 0"):
+        LLMSettingsModel(ai_max_retries=-1)
@@ -68,3 +68,10 @@ def test_split_and_validate_invalid():
     split_sources = split_and_fix(sources)
     assert len(split_sources) == 3
     assert split_sources[0] == "http://aws.amazon.com"
+
+
+def test_split_and_validate_simple_host():
+    sources = "localhost:11434;gpu-1:11434"
+    assert split_and_fix(sources, simple_host=True) == ["http://localhost:11434", "http://gpu-1:11434"]
+    with pytest.raises(ValueError, match="Invalid URL"):
+        split_and_fix(sources)